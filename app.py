@@ -1,17 +1,40 @@
 import os
+import io
+import re
 import uuid
 import json
-import numpy as np
-import plotly.graph_objects as go
-import plotly.express as px
-from plotly.utils import PlotlyJSONEncoder
-from flask import Flask, render_template, redirect, request, jsonify, url_for, session, flash, abort
+import base64
+import time
+import zipfile
+import threading
+import mimetypes
+from flask import Flask, render_template, redirect, request, jsonify, url_for, session, flash, abort, send_file, \
+    stream_with_context
 from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash
-from models.style_controller import StyleTransferController
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
+from werkzeug.middleware.proxy_fix import ProxyFix
+from PIL import Image
 from datetime import datetime
 import sys
 from init_dirs import create_directories
+from boot import BootStep, boot
+from style_data import STYLE_PROPERTIES, STYLE_FEATURES
+import metrics
+import timing
+import profiling
+import fast_runtime
+import thread_budget
+from timing import stage
+from media_store import create_media_store
+import region
+import render_cache
+import live_preview
+import singleflight
+import scheduler
+import rate_limit
+import job_queue
+import checkpoint
+from video_transfer import SUPPORTED_VIDEO_EXTENSIONS, is_video_file, is_supported_video, probe_video, stylize_video
 
 # 导入数据库模块
 import sqlite3
@@ -38,26 +61,232 @@ except ImportError:
 app = Flask(__name__)
 app.secret_key = 'portrait_style_transfer_secret_key'
 
+# 请求耗时等运行指标，通过 /metrics 暴露
+metrics.init_app(app)
+# 分阶段耗时，通过Server-Timing响应头返回
+timing.init_app(app)
+# 管理员请求上的按需性能分析 (?_profile=1 或 ?_profile=sample)
+profiling.init_app(app)
+
 # 设置配置
 app.config['ORIGINAL_FOLDER'] = os.path.join('static', 'uploads', 'originals')
 app.config['RESULT_FOLDER'] = os.path.join('static', 'uploads', 'results')
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 限制上传文件大小为10MB
+app.config['MAX_BATCH_JOBS'] = 100  # 单次批量处理最多的 图片×风格 组合数
+app.config['VIDEO_WORKERS'] = 4  # 动图/视频并行处理的帧数
+app.config['VIDEO_FRAME_WINDOW'] = 8  # 内存中最多保留的帧数
+app.config['VIDEO_MAX_FRAMES'] = 600  # 最多处理的帧数
+app.config['VIDEO_DIFF_THRESHOLD'] = 2.0  # 与上一关键帧的平均灰度差小于该值时复用结果
+
+# 大图先在缩小的副本上风格化，再以原图为引导上采样回原尺寸（见guided_upsample.py）
+# 各引擎实际处理的像素比例，默认1.0（始终使用全分辨率），会降低大图的输出质量，需要时通过
+# 环境变量REDUCED_RES_FRACTION（例如0.25）开启；只对不小于REDUCED_RES_MIN_PIXELS的图像生效
+# fast只在启用模型池（FAST_MODEL_VARIANT等配置）时生效
+app.config['REDUCED_RES_FRACTION'] = {engine: float(os.environ.get('REDUCED_RES_FRACTION', 1.0))
+                                      for engine in ('simplified', 'fast')}
+app.config['REDUCED_RES_MIN_PIXELS'] = 4000000
+
+# 局部风格迁移: 裁剪时在区域外扩的边距和默认羽化半径（像素）
+app.config['REGION_PADDING'] = 16
+app.config['REGION_FEATHER'] = 8
+
+# 底图缓存: 只有确认引擎的强度/内容保留度/色彩增强等价于render_cache.apply_blend时才开启，
+# 否则每次都把实际参数交给引擎。BASE_CACHE_MEMORY为每个进程在内存中保留的已解码底图和原图的字节数，
+# 磁盘上的底图由gc_media.py回收
+app.config['BASE_CACHE_BLEND'] = os.environ.get('BASE_CACHE_BLEND', '0') == '1'
+app.config['BASE_CACHE_MEMORY'] = 256 * 1024 * 1024
+
+# 相同的 /process 请求在第一个完成后的若干秒内直接复用其结果
+app.config['DEDUP_SHARE_WINDOW'] = 30
+
+# 任务调度: 同时执行风格迁移的名额数（默认为核心数，至少2）和为实时预览预留的名额数
+app.config['SCHEDULER_WORKERS'] = int(os.environ.get('SCHEDULER_WORKERS') or max(2, os.cpu_count() or 1))
+app.config['SCHEDULER_RESERVED_INTERACTIVE'] = 1
+# 道内同时执行的任务数上限，None表示只受总名额限制
+app.config['SCHEDULER_LANE_LIMITS'] = {'preview': None, 'simplified': None, 'fast': None, 'neural': 1}
+# 公平排队时注册用户和匿名用户的权重，权重为2的用户得到的名额约为权重1的两倍
+app.config['SCHEDULER_WEIGHTS'] = {
+    'registered': float(os.environ.get('SCHEDULER_WEIGHT_REGISTERED', 1.0)),
+    'anonymous': float(os.environ.get('SCHEDULER_WEIGHT_ANONYMOUS', 1.0))
+}
+
+# 按计算代价限流: 每个用户和IP的令牌桶保存在database/rate_limit.db中，所有worker共享
+# 默认配额见rate_limit.DEFAULT_QUOTAS，管理员可以通过 /admin/quotas 修改，管理员自己不受限制
+app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+# 前面的反向代理层数（例如只有一层Nginx时为1）。为0时直接使用连接的对端地址，
+# 部署在代理后面时必须设置，否则所有匿名用户共用代理地址的令牌桶和公平排队
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+
+# 持久化任务队列: PROCESS_QUEUE=1 时 /process 只入队并返回202，由 worker.py 进程执行
+# （请求中的 "async": true/false 可以覆盖），worker每 租约/3 秒续约一次，租约过期的任务被重新领取
+app.config['PROCESS_QUEUE'] = os.environ.get('PROCESS_QUEUE', '0') == '1'
+app.config['JOB_LEASE_SECONDS'] = int(os.environ.get('JOB_LEASE_SECONDS', 60))
+app.config['JOB_MAX_ATTEMPTS'] = 3
+
+# 神经风格迁移（只能通过任务队列执行）: 迭代次数，以及保存检查点的迭代间隔和时间间隔（秒），0表示不按该条件保存
+app.config['NEURAL_STEPS'] = 300
+app.config['NEURAL_CHECKPOINT_STEPS'] = int(os.environ.get('NEURAL_CHECKPOINT_STEPS', 50))
+app.config['NEURAL_CHECKPOINT_SECONDS'] = int(os.environ.get('NEURAL_CHECKPOINT_SECONDS', 60))
+
+# 实时预览: 预览图的最长边、所有通道共用的并发渲染数、SSE/长轮询单次等待的秒数
+app.config['PREVIEW_MAX_SIDE'] = 512
+app.config['PREVIEW_WORKERS'] = 2
+app.config['PREVIEW_WAIT'] = 25
+
+# 媒体文件（原图/结果图）缓存与转发配置
+# 文件名包含UUID且内容不会改变，可以让浏览器和CDN长期缓存
+app.config['MEDIA_CACHE_MAX_AGE'] = 365 * 24 * 3600
+# 交给前端代理发送文件: None(由Flask发送) / 'x-sendfile'(Apache/lighttpd) / 'x-accel-redirect'(Nginx)
+app.config['MEDIA_ACCEL'] = os.environ.get('MEDIA_ACCEL') or None
+# Nginx中对应的internal location前缀，例如 location /protected_media/ { internal; alias /srv/portrait/static/uploads/; }
+app.config['MEDIA_ACCEL_PREFIX'] = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected_media')
+app.config['USE_X_SENDFILE'] = app.config['MEDIA_ACCEL'] == 'x-sendfile'
+
+# 从可信代理的X-Forwarded-For/-Proto/-Host中取得客户端的真实地址，限流和公平排队都按request.remote_addr区分
+if app.config['TRUSTED_PROXIES']:
+    hops = app.config['TRUSTED_PROXIES']
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops, x_host=hops)
+
+# 媒体存储后端，默认使用按哈希分片的本地目录
+app.config['MEDIA_STORE'] = os.environ.get('MEDIA_STORE', 'local')
+# 执行relayout_media.py迁移完旧文件后可以关闭，省去一次额外的文件检查
+app.config['MEDIA_LEGACY_FALLBACK'] = os.environ.get('MEDIA_LEGACY_FALLBACK', '1') == '1'
+
+# 快速迁移模型变体（需要先运行quantize_models.py生成int8模型），以下都使用默认值时使用风格控制器原有实现
+# FAST_MODEL_VARIANT: 所有风格默认使用的变体 fp32 / int8
+# FAST_MODEL_VARIANTS: 按风格覆盖，例如 'vangogh=int8,ink=fp32'
+app.config['FAST_MODEL_VARIANT'] = os.environ.get('FAST_MODEL_VARIANT') or None
+app.config['FAST_MODEL_VARIANTS'] = os.environ.get('FAST_MODEL_VARIANTS', '')
+# fp32模型的执行后端 eager / torchscript / onnx（需要先运行export_models.py导出）
+app.config['FAST_BACKEND'] = os.environ.get('FAST_BACKEND', 'eager')
+
+# 同一台机器上的worker数，设置后为每个worker分配 核心数/worker数 个torch/OpenMP/BLAS线程
+# 默认读取gunicorn的WEB_CONCURRENCY，0表示不限制（单进程开发服务器）
+app.config['THREAD_BUDGET_WORKERS'] = int(os.environ.get('THREAD_BUDGET_WORKERS') or
+                                          os.environ.get('WEB_CONCURRENCY') or 0)
+# 必须在导入numpy/torch之前设置线程数环境变量
+# 使用gunicorn.conf.py时post_fork钩子已经按worker编号分配（可选绑定核心），这里不再重复
+if app.config['THREAD_BUDGET_WORKERS'] and thread_budget.current() is None:
+    thread_budget.configure(app.config['THREAD_BUDGET_WORKERS'])
+
+# 可以通过/media路由访问的媒体类型
+MEDIA_KINDS = ('originals', 'results')
+
+# 媒体文件存储
+media_store = create_media_store(app.config)
+
+# 风格化底图缓存，只调整强度/内容保留度/色彩增强时跳过引擎
+base_cache = render_cache.BaseCache(media_store, memory_bytes=app.config['BASE_CACHE_MEMORY'])
+
+# 合并同时到达的相同 /process 请求，跨线程和worker进程只计算一次
+style_flights = singleflight.SingleFlight(share_window=app.config['DEDUP_SHARE_WINDOW'])
+
+# 按计算代价的用户/IP令牌桶
+rate_limiter = rate_limit.RateLimiter()
+
+# 按引擎分道、道内按用户公平排队的任务调度，实时预览使用预留名额
+# fast/neural道供风格控制器的快速迁移和神经风格迁移任务使用
+job_scheduler = scheduler.JobScheduler(
+    [
+        scheduler.Lane('preview', app.config['SCHEDULER_LANE_LIMITS']['preview'], interactive=True,
+                       default_duration=0.2),
+        scheduler.Lane('simplified', app.config['SCHEDULER_LANE_LIMITS']['simplified']),
+        scheduler.Lane('fast', app.config['SCHEDULER_LANE_LIMITS']['fast'], default_duration=0.1),
+        scheduler.Lane('neural', app.config['SCHEDULER_LANE_LIMITS']['neural'], default_duration=1200),
+    ],
+    workers=app.config['SCHEDULER_WORKERS'],
+    reserved=app.config['SCHEDULER_RESERVED_INTERACTIVE']
+)
+if app.config['THREAD_BUDGET_WORKERS'] > 1:
+    # 调度器和任务记录在每个进程中各有一份
+    print("警告: 多个worker进程时任务调度只在各自进程内公平排队，同步处理的任务只能由接收它的worker"
+          "通过 /jobs/<id> 查询；需要跨进程查询时设置 PROCESS_QUEUE=1 让 /process 经过共享的任务队列")
+
+# 风格迁移控制器会导入torch，首次使用或warm_up()时才初始化
+_style_controller = None
+_style_controller_loaded = False
+_style_controller_lock = threading.Lock()
+
+# 启动初始化推迟到第一个请求，导入app模块不再有文件系统操作
+_app_prepared = False
+_app_prepare_lock = threading.Lock()
+
+
+def get_style_controller():
+    """获取风格迁移控制器，第一次调用时导入并初始化"""
+    global _style_controller, _style_controller_loaded
+    if _style_controller_loaded:
+        return _style_controller
+
+    with _style_controller_lock:
+        if not _style_controller_loaded:
+            try:
+                from models.style_controller import StyleTransferController
+                _style_controller = StyleTransferController()
+                thread_budget.apply_torch()
+                pool = fast_runtime.create_model_pool(app.config)
+                if pool is not None:
+                    fast_runtime.attach_model_pool(_style_controller, pool,
+                                                   app.config['REDUCED_RES_FRACTION'].get('fast'),
+                                                   app.config['REDUCED_RES_MIN_PIXELS'])
+            except ImportError as e:
+                print(f"无法导入风格控制器: {e}")
+                _style_controller = None
+            _style_controller_loaded = True
+    return _style_controller
+
+
+def warm_up():
+    """预先加载重量级模块和风格控制器
+
+    适合在gunicorn的post_worker_init钩子或部署脚本中调用，
+    避免第一个用户请求承担加载时间。
+    """
+    start = time.perf_counter()
+    prepare_app()
+    import numpy  # noqa: F401
+    import plotly.graph_objects  # noqa: F401
+    from models import simplified_transfer  # noqa: F401
+    get_style_controller()
+    print(f"预热完成，耗时 {time.perf_counter() - start:.2f}秒")
+
+
+def boot_app():
+    """执行启动初始化（目录、数据库、风格预览），已是最新的步骤直接跳过"""
+    return boot(BOOT_STEPS)
+
+
+@app.before_request
+def prepare_app():
+    """每个进程只检查一次启动初始化
+
+    并发的第一批请求等待同一次初始化完成；初始化失败时返回503，下一个请求重试。
+    """
+    global _app_prepared
+    if _app_prepared:
+        return
+    with _app_prepare_lock:
+        if not _app_prepared:
+            if not boot_app():
+                abort(503)
+            _app_prepared = True
 
-# 确保所有必要目录存在
-create_directories()
 
-# 导入风格迁移控制器
-try:
-    style_controller = StyleTransferController()
-except ImportError as e:
-    print(f"无法导入风格控制器: {e}")
-    style_controller = None
+# 辅助函数
+def media_url(kind, filename):
+    """生成媒体文件的访问地址，模板中可直接使用 media_url('results', name)"""
+    return url_for('media', kind=kind, filename=filename)
+
+
+@app.context_processor
+def inject_media_url():
+    """向模板注入media_url辅助函数"""
+    return {'media_url': media_url}
 
 
-# 辅助函数
 def allowed_file(filename):
     """检查文件类型是否被允许"""
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'} | SUPPORTED_VIDEO_EXTENSIONS
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
@@ -85,6 +314,7 @@ def get_db_connection():
 def execute_query(conn, query, params=None, fetchall=False, commit=False):
     """执行数据库查询，支持MySQL和SQLite"""
     cursor = None
+    start = time.perf_counter()
     try:
         if USE_MYSQL:
             cursor = conn.cursor()
@@ -124,6 +354,13 @@ def execute_query(conn, query, params=None, fetchall=False, commit=False):
         # 如果是MySQL，需要关闭cursor
         if USE_MYSQL and cursor:
             cursor.close()
+        metrics.DB_QUERY_LATENCY.observe(time.perf_counter() - start, statement=metrics.statement_label(query))
+
+
+# 保存在应用数据库中的任务队列，由worker.py领取执行
+style_job_queue = job_queue.JobQueue(get_db_connection, execute_query,
+                                     lease_seconds=app.config['JOB_LEASE_SECONDS'],
+                                     max_attempts=app.config['JOB_MAX_ATTEMPTS'])
 
 
 # 初始化数据库
@@ -148,6 +385,8 @@ def init_db():
                 print("已创建默认管理员账户 (用户名: admin, 密码: admin123)")
 
             conn.commit()
+            # 独立worker使用的任务队列表
+            job_queue.create_table(conn, mysql=True)
             conn.close()
             print("MySQL数据库检查成功")
             return True
@@ -227,6 +466,8 @@ def init_db():
                 print("已创建默认管理员账户 (用户名: admin, 密码: admin123)")
 
             conn.commit()
+            # 独立worker使用的任务队列表
+            job_queue.create_table(conn)
             conn.close()
             print("SQLite数据库初始化成功")
             return True
@@ -235,6 +476,27 @@ def init_db():
             return False
 
 
+def create_default_style_previews():
+    """生成内置风格的预览图像"""
+    from create_style_previews import create_all_style_previews
+    create_all_style_previews()
+
+
+BUILTIN_STYLES = ['vangogh', 'picasso', 'ink', 'impression', 'pop']
+
+BOOT_STEPS = [
+    BootStep('directories', create_directories, sources=[create_directories],
+             outputs=['static/uploads/temp', 'templates/admin', 'static/img/avatars/default.png']),
+    BootStep('database', init_db, sources=[init_db],
+             outputs=[] if USE_MYSQL else ['database/portrait.db'],
+             params={'host': DB_CONFIG['host'], 'db': DB_CONFIG['db']} if USE_MYSQL else 'sqlite'),
+    BootStep('style_previews', create_default_style_previews,
+             sources=[os.path.join(app.root_path, 'create_style_previews.py')],
+             outputs=[os.path.join('static', 'img', 'styles', f'{style}.jpg') for style in BUILTIN_STYLES],
+             required=False),
+]
+
+
 # 路由定义
 @app.route('/')
 def index():
@@ -494,13 +756,8 @@ def upload_file():
         print(f"上传的文件: {file.filename}")
         filename = secure_filename(f"{uuid.uuid4()}_{file.filename}")
 
-        # 确保目录存在
-        uploads_dir = os.path.join('static', 'uploads', 'originals')
-        os.makedirs(uploads_dir, exist_ok=True)
-
         # 保存文件
-        file_path = os.path.join(uploads_dir, filename)
-        file.save(file_path)
+        file_path = media_store.save('originals', filename, file)
         print(f"文件已保存到: {file_path}")
 
         # 如果用户已登录，记录上传历史
@@ -517,14 +774,319 @@ def upload_file():
         return jsonify({
             'success': True,
             'filename': filename,
-            'preview_url': url_for('static', filename=f'uploads/originals/{filename}')
+            'preview_url': media_url('originals', filename)
         })
 
     print(f"不支持的文件格式: {file.filename}")
     return jsonify({'error': '不支持的文件格式'}), 400
 
 
+# 媒体文件访问
+@app.route('/media/<kind>/<path:filename>')
+def media(kind, filename):
+    """发送原图或结果图，带长期缓存头、强ETag并支持Range请求
+
+    配置MEDIA_ACCEL后只返回转发头，由前端代理直接发送文件内容，
+    Python进程不再读取和传输图片数据。
+    """
+    if kind not in MEDIA_KINDS or safe_join(kind, filename) is None:
+        abort(404)
+
+    relative_path, file_path = media_store.locate(kind, filename)
+    if file_path is None:
+        abort(404)
+
+    max_age = app.config['MEDIA_CACHE_MAX_AGE']
+
+    if app.config['MEDIA_ACCEL'] == 'x-accel-redirect':
+        # Nginx负责ETag、Range和文件传输
+        response = app.response_class()
+        response.headers['X-Accel-Redirect'] = (
+            f"{app.config['MEDIA_ACCEL_PREFIX'].rstrip('/')}/{kind}/{relative_path.replace(os.sep, '/')}"
+        )
+        response.headers['Content-Type'] = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    else:
+        # conditional=True 会处理 If-None-Match / If-Modified-Since / Range
+        # USE_X_SENDFILE 打开时werkzeug只返回X-Sendfile头
+        response = send_file(os.path.abspath(file_path), conditional=True, etag=True, max_age=max_age)
+
+    response.headers['Cache-Control'] = f'public, max-age={max_age}, immutable'
+    return response
+
+
+@app.route('/static/uploads/<any(originals, results):kind>/<filename>')
+def legacy_media(kind, filename):
+    """旧的平铺静态地址（模板中的 url_for('static', filename='uploads/...')）
+
+    新文件按哈希分片存放，旧地址找不到文件，统一重定向到 /media。
+    """
+    return redirect(url_for('media', kind=kind, filename=filename), code=301)
+
+
+# 前端生成的实时预览通道id、任务id
+CLIENT_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+
+def client_id(value, required=True):
+    """校验前端生成的id，没有提供且不是必需时返回None"""
+    if not value and not required:
+        return None
+    if not value or not CLIENT_ID_PATTERN.match(value):
+        abort(400)
+    return value
+
+
+def job_owner():
+    """公平排队时区分用户: 登录用户按用户id，匿名用户按IP"""
+    if 'user_id' in session:
+        return f"user:{session['user_id']}"
+    return f"ip:{request.remote_addr}"
+
+
+def job_weight():
+    """公平排队时的用户权重，见SCHEDULER_WEIGHTS"""
+    return app.config['SCHEDULER_WEIGHTS']['registered' if 'user_id' in session else 'anonymous']
+
+
+def rate_limit_buckets():
+    """当前请求需要扣除的令牌桶: 用户（匿名用户按IP）和IP各一个，管理员不限流"""
+    if not app.config['RATE_LIMIT_ENABLED'] or session.get('is_admin'):
+        return []
+    ip = request.remote_addr
+    if 'user_id' in session:
+        user_bucket = (f"user:{session['user_id']}", [f"user:{session['user_id']}", 'registered'])
+    else:
+        user_bucket = (f'anon:{ip}', ['anonymous'])
+    return [user_bucket, (f'ip:{ip}', [f'ip:{ip}', 'ip'])]
+
+
+def charge_compute(buckets, engine, megapixels, styles, items=1):
+    """按计算代价扣除令牌，不足时抛出RateLimitExceeded"""
+    if buckets:
+        rate_limiter.charge(buckets, rate_limit.estimate_cost(engine, megapixels, styles, items))
+
+
+def rate_limited(e):
+    """令牌不足时的429响应，单次请求就超过配额上限、等待也无法执行时返回413"""
+    response = jsonify({'error': str(e), 'cost': e.cost, 'retry_after': e.retry_after})
+    response.status_code = 429 if e.retry_after is not None else 413
+    if e.retry_after is not None:
+        response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+
+def image_megapixels(path):
+    with Image.open(path) as img:
+        return img.width * img.height / 1e6
+
+
 # 风格迁移处理
+def parse_style_params(data):
+    """从请求数据中解析风格迁移参数"""
+    return {
+        'styles': data.get('styles', []),
+        'weights': data.get('weights', []),
+        'style_strength': float(data.get('styleStrength', 0.8)),
+        'content_weight': float(data.get('contentWeight', 0.2)),
+        'color_enhance': bool(data.get('colorEnhance', False))
+    }
+
+
+def render_base(content_img_path, params, base=None, output_path=None):
+    """运行引擎生成风格化图像，返回文件路径，未能生成时返回None
+
+    base: 传给引擎的强度/内容保留度/色彩增强，默认使用params中的实际参数；
+    生成缓存用的未混合底图时传入render_cache.BASE_PARAMS。
+    output_path: 引擎输出的位置，默认写在临时目录。
+    """
+    # 使用简化的风格迁移处理
+    from models.simplified_transfer import apply_style, multi_style_fusion
+    import guided_upsample
+
+    styles = params['styles']
+    base = base or params
+    base_path = output_path or media_store.new_path('temp', f"base_{uuid.uuid4()}.jpg")
+
+    # 大图在缩小的副本上风格化
+    reduced_size = guided_upsample.plan_reduction(content_img_path,
+                                                  app.config['REDUCED_RES_FRACTION'].get('simplified'),
+                                                  app.config['REDUCED_RES_MIN_PIXELS'])
+    engine_input = content_img_path
+    if reduced_size is not None:
+        with stage('downscale'):
+            engine_input = media_store.new_path('temp', f"reduced_{uuid.uuid4()}.jpg")
+            guided_upsample.save_downscaled(content_img_path, engine_input, reduced_size)
+
+    try:
+        # 单风格或多风格处理
+        # 简化引擎（models/simplified_transfer.py）内部的解码、缩放、混合和编码没有单独计时，
+        # 都计入stylize-*阶段；引擎内部可以通过timing.stage继续记录这些阶段
+        if len(styles) == 1:
+            with stage(f'stylize-{styles[0]}'):
+                apply_style(engine_input, styles[0], base_path,
+                            base['style_strength'], base['content_weight'], base['color_enhance'])
+        else:
+            with stage(f"stylize-{'+'.join(styles)}"):
+                fusion_filename = multi_style_fusion(engine_input, styles, params['weights'],
+                                                     base['style_strength'], base['content_weight'],
+                                                     base['color_enhance'])
+            # 多风格融合直接返回结果文件名，不是完整路径，文件写在平铺的结果目录中
+            if fusion_filename.startswith('uploads/results/'):
+                fusion_filename = fusion_filename[len('uploads/results/'):]
+            fusion_path = os.path.join(app.config['RESULT_FOLDER'], fusion_filename)
+            if os.path.exists(fusion_path):
+                os.replace(fusion_path, base_path)
+    finally:
+        if engine_input != content_img_path and os.path.exists(engine_input):
+            os.remove(engine_input)
+
+    # 检查结果文件是否存在
+    if not os.path.exists(base_path):
+        print(f"警告: 结果文件不存在: {base_path}")
+        return None
+
+    if reduced_size is not None:
+        # 以原图为引导恢复全分辨率的边缘
+        with stage('upsample'):
+            guided_upsample.upsample_file(content_img_path, base_path)
+    return base_path
+
+
+def stylize_image(content_img_path, params, report=None, use_cache=True):
+    """执行一次风格迁移，返回结果图像（PIL），未能生成时返回None
+
+    开启BASE_CACHE_BLEND时底图按 (原图内容, 风格组合) 缓存，只改变风格强度、内容保留度或色彩增强时
+    跳过引擎，只重新混合。report不为None时写入复用(reused)和重新计算(computed)的阶段。
+    视频帧等不会重复处理的输入可以传入use_cache=False。
+    """
+    if not (use_cache and app.config['BASE_CACHE_BLEND']):
+        # 引擎直接使用实际参数，结果需要以图像返回（如视频帧），写入结果目录的请求见run_style_job
+        result_path = render_base(content_img_path, params)
+        if result_path is None:
+            return None
+        with Image.open(result_path) as img:
+            result = img.convert('RGB')
+        os.remove(result_path)
+        if report is not None:
+            report['reused'] = []
+            report['computed'] = ['stylize']
+        return result
+
+    with stage('base-cache'):
+        key = render_cache.base_key(content_img_path, params['styles'], params['weights'])
+        entry = base_cache.get(key, content_img_path)
+    reused = entry is not None
+    if entry is None:
+        base_path = render_base(content_img_path, params, render_cache.BASE_PARAMS)
+        if base_path is None:
+            return None
+        entry = base_cache.put(key, content_img_path, base_path)
+
+    with stage('blend'):
+        result = render_cache.apply_blend(entry.original, entry.base, params)
+    if report is not None:
+        report['reused'] = ['stylize'] if reused else []
+        report['computed'] = ['blend'] if reused else ['stylize', 'blend']
+    return result
+
+
+def style_label(styles):
+    """指标中的风格标签: 已知的单一风格用风格名，多风格融合为fusion，其他为other，避免客户端输入产生无限多的标签"""
+    if len(styles) > 1:
+        return 'fusion'
+    if len(styles) == 1 and styles[0] in STYLE_PROPERTIES:
+        return styles[0]
+    return 'other'
+
+
+def run_style_job(content_img_path, params, report=None, use_cache=True):
+    """执行一次风格迁移并写入结果目录，返回结果文件名，未能生成结果图像时返回None"""
+    start = time.perf_counter()
+    # 生成唯一输出文件名
+    result_filename = f"result_{uuid.uuid4()}.jpg"
+
+    if use_cache and app.config['BASE_CACHE_BLEND']:
+        result = stylize_image(content_img_path, params, report, use_cache)
+        if result is None:
+            return None
+        with stage('write'):
+            result_path = media_store.new_path('results', result_filename)
+            result.save(result_path, quality=95)
+    else:
+        # 不使用底图缓存时引擎直接写入结果目录，避免再解码和重新编码一次JPEG
+        result_path = render_base(content_img_path, params,
+                                  output_path=media_store.new_path('results', result_filename))
+        if result_path is None:
+            return None
+        if report is not None:
+            report['reused'] = []
+            report['computed'] = ['stylize']
+    result_size = os.path.getsize(result_path)
+
+    metrics.STYLE_JOB_DURATION.observe(time.perf_counter() - start, engine='simplified',
+                                       style=style_label(params['styles']))
+    metrics.RESULT_BYTES_WRITTEN.inc(result_size)
+    return result_filename
+
+
+def run_fast_job(content_img_path, params, report=None):
+    """用快速迁移（TransformerNet，启用时经过模型池和导出的后端）处理单一风格，返回结果文件名"""
+    controller = get_style_controller()
+    fast = getattr(controller, 'fast_style_transfer', None)
+    if fast is None:
+        raise RuntimeError('快速风格迁移不可用')
+
+    start = time.perf_counter()
+    style = params['styles'][0]
+    result_filename = f"result_{uuid.uuid4()}.jpg"
+    with stage(f'stylize-{style}'):
+        fast(content_img_path, style, media_store.new_path('results', result_filename))
+    result_path = media_store.path('results', result_filename)
+    if result_path is None:
+        return None
+
+    metrics.STYLE_JOB_DURATION.observe(time.perf_counter() - start, engine='fast', style=style_label(params['styles']))
+    metrics.RESULT_BYTES_WRITTEN.inc(os.path.getsize(result_path))
+    if report is not None:
+        report['reused'] = []
+        report['computed'] = ['stylize']
+    return result_filename
+
+
+def run_region_job(content_img_path, params, plan, report=None):
+    """只对区域的包围框做风格迁移，再按羽化蒙版贴回原图，返回结果文件名"""
+    with stage('crop'):
+        crop_path = media_store.new_path('temp', f"region_{uuid.uuid4()}.jpg")
+        region.save_crop(content_img_path, crop_path, plan)
+    try:
+        result_filename = run_style_job(crop_path, params, report)
+    finally:
+        os.remove(crop_path)
+    if result_filename is None:
+        return None
+
+    with stage('composite'):
+        result_path = media_store.path('results', result_filename)
+        region.composite(content_img_path, result_path, result_path, plan)
+    return result_filename
+
+
+def record_result(conn, user_id, original_image, result_filename, params, commit=True):
+    """记录用户的处理历史"""
+    execute_query(conn, '''
+        INSERT INTO user_results 
+        (user_id, original_image, result_image, styles, parameters, create_date) 
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (
+        user_id,
+        original_image,
+        result_filename,
+        ','.join(params['styles']),
+        f"强度:{params['style_strength']},内容:{params['content_weight']},色彩增强:{params['color_enhance']}",
+        datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    ), commit=commit)
+
+
 @app.route('/process', methods=['POST'])
 def process_image():
     print("接收到处理请求")
@@ -533,101 +1095,562 @@ def process_image():
         print(f"请求数据: {data}")
 
         original_image = data.get('image')
-        styles = data.get('styles', [])
-        style_weights = data.get('weights', [])
-        style_strength = float(data.get('styleStrength', 0.8))
-        content_weight = float(data.get('contentWeight', 0.2))
-        color_enhance = bool(data.get('colorEnhance', False))
-
-        if not original_image or not styles:
+        params = parse_style_params(data)
+        # 前端可以预先生成任务id，处理期间通过 /jobs/<id> 查询排队位置
+        job_id = client_id(data.get('jobId'), required=False)
+        engine = data.get('engine', 'simplified')
+        if engine not in ('simplified', 'fast', 'neural'):
+            return jsonify({'error': f'不支持的引擎: {engine}'}), 400
+        if engine == 'neural' and 'user_id' not in session:
+            # 最小的神经风格迁移任务也超过匿名用户的配额上限，直接拒绝而不是返回无法重试的429
+            return jsonify({'error': '神经风格迁移需要登录'}), 403
+
+        if not original_image or not params['styles']:
             print("缺少必要参数")
             return jsonify({'error': '缺少必要参数'}), 400
 
-        print(f"处理图像: {original_image}, 风格: {styles}")
+        if is_video_file(original_image):
+            return jsonify({'error': '动图和视频请使用 /process_video 处理'}), 400
+
+        # 可选的局部区域（roi矩形或上传的蒙版）
+        try:
+            region_spec = region.parse_region(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        mask_path = None
+        if region_spec is not None and region_spec['mask']:
+            mask_path = media_store.path('originals', region_spec['mask'])
+            if mask_path is None:
+                return jsonify({'error': '找不到蒙版图像'}), 404
+
+        if engine == 'neural' and region_spec is not None:
+            return jsonify({'error': '神经风格迁移不支持局部区域'}), 400
+        if engine == 'fast' and (region_spec is not None or len(params['styles']) != 1):
+            # 每个快速迁移模型只对应一种风格，不做融合和局部处理
+            return jsonify({'error': '快速风格迁移只支持单一风格的整图处理'}), 400
+
+        print(f"处理图像: {original_image}, 风格: {params['styles']}")
 
         # 处理图像风格迁移
-        content_img_path = os.path.join(app.config['ORIGINAL_FOLDER'], original_image)
-        if not os.path.exists(content_img_path):
-            print(f"找不到原始图像: {content_img_path}")
+        with stage('read'):
+            content_img_path = media_store.path('originals', original_image)
+        if content_img_path is None:
+            print(f"找不到原始图像: {original_image}")
             return jsonify({'error': '找不到原始图像'}), 404
 
-        # 使用简化的风格迁移处理
-        from models.simplified_transfer import apply_style, multi_style_fusion
+        plan = None
+        if region_spec is not None:
+            try:
+                with stage('mask'):
+                    plan = region.plan_region(content_img_path, region_spec, mask_path,
+                                              app.config['REGION_PADDING'], app.config['REGION_FEATHER'])
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+
+        report = {}
+        owner = job_owner()
+        weight = job_weight()
+        buckets = rate_limit_buckets()
+        if plan is None:
+            megapixels = image_megapixels(content_img_path)
+        else:
+            megapixels = plan.size[0] * plan.size[1] / 1e6
+        # 道内按计算代价公平排队，与计费使用相同的估计
+        cost = rate_limit.estimate_cost(engine, megapixels, len(params['styles']))
+
+        if engine == 'neural':
+            # 神经风格迁移需要几十分钟，总是交给worker执行，可以从检查点继续
+            charge_compute(buckets, 'neural', megapixels, len(params['styles']))
+            job_id = style_job_queue.enqueue('neural', {
+                'image': original_image,
+                'params': params,
+                'user_id': session.get('user_id')
+            }, lane='neural', owner=owner, job_id=job_id)
+            return jsonify({'success': True, 'job_id': job_id,
+                            'status_url': url_for('job_status', job_id=job_id)}), 202
+
+        if data.get('async', app.config['PROCESS_QUEUE']):
+            # 交给worker进程执行，参数已经在这里校验过
+            charge_compute(buckets, engine, megapixels, len(params['styles']))
+            job_id = style_job_queue.enqueue('process', {
+                'image': original_image,
+                'engine': engine,
+                'params': params,
+                'region': region_spec,
+                'user_id': session.get('user_id')
+            }, lane=engine, owner=owner, job_id=job_id)
+            return jsonify({'success': True, 'job_id': job_id,
+                            'status_url': url_for('job_status', job_id=job_id)}), 202
+
+        def compute():
+            # 合并的重复请求不计费，只有实际计算的请求扣除令牌
+            charge_compute(buckets, engine, megapixels, len(params['styles']))
+            if engine == 'fast':
+                return job_scheduler.run('fast', owner, run_fast_job, content_img_path, params, report,
+                                         cost=cost, weight=weight, job_id=job_id)
+            if plan is None:
+                return job_scheduler.run('simplified', owner, run_style_job, content_img_path, params, report,
+                                         cost=cost, weight=weight, job_id=job_id)
+            return job_scheduler.run('simplified', owner, run_region_job, content_img_path, params, plan, report,
+                                     cost=cost, weight=weight, job_id=job_id)
+
+        # 相同原图和参数的请求只计算一次，其他请求等待并复用结果文件
+        with stage('dedup'):
+            key = singleflight.job_key(
+                'process' if engine == 'simplified' else f'process-{engine}',
+                render_cache.file_digest(content_img_path), params, region_spec,
+                render_cache.file_digest(mask_path) if mask_path else None)
+        result_filename, shared = style_flights.run(key, compute)
+        if shared and media_store.path('results', result_filename) is None:
+            # 共享的结果已经被删除
+            result_filename, shared = compute(), False
+        if shared:
+            report = {'reused': ['stylize', 'blend'], 'computed': []}
+        if result_filename is None:
+            return jsonify({'error': '处理失败：无法生成结果图像'}), 500
 
-        # 生成唯一输出文件名
-        result_filename = f"result_{uuid.uuid4()}.jpg"
-        result_path = os.path.join(app.config['RESULT_FOLDER'], result_filename)
+        print(f"处理完成，结果文件: {result_filename}")
 
-        # 保存结果图像
-        if not os.path.exists(os.path.dirname(result_path)):
-            os.makedirs(os.path.dirname(result_path), exist_ok=True)
+        # 如果用户已登录，记录处理历史
+        if 'user_id' in session:
+            with stage('db'):
+                conn = get_db_connection()
+                record_result(conn, session['user_id'], original_image, result_filename, params)
+                conn.close()
 
-        # 确保目录存在
-        os.makedirs(app.config['RESULT_FOLDER'], exist_ok=True)
+        # 返回成功响应
+        return jsonify({
+            'success': True,
+            'result_url': media_url('results', result_filename),
+            'reused': report['reused'],
+            'computed': report['computed'],
+            'shared': shared
+        })
 
-        # 单风格或多风格处理
-        if len(styles) == 1:
-            apply_style(
-                content_img_path,
-                styles[0],
-                result_path,
-                style_strength,
-                content_weight,
-                color_enhance
-            )
-        else:
-            result_filename = multi_style_fusion(
-                content_img_path,
-                styles,
-                style_weights,
-                style_strength,
-                content_weight,
-                color_enhance
-            )
-            # 多风格融合直接返回结果文件名，不是完整路径
-            # 确保结果文件名是相对于static目录的路径
-            if not result_filename.startswith('uploads/results/'):
-                result_path = os.path.join(app.config['RESULT_FOLDER'], result_filename)
-            else:
-                result_path = os.path.join('static', result_filename)
+    except rate_limit.RateLimitExceeded as e:
+        return rate_limited(e)
+    except Exception as e:
+        print(f"处理图像时出错: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': f'处理失败: {str(e)}'}), 500
 
-        # 检查结果文件是否存在
-        if not os.path.exists(result_path):
-            print(f"警告: 结果文件不存在: {result_path}")
-            return jsonify({'error': '处理失败：无法生成结果图像'}), 500
 
-        print(f"处理完成，结果文件: {result_filename}")
+# 拖动滑块时的实时预览
+def preview_source(content_img_path):
+    """原图缩小到PREVIEW_MAX_SIDE的副本，按原图内容缓存在临时目录，同一张图的预览都复用它和它的底图"""
+    max_side = app.config['PREVIEW_MAX_SIDE']
+    name = f"preview_{render_cache.file_digest(content_img_path)}_{max_side}.jpg"
+    path = media_store.path('temp', name)
+    if path is not None:
+        return path
+    with Image.open(content_img_path) as img:
+        width, height = img.size
+    scale = max_side / max(width, height)
+    if scale >= 1:
+        return content_img_path
+    import guided_upsample
+
+    path = media_store.new_path('temp', name)
+    tmp_path = f"{path[:-4]}.{uuid.uuid4().hex}.jpg"
+    guided_upsample.save_downscaled(content_img_path, tmp_path,
+                                    (max(1, round(width * scale)), max(1, round(height * scale))))
+    # 并发的预览可能同时生成，用rename保证读到的总是完整文件
+    os.replace(tmp_path, path)
+    return path
+
+
+def render_live_preview(job):
+    """在预览线程中渲染一组参数，预览图直接以data URL返回，不写入结果目录"""
+    content_img_path, params, owner, weight, buckets = job
+    source = preview_source(content_img_path)
+    megapixels = image_megapixels(source)
+    # 被合并丢弃的参数不计费，只在实际渲染时扣除令牌
+    try:
+        charge_compute(buckets, 'simplified', megapixels, len(params['styles']))
+    except rate_limit.RateLimitExceeded as e:
+        return {'error': str(e), 'retry_after': e.retry_after}
+    report = {}
+    result = job_scheduler.run('preview', owner, stylize_image, source, params, report,
+                               cost=rate_limit.estimate_cost('simplified', megapixels, len(params['styles'])),
+                               weight=weight)
+    if result is None:
+        raise RuntimeError('无法生成预览图像')
+    buf = io.BytesIO()
+    result.save(buf, 'JPEG', quality=80)
+    return {
+        'image': 'data:image/jpeg;base64,' + base64.b64encode(buf.getvalue()).decode('ascii'),
+        'reused': report['reused'],
+        'computed': report['computed']
+    }
+
+
+preview_hub = live_preview.PreviewHub(render_live_preview, workers=app.config['PREVIEW_WORKERS'])
+
+
+@app.route('/preview', methods=['POST'])
+def submit_preview():
+    """提交实时预览的最新参数，参数与 /process 相同，另需 channel（前端生成的8~64位id）
+
+    立即返回版本号，未开始的旧参数被替换，不再渲染。结果通过 /preview/stream 或 /preview/poll 获取。
+    """
+    data = request.json or {}
+    channel_id = client_id(data.get('channel'))
+    original_image = data.get('image')
+    params = parse_style_params(data)
+    if not original_image or not params['styles']:
+        return jsonify({'error': '缺少必要参数'}), 400
+    if is_video_file(original_image):
+        return jsonify({'error': '动图和视频不支持实时预览'}), 400
+
+    content_img_path = media_store.path('originals', original_image)
+    if content_img_path is None:
+        return jsonify({'error': '找不到原始图像'}), 404
+
+    version = preview_hub.submit(channel_id, (content_img_path, params, job_owner(), job_weight(), rate_limit_buckets()))
+    return jsonify({'success': True, 'version': version}), 202
+
+
+@app.route('/preview/stream')
+def stream_preview():
+    """以Server-Sent Events推送通道的最新预览，每条事件的id为版本号
+
+    浏览器断线重连时通过Last-Event-ID从上次收到的版本之后继续。
+    """
+    channel_id = client_id(request.args.get('channel'))
+    after = request.headers.get('Last-Event-ID') or request.args.get('after') or 0
+    try:
+        after = int(after)
+    except ValueError:
+        abort(400)
+    wait = app.config['PREVIEW_WAIT']
+
+    def generate():
+        nonlocal after
+        yield 'retry: 1000\n\n'
+        while True:
+            latest = preview_hub.wait(channel_id, after, wait)
+            if latest is None:
+                # 注释行保持连接，代理不会因为空闲断开
+                yield ': keep-alive\n\n'
+                continue
+            after, payload = latest
+            yield f"id: {after}\nevent: preview\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    response = app.response_class(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # 关闭Nginx对这个响应的缓冲
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/preview/poll')
+def poll_preview():
+    """长轮询: 等待版本号大于after的预览，超时返回204"""
+    channel_id = client_id(request.args.get('channel'))
+    after = request.args.get('after', 0, type=int)
+    latest = preview_hub.wait(channel_id, after, app.config['PREVIEW_WAIT'])
+    if latest is None:
+        return '', 204
+    version, payload = latest
+    return jsonify(dict(payload, version=version))
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """查询任务的状态、排队位置（position）和预计开始时间（estimated_start，秒）
+
+    本进程中调度的任务来自调度器，交给worker的任务来自任务队列，完成后包含result_url。
+    """
+    info = job_scheduler.status(job_id)
+    if info is None:
+        info = style_job_queue.status(job_id)
+    if info is None:
+        return jsonify({'error': '找不到任务'}), 404
+    result = info.pop('result', None)
+    if result and result.get('result_filename'):
+        info['result_url'] = media_url('results', result['result_filename'])
+    return jsonify(info)
+
+
+def run_queued_process(payload, job_id, control):
+    """在worker进程中执行 /process 入队的任务，返回结果文件名"""
+    content_img_path = media_store.path('originals', payload['image'])
+    if content_img_path is None:
+        raise FileNotFoundError(f"找不到原始图像: {payload['image']}")
+    params = payload['params']
+    region_spec = payload['region']
+
+    if payload.get('engine') == 'fast':
+        result_filename = run_fast_job(content_img_path, params)
+    elif region_spec is None:
+        result_filename = run_style_job(content_img_path, params)
+    else:
+        mask_path = media_store.path('originals', region_spec['mask']) if region_spec['mask'] else None
+        plan = region.plan_region(content_img_path, region_spec, mask_path,
+                                  app.config['REGION_PADDING'], app.config['REGION_FEATHER'])
+        result_filename = run_region_job(content_img_path, params, plan)
+    if result_filename is None:
+        raise RuntimeError('无法生成结果图像')
+
+    if payload.get('user_id') is not None:
+        conn = get_db_connection()
+        record_result(conn, payload['user_id'], payload['image'], result_filename, params)
+        conn.close()
+    return {'result_filename': result_filename}
+
+
+def run_queued_neural(payload, job_id, control):
+    """在worker进程中执行神经风格迁移，定期保存检查点，任务被重新领取时从检查点继续"""
+    import inspect
+
+    content_img_path = media_store.path('originals', payload['image'])
+    if content_img_path is None:
+        raise FileNotFoundError(f"找不到原始图像: {payload['image']}")
+    controller = get_style_controller()
+    neural = getattr(controller, 'neural_style_transfer', None)
+    if neural is None:
+        raise RuntimeError('风格控制器没有neural_style_transfer方法')
+
+    params = payload['params']
+    # 检查点以任务id命名，保存在共享存储上，任何worker重新领取都能找到
+    checkpointer = checkpoint.Checkpointer(media_store.new_path('checkpoints', f'{job_id}.pt'),
+                                           every_steps=app.config['NEURAL_CHECKPOINT_STEPS'],
+                                           every_seconds=app.config['NEURAL_CHECKPOINT_SECONDS'],
+                                           control=control)
+    kwargs = {'num_steps': app.config['NEURAL_STEPS']}
+    if 'checkpoint' in inspect.signature(neural).parameters:
+        kwargs['checkpoint'] = checkpointer
+    else:
+        print("neural_style_transfer不接受checkpoint参数，本次运行无法断点续算")
+
+    result_filename = f"result_{uuid.uuid4()}.jpg"
+    start = time.perf_counter()
+    neural(content_img_path, params['styles'], media_store.new_path('results', result_filename), **kwargs)
+    if media_store.path('results', result_filename) is None:
+        raise RuntimeError('无法生成结果图像')
+    # 租约已丢失时任务属于接管它的worker，不能删除它正在使用的检查点或重复记录结果
+    checkpointer.check()
+    checkpointer.clear()
+    metrics.STYLE_JOB_DURATION.observe(time.perf_counter() - start, engine='neural', style=style_label(params['styles']))
+
+    if payload.get('user_id') is not None:
+        conn = get_db_connection()
+        record_result(conn, payload['user_id'], payload['image'], result_filename, params)
+        conn.close()
+    return {'result_filename': result_filename, 'checkpoint': checkpointer.stats()}
+
+
+# worker.py按任务类型调用的处理函数，参数为 (任务数据, 任务id, job_queue.JobControl)
+QUEUED_JOB_HANDLERS = {
+    'process': run_queued_process,
+    'neural': run_queued_neural,
+}
+
+
+# 动图/视频风格迁移
+@app.route('/process_video', methods=['POST'])
+def process_video():
+    """对上传的GIF或短视频逐帧做风格迁移，参数与 /process 相同"""
+    print("接收到视频处理请求")
+    try:
+        data = request.json
+        original_video = data.get('image')
+        params = parse_style_params(data)
+
+        if not original_video or not params['styles']:
+            return jsonify({'error': '缺少必要参数'}), 400
+
+        if not is_video_file(original_video):
+            return jsonify({'error': '不支持的动图/视频格式'}), 400
+        if not is_supported_video(original_video):
+            return jsonify({'error': '处理视频需要安装imageio和imageio-ffmpeg'}), 400
+
+        content_path = media_store.path('originals', original_video)
+        if content_path is None:
+            return jsonify({'error': '找不到原始文件'}), 404
+
+        # 按最多处理的帧数预先计费
+        (width, height), frame_count = probe_video(content_path)
+        frame_count = min(frame_count or app.config['VIDEO_MAX_FRAMES'], app.config['VIDEO_MAX_FRAMES'])
+        charge_compute(rate_limit_buckets(), 'simplified', width * height / 1e6, len(params['styles']), frame_count)
+
+        owner = job_owner()
+        weight = job_weight()
+        frame_cost = rate_limit.estimate_cost('simplified', width * height / 1e6, len(params['styles']))
+
+        def stylize(frame_path):
+            # 每一帧作为一个任务排队，与其他用户的任务公平分享名额；帧的内容都不同，不使用底图缓存。
+            # 结果只保留在内存中，由stylize_video编码进输出文件
+            result = job_scheduler.run('simplified', owner, stylize_image, frame_path, params, use_cache=False,
+                                       cost=frame_cost, weight=weight)
+            if result is None:
+                raise RuntimeError('无法生成结果图像')
+            return result
+
+        # GIF输出GIF，其他视频统一编码为mp4
+        ext = 'gif' if original_video.lower().endswith('.gif') else 'mp4'
+        result_filename = f"result_{uuid.uuid4()}.{ext}"
+        result_path = media_store.new_path('results', result_filename)
+
+        stats = stylize_video(
+            content_path,
+            result_path,
+            stylize,
+            media_store.root('temp'),
+            workers=app.config['VIDEO_WORKERS'],
+            window=app.config['VIDEO_FRAME_WINDOW'],
+            diff_threshold=app.config['VIDEO_DIFF_THRESHOLD'],
+            max_frames=app.config['VIDEO_MAX_FRAMES']
+        )
+        print(f"视频处理完成: {result_filename}, {stats}")
+        metrics.RESULT_BYTES_WRITTEN.inc(os.path.getsize(result_path))
 
-        # 如果用户已登录，记录处理历史
         if 'user_id' in session:
             conn = get_db_connection()
-            execute_query(conn, '''
-                INSERT INTO user_results 
-                (user_id, original_image, result_image, styles, parameters, create_date) 
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                session['user_id'],
-                original_image,
-                result_filename,
-                ','.join(styles),
-                f"强度:{style_strength},内容:{content_weight},色彩增强:{color_enhance}",
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            ), commit=True)
+            record_result(conn, session['user_id'], original_video, result_filename, params)
             conn.close()
 
-        # 返回成功响应
         return jsonify({
             'success': True,
-            'result_url': url_for('static', filename=f'uploads/results/{result_filename}')
+            'result_url': media_url('results', result_filename),
+            'frames': stats
         })
 
+    except rate_limit.RateLimitExceeded as e:
+        return rate_limited(e)
     except Exception as e:
-        print(f"处理图像时出错: {str(e)}")
+        print(f"处理视频时出错: {str(e)}")
         import traceback
         traceback.print_exc()
         return jsonify({'error': f'处理失败: {str(e)}'}), 500
 
 
+# 批量风格迁移
+@app.route('/process_batch', methods=['POST'])
+def process_batch():
+    """一次请求处理多张图片×多组风格配置，结果以NDJSON逐行返回
+
+    请求: {"images": [文件名...], "configs": [{"styles": [...], "weights": [...],
+           "styleStrength": 0.8, ...}, ...], "zip": false}
+    每完成一项返回一行 {"image", "config", "result_url"} 或 {"image", "config", "error"}，
+    最后一行为 {"done": true, "completed", "failed"[, "zip_url" 或 "zip_error"]}。
+    动图和视频不在批量处理中支持，对应的每一项都返回错误。
+    """
+    data = request.json or {}
+    images = data.get('images', [])
+    configs = [parse_style_params(config) for config in data.get('configs', [])]
+    want_zip = bool(data.get('zip', False))
+
+    if not images or not configs or any(not config['styles'] for config in configs):
+        return jsonify({'error': '缺少必要参数'}), 400
+
+    if len(images) * len(configs) > app.config['MAX_BATCH_JOBS']:
+        return jsonify({'error': f"单次批量任务最多 {app.config['MAX_BATCH_JOBS']} 项"}), 400
+
+    # 每张图片只查找和校验一次
+    content_paths = {}
+    for image in images:
+        if is_video_file(image):
+            continue
+        path = media_store.path('originals', image)
+        if path is None:
+            return jsonify({'error': f'找不到原始图像: {image}'}), 404
+        content_paths[image] = path
+
+    # 整个批次一次性预先计费，配额不足时一项都不处理
+    buckets = rate_limit_buckets()
+    megapixels = {image: image_megapixels(path) for image, path in content_paths.items()}
+    if buckets:
+        total_cost = sum(rate_limit.estimate_cost('simplified', megapixels[image], len(params['styles']))
+                         for params in configs for image in content_paths)
+        try:
+            rate_limiter.charge(buckets, total_cost)
+        except rate_limit.RateLimitExceeded as e:
+            return rate_limited(e)
+
+    user_id = session.get('user_id')
+    owner = job_owner()
+    weight = job_weight()
+    # 第i项的任务id为 <jobId>-<i>，可以通过 /jobs/<id> 查询
+    batch_id = client_id(data.get('jobId'), required=False) or uuid.uuid4().hex
+    print(f"接收到批量处理请求: {len(images)} 张图片 × {len(configs)} 组风格")
+
+    def generate():
+        completed = []
+        failed = 0
+        # 按风格配置分组依次处理所有图片，同一风格的模型在批次内保持常驻
+        for config_index, params in enumerate(configs):
+            for image_index, image in enumerate(images):
+                line = {'image': image, 'config': config_index}
+                if image not in content_paths:
+                    failed += 1
+                    line['error'] = '动图和视频请使用 /process_video 处理'
+                    yield json.dumps(line, ensure_ascii=False) + '\n'
+                    continue
+                try:
+                    result_filename = job_scheduler.run(
+                        'simplified', owner, run_style_job, content_paths[image], params,
+                        cost=rate_limit.estimate_cost('simplified', megapixels[image], len(params['styles'])),
+                        weight=weight, job_id=f'{batch_id}-{config_index * len(images) + image_index}')
+                    if result_filename is None:
+                        line['error'] = '无法生成结果图像'
+                    else:
+                        line['result_url'] = media_url('results', result_filename)
+                        completed.append((image, result_filename, params))
+                except Exception as e:
+                    print(f"批量处理 {image} 时出错: {e}")
+                    line['error'] = str(e)
+
+                if 'error' in line:
+                    failed += 1
+                yield json.dumps(line, ensure_ascii=False) + '\n'
+
+        # 整个批次的处理历史一次性写入
+        if user_id is not None and completed:
+            try:
+                conn = get_db_connection()
+                for image, result_filename, params in completed:
+                    record_result(conn, user_id, image, result_filename, params, commit=False)
+                conn.commit()
+                conn.close()
+            except Exception as e:
+                print(f"记录批量处理历史失败: {e}")
+
+        summary = {'done': True, 'completed': len(completed), 'failed': failed}
+        if want_zip and completed:
+            # 打包失败时各项结果仍然有效，最后一行照常返回并说明原因
+            try:
+                summary['zip_url'] = media_url('results', build_batch_zip(completed))
+            except Exception as e:
+                print(f"打包批量处理结果失败: {e}")
+                summary['zip_error'] = f'打包失败: {e}'
+        yield json.dumps(summary, ensure_ascii=False) + '\n'
+
+    return app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def build_batch_zip(completed):
+    """把批量任务的结果打包，返回压缩包文件名"""
+    zip_filename = f"batch_{uuid.uuid4()}.zip"
+    zip_path = media_store.new_path('results', zip_filename)
+    try:
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as archive:
+            for index, (image, result_filename, params) in enumerate(completed):
+                stem = os.path.splitext(image)[0]
+                ext = os.path.splitext(result_filename)[1]
+                # JPEG已经压缩过，直接存储即可
+                archive.write(media_store.path('results', result_filename),
+                              f"{index:03d}_{stem}_{'+'.join(params['styles'])}{ext}")
+    except Exception:
+        # 不留下不完整的压缩包
+        if os.path.exists(zip_path):
+            os.remove(zip_path)
+        raise
+    metrics.RESULT_BYTES_WRITTEN.inc(os.path.getsize(zip_path))
+    return zip_filename
+
+
 # 管理员后台路由
 @app.route('/admin')
 def admin():
@@ -644,7 +1667,7 @@ def admin():
         return redirect(url_for('admin_models'))
 
     # 直接使用管理员面板模板
-    return render_template('admin/dashboard.html')
+    return render_template('admin/dashboard.html', profiles=profiling.list_profiles())
 
 
 @app.route('/admin/dashboard')
@@ -654,7 +1677,7 @@ def admin_dashboard():
         flash('需要管理员权限', 'error')
         return redirect(url_for('index'))
 
-    return render_template('admin/dashboard.html')
+    return render_template('admin/dashboard.html', profiles=profiling.list_profiles())
 
 
 @app.route('/admin/users')
@@ -711,6 +1734,35 @@ def toggle_user_status(user_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+# 计算配额管理API
+@app.route('/admin/quotas', methods=['GET', 'POST'])
+def admin_quotas():
+    """查看或修改计算配额
+
+    POST {"subject": "anonymous" | "registered" | "ip" | "user:<id>" | "ip:<地址>",
+          "capacity": 桶容量, "refillPerHour": 每小时恢复的令牌数}
+    capacity为null时删除该主体的配额，恢复默认值。
+    """
+    if 'user_id' not in session or not session.get('is_admin'):
+        return jsonify({'success': False, 'error': '需要管理员权限'}), 403
+
+    if request.method == 'POST':
+        data = request.json or {}
+        subject = data.get('subject', '')
+        if subject not in rate_limit.DEFAULT_QUOTAS and not re.match(r'^(user|ip):\S+$', subject):
+            return jsonify({'success': False, 'error': '无效的配额主体'}), 400
+        try:
+            capacity = data.get('capacity')
+            refill_per_hour = float(data.get('refillPerHour', 0)) if capacity is not None else None
+            if capacity is not None and (float(capacity) <= 0 or refill_per_hour < 0):
+                raise ValueError
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': '配额必须是正数'}), 400
+        rate_limiter.set_quota(subject, capacity, refill_per_hour)
+
+    return jsonify({'success': True, 'quotas': rate_limiter.list_quotas()})
+
+
 # 风格模型管理API
 @app.route('/admin/models/add', methods=['POST'])
 def add_model():
@@ -739,15 +1791,11 @@ def add_model():
 
         # 保存预览图片
         preview_filename = secure_filename(f"{uuid.uuid4()}_{preview_image.filename}")
-        preview_path = os.path.join('static/img/styles', preview_filename)
-        os.makedirs(os.path.dirname(preview_path), exist_ok=True)
-        preview_image.save(preview_path)
+        preview_path = media_store.save('previews', preview_filename, preview_image)
 
         # 保存模型文件
         model_filename = secure_filename(f"{uuid.uuid4()}_{model_file.filename}")
-        model_path = os.path.join('static/models', model_filename)
-        os.makedirs(os.path.dirname(model_path), exist_ok=True)
-        model_file.save(model_path)
+        model_path = media_store.save('models', model_filename, model_file)
 
         # 保存到数据库
         conn = get_db_connection()
@@ -779,11 +1827,8 @@ def delete_model(model_id):
             return jsonify({'success': False, 'error': '模型不存在'}), 404
 
         # 删除文件
-        if model['preview_image'] and os.path.exists(model['preview_image']):
-            os.remove(model['preview_image'])
-
-        if model['model_path'] and os.path.exists(model['model_path']):
-            os.remove(model['model_path'])
+        media_store.delete_path(model['preview_image'])
+        media_store.delete_path(model['model_path'])
 
         # 从数据库删除
         execute_query(conn, 'DELETE FROM styles WHERE id = ?', (model_id,), commit=True)
@@ -877,6 +1922,11 @@ def update_admin_password(username, password):
 @app.route('/api/style_effect_prediction', methods=['POST'])
 def get_style_effect_prediction():
     """获取风格效果预测热力图数据，展示不同参数组合的预期效果"""
+    # numpy和plotly导入较慢，只在需要时加载
+    import numpy as np
+    import plotly.graph_objects as go
+    from plotly.utils import PlotlyJSONEncoder
+
     try:
         data = request.json
         styles = data.get('styles', [])
@@ -893,120 +1943,16 @@ def get_style_effect_prediction():
         style_weights = np.linspace(0.1, 1.0, 10)  # 10×10的热力图更清晰易读
         content_weights = np.linspace(0.1, 1.0, 10)
 
-        # 为不同风格定义特性参数 - 为每种风格设置不同的参数，确保有明显区别
-        style_properties = {
-            'vangogh': {
-                'realism': 0.4,  # 真实感
-                'detail': 0.7,  # 细节保留
-                'color_fidelity': 0.5,  # 色彩保真度
-                'stylization': 0.9,  # 风格化程度
-                'optimal_style_weight': 0.75,  # 最佳风格权重
-                'optimal_content_weight': 0.45,  # 最佳内容权重
-                'balance_factor': 1.1,  # 平衡因子
-                'heatmap_variant': 1  # 热力图变体
-            },
-            'picasso': {
-                'realism': 0.3,
-                'detail': 0.5,
-                'color_fidelity': 0.6,
-                'stylization': 0.8,
-                'optimal_style_weight': 0.8,
-                'optimal_content_weight': 0.3,
-                'balance_factor': 0.9,
-                'heatmap_variant': 2
-            },
-            'ink': {
-                'realism': 0.2,
-                'detail': 0.8,
-                'color_fidelity': 0.3,
-                'stylization': 0.9,
-                'optimal_style_weight': 0.9,
-                'optimal_content_weight': 0.2,
-                'balance_factor': 1.2,
-                'heatmap_variant': 3
-            },
-            'impression': {
-                'realism': 0.5,
-                'detail': 0.6,
-                'color_fidelity': 0.8,
-                'stylization': 0.7,
-                'optimal_style_weight': 0.7,
-                'optimal_content_weight': 0.5,
-                'balance_factor': 1.0,
-                'heatmap_variant': 4
-            },
-            'pop': {
-                'realism': 0.3,
-                'detail': 0.5,
-                'color_fidelity': 0.9,
-                'stylization': 0.8,
-                'optimal_style_weight': 0.65,
-                'optimal_content_weight': 0.55,
-                'balance_factor': 0.85,
-                'heatmap_variant': 5
-            },
-            'horror': {
-                'realism': 0.4,
-                'detail': 0.8,
-                'color_fidelity': 0.4,
-                'stylization': 0.9,
-                'optimal_style_weight': 0.85,
-                'optimal_content_weight': 0.3,
-                'balance_factor': 1.15,
-                'heatmap_variant': 6
-            },
-            'candy': {
-                'realism': 0.2,
-                'detail': 0.4,
-                'color_fidelity': 0.9,
-                'stylization': 0.9,
-                'optimal_style_weight': 0.7,
-                'optimal_content_weight': 0.4,
-                'balance_factor': 0.8,
-                'heatmap_variant': 7
-            },
-            'mosaic': {
-                'realism': 0.3,
-                'detail': 0.7,
-                'color_fidelity': 0.6,
-                'stylization': 0.8,
-                'optimal_style_weight': 0.75,
-                'optimal_content_weight': 0.35,
-                'balance_factor': 1.05,
-                'heatmap_variant': 8
-            },
-            'rain-princess': {
-                'realism': 0.5,
-                'detail': 0.7,
-                'color_fidelity': 0.7,
-                'stylization': 0.8,
-                'optimal_style_weight': 0.6,
-                'optimal_content_weight': 0.6,
-                'balance_factor': 0.95,
-                'heatmap_variant': 9
-            },
-            'udnie': {
-                'realism': 0.4,
-                'detail': 0.6,
-                'color_fidelity': 0.5,
-                'stylization': 0.8,
-                'optimal_style_weight': 0.7,
-                'optimal_content_weight': 0.5,
-                'balance_factor': 1.0,
-                'heatmap_variant': 10
-            }
-        }
-
         # 创建效果热力图数据
         result_heatmap = np.zeros((len(style_weights), len(content_weights)))
 
         # 计算风格混合的效果预测值
         # 根据风格权重和内容权重的不同组合计算总体效果
         main_style = styles[0]  # 以第一个风格为主
-        if main_style not in style_properties:
+        if main_style not in STYLE_PROPERTIES:
             main_style = 'vangogh'  # 默认风格
 
-        main_props = style_properties[main_style]
+        main_props = STYLE_PROPERTIES[main_style]
         variant = main_props['heatmap_variant']
 
         # 为不同风格生成不同的热力图模式
@@ -1016,10 +1962,10 @@ def get_style_effect_prediction():
                 effect_score = 0
                 for style_name in styles:
                     # 使用默认风格特性如果风格不存在
-                    if style_name not in style_properties:
-                        props = style_properties['vangogh']
+                    if style_name not in STYLE_PROPERTIES:
+                        props = STYLE_PROPERTIES['vangogh']
                     else:
-                        props = style_properties[style_name]
+                        props = STYLE_PROPERTIES[style_name]
 
                     # 根据权重组合计算预期效果
                     style_effect = (
@@ -1223,82 +2169,8 @@ def get_style_radar_data():
         if not style:
             return jsonify({'error': '未指定风格名称'}), 400
 
-        # 不同风格的特性数据
-        style_features = {
-            'vangogh': {
-                '笔触': 0.9,
-                '色彩': 0.8,
-                '纹理': 0.7,
-                '对比度': 0.8,
-                '构图': 0.6
-            },
-            'picasso': {
-                '笔触': 0.6,
-                '色彩': 0.7,
-                '纹理': 0.8,
-                '对比度': 0.9,
-                '构图': 0.7
-            },
-            'ink': {
-                '笔触': 0.8,
-                '色彩': 0.3,
-                '纹理': 0.9,
-                '对比度': 0.9,
-                '构图': 0.8
-            },
-            'impression': {
-                '笔触': 0.7,
-                '色彩': 0.9,
-                '纹理': 0.6,
-                '对比度': 0.6,
-                '构图': 0.8
-            },
-            'pop': {
-                '笔触': 0.5,
-                '色彩': 0.9,
-                '纹理': 0.5,
-                '对比度': 0.9,
-                '构图': 0.6
-            },
-            'horror': {
-                '笔触': 0.6,
-                '色彩': 0.7,
-                '纹理': 0.9,
-                '对比度': 0.9,
-                '构图': 0.7
-            },
-            'candy': {
-                '笔触': 0.5,
-                '色彩': 0.9,
-                '纹理': 0.5,
-                '对比度': 0.8,
-                '构图': 0.6
-            },
-            'mosaic': {
-                '笔触': 0.3,
-                '色彩': 0.8,
-                '纹理': 0.9,
-                '对比度': 0.7,
-                '构图': 0.6
-            },
-            'rain-princess': {
-                '笔触': 0.7,
-                '色彩': 0.7,
-                '纹理': 0.8,
-                '对比度': 0.7,
-                '构图': 0.8
-            },
-            'udnie': {
-                '笔触': 0.7,
-                '色彩': 0.6,
-                '纹理': 0.8,
-                '对比度': 0.8,
-                '构图': 0.7
-            }
-        }
-
         # 如果风格不存在，使用默认值
-        if style not in style_features:
+        if style not in STYLE_FEATURES:
             # 返回一个空的雷达图
             radar_data = [{
                 'type': 'scatterpolar',
@@ -1320,11 +2192,11 @@ def get_style_radar_data():
             }
 
             fig = {'data': radar_data, 'layout': layout}
-            graphJSON = json.dumps(fig, cls=PlotlyJSONEncoder)
+            graphJSON = json.dumps(fig)
             return jsonify({'success': True, 'graph': graphJSON})
 
         # 获取特性值和标签
-        features = style_features[style]
+        features = STYLE_FEATURES[style]
         labels = list(features.keys())
         values = list(features.values())
 
@@ -1353,9 +2225,9 @@ def get_style_radar_data():
             'showlegend': False
         }
 
-        # 创建图表
+        # 创建图表（雷达图数据都是普通Python类型，不需要plotly）
         fig = {'data': radar_data, 'layout': layout}
-        graphJSON = json.dumps(fig, cls=PlotlyJSONEncoder)
+        graphJSON = json.dumps(fig)
 
         return jsonify({'success': True, 'graph': graphJSON})
 
@@ -1394,14 +2266,17 @@ def delete_result(result_id):
 
         # 从数据库中删除记录
         execute_query(conn, 'DELETE FROM user_results WHERE id = ?', (result_id,), commit=True)
+        # 相同的请求会共享同一个结果文件，仍被其他记录引用时保留
+        still_referenced = execute_query(conn, 'SELECT id FROM user_results WHERE result_image = ?',
+                                         (result_image,))
         conn.close()
 
         # 尝试删除结果图像文件(原图可能被其他记录使用，所以不删除)
         try:
-            result_path = os.path.join(app.config['RESULT_FOLDER'], result_image)
-            if os.path.exists(result_path):
-                os.remove(result_path)
-                print(f"已删除结果图像文件: {result_path}")
+            if still_referenced:
+                print(f"结果图像仍被其他记录引用，保留文件: {result_image}")
+            elif media_store.delete('results', result_image):
+                print(f"已删除结果图像文件: {result_image}")
         except Exception as e:
             print(f"删除结果图像文件失败: {e}")
             # 继续执行，即使图像文件删除失败也返回成功
@@ -1416,37 +2291,11 @@ def delete_result(result_id):
 
 
 if __name__ == '__main__':
-    # 创建必要的目录
-    os.makedirs('database', exist_ok=True)
-    os.makedirs('static/uploads/originals', exist_ok=True)
-    os.makedirs('static/uploads/results', exist_ok=True)
-    os.makedirs('static/img/styles', exist_ok=True)
-    os.makedirs('static/models/pretrained', exist_ok=True)
-
-    # 初始化数据库
-    if not init_db():
-        print("数据库初始化失败，程序退出")
+    # 创建目录、初始化数据库和风格预览，已完成的步骤会被跳过
+    _app_prepared = True
+    if not boot_app():
+        print("启动初始化失败，程序退出")
         sys.exit(1)
 
-    # 检查风格预览图像是否存在，如果不存在则尝试创建
-    styles = ['vangogh', 'picasso', 'ink', 'impression', 'pop']
-    missing_styles = False
-    for style in styles:
-        style_path = os.path.join('static', 'img', 'styles', f'{style}.jpg')
-        if not os.path.exists(style_path):
-            missing_styles = True
-            break
-
-    if missing_styles:
-        try:
-            from create_style_previews import create_all_style_previews
-
-            create_all_style_previews()
-            print("风格预览图像创建成功")
-        except ImportError:
-            print("无法导入风格预览生成工具，请确保create_style_previews.py文件存在")
-        except Exception as e:
-            print(f"创建风格预览图像失败: {e}")
-
     # 运行应用
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(debug=True, host='0.0.0.0', port=5000)
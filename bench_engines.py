@@ -0,0 +1,285 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+
+# 从任意目录运行时都能导入项目模块
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT_DIR)
+
+from style_data import STYLE_PROPERTIES
+
+# 测试分辨率: 名称 -> (宽, 高)
+RESOLUTIONS = {
+    '256': (256, 256),
+    '512': (512, 512),
+    '1024': (1024, 1024),
+    '1080p': (1920, 1080),
+    '4k': (3840, 2160)
+}
+
+# 多风格融合使用的风格组合
+FUSION_SETS = [
+    ['vangogh', 'ink'],
+    ['vangogh', 'picasso', 'pop']
+]
+
+
+class RssSampler:
+    """在后台线程中采样当前进程的常驻内存，记录测试期间的峰值"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._page_size = resource.getpagesize()
+
+    def current(self):
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * self._page_size
+        except OSError:
+            # 非Linux系统只能使用进程生命周期内的峰值
+            usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return usage if sys.platform == 'darwin' else usage * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+def synthetic_image(size, seed=0):
+    """带渐变、色块和噪声的测试图像，避免纯色图让算法走捷径"""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    img = np.stack([
+        255 * x / max(width - 1, 1),
+        255 * y / max(height - 1, 1),
+        127.5 * (1 + np.sin(x / (37.0 + seed)) * np.cos(y / 23.0))
+    ], axis=-1)
+    img += rng.normal(0, 12, img.shape)
+    return Image.fromarray(np.clip(img, 0, 255).astype(np.uint8))
+
+
+def make_synthetic_image(path, size, seed=0):
+    """生成测试图像并保存到path"""
+    synthetic_image(size, seed).save(path, quality=95)
+    return path
+
+
+def percentile_summary(latencies):
+    """计算延迟分位数（毫秒）"""
+    data = np.array(latencies) * 1000
+    return {
+        'mean_ms': float(np.mean(data)),
+        'p50_ms': float(np.percentile(data, 50)),
+        'p90_ms': float(np.percentile(data, 90)),
+        'p99_ms': float(np.percentile(data, 99)),
+        'min_ms': float(np.min(data)),
+        'max_ms': float(np.max(data))
+    }
+
+
+def run_case(fn, size, repeats, warmup):
+    """重复运行一个测试用例并汇总结果"""
+    for _ in range(warmup):
+        fn()
+
+    latencies = []
+    with RssSampler() as sampler:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fn()
+            latencies.append(time.perf_counter() - start)
+
+    total = sum(latencies)
+    megapixels = size[0] * size[1] / 1e6
+    summary = percentile_summary(latencies)
+    summary.update({
+        'repeats': repeats,
+        'width': size[0],
+        'height': size[1],
+        'images_per_s': repeats / total if total else 0.0,
+        'megapixels_per_s': repeats * megapixels / total if total else 0.0,
+        'peak_rss_mb': sampler.peak / (1024 * 1024)
+    })
+    return summary
+
+
+def run_fusion(multi_style_fusion, content_path, styles, weights):
+    """多风格融合把结果写到项目的结果目录，测完立即删除"""
+    filename = multi_style_fusion(content_path, styles, weights, 0.8, 0.2, False)
+    path = os.path.join('static', 'uploads', 'results', os.path.basename(filename))
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def build_cases(engines, resolutions, work_dir, neural_max_pixels, neural_steps):
+    """生成 (用例名, 分辨率, 执行函数) 列表，不可用的引擎跳过"""
+    cases = []
+    inputs = {}
+    for name in resolutions:
+        inputs[name] = make_synthetic_image(os.path.join(work_dir, f'input_{name}.jpg'), RESOLUTIONS[name])
+    output_path = os.path.join(work_dir, 'output.jpg')
+
+    if 'simplified' in engines:
+        from models.simplified_transfer import apply_style, multi_style_fusion
+
+        for res in resolutions:
+            for style in STYLE_PROPERTIES:
+                cases.append((f'simplified/{style}/{res}', RESOLUTIONS[res],
+                              lambda p=inputs[res], s=style: apply_style(p, s, output_path, 0.8, 0.2, False)))
+            for style_set in FUSION_SETS:
+                weights = [1.0 / len(style_set)] * len(style_set)
+                cases.append((f"fusion/{'+'.join(style_set)}/{res}", RESOLUTIONS[res],
+                              lambda p=inputs[res], s=style_set, w=weights: run_fusion(multi_style_fusion, p, s, w)))
+
+    if 'fast' in engines or 'neural' in engines:
+        try:
+            from models.style_controller import StyleTransferController
+            controller = StyleTransferController()
+        except Exception as e:
+            print(f"无法初始化风格控制器，跳过fast/neural引擎: {e}")
+            controller = None
+
+        if controller is not None and 'fast' in engines:
+            fast = getattr(controller, 'fast_style_transfer', None)
+            if fast is None:
+                print("风格控制器没有fast_style_transfer方法，跳过fast引擎")
+            else:
+                for res in resolutions:
+                    for style in STYLE_PROPERTIES:
+                        cases.append((f'fast/{style}/{res}', RESOLUTIONS[res],
+                                      lambda p=inputs[res], s=style: fast(p, s, output_path)))
+
+        if controller is not None and 'neural' in engines:
+            neural = getattr(controller, 'neural_style_transfer', None)
+            if neural is None:
+                print("风格控制器没有neural_style_transfer方法，跳过neural引擎")
+            else:
+                for res in resolutions:
+                    width, height = RESOLUTIONS[res]
+                    # 神经风格迁移很慢，默认只测小分辨率
+                    if width * height > neural_max_pixels:
+                        continue
+                    cases.append((f'neural/vangogh/{res}', RESOLUTIONS[res],
+                                  lambda p=inputs[res]: neural(p, ['vangogh'], output_path, num_steps=neural_steps)))
+    return cases
+
+
+def run_benchmarks(args):
+    """运行所有用例，返回结果字典"""
+    work_dir = tempfile.mkdtemp(prefix='bench_engines_')
+    cwd = os.getcwd()
+    # 引擎按相对路径加载模型（models/pretrained）和写入融合结果，与应用一样在项目根目录中运行，
+    # 测试图像和输出放在临时目录
+    os.chdir(ROOT_DIR)
+    os.makedirs(os.path.join('static', 'uploads', 'results'), exist_ok=True)
+    results = {}
+    try:
+        cases = build_cases(args.engines, args.resolutions, work_dir, args.neural_max_pixels, args.neural_steps)
+        for name, size, fn in cases:
+            if args.filter and args.filter not in name:
+                continue
+            repeats = 1 if name.startswith('neural/') else args.repeats
+            warmup = 0 if name.startswith('neural/') else args.warmup
+            try:
+                results[name] = run_case(fn, size, repeats, warmup)
+                r = results[name]
+                print(f"{name:40s} p50={r['p50_ms']:9.1f}ms p99={r['p99_ms']:9.1f}ms "
+                      f"{r['megapixels_per_s']:7.2f}MP/s rss={r['peak_rss_mb']:.0f}MB")
+            except Exception as e:
+                print(f"{name:40s} 失败: {e}")
+                results[name] = {'error': str(e)}
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeats': args.repeats
+        },
+        'results': results
+    }
+
+
+def compare(current, baseline, tolerance):
+    """与基线对比，返回退化的用例列表"""
+    regressions = []
+    for name, result in current['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if not base or 'error' in base or 'error' in result:
+            continue
+        p50_ratio = result['p50_ms'] / base['p50_ms'] if base['p50_ms'] else 1.0
+        rss_ratio = result['peak_rss_mb'] / base['peak_rss_mb'] if base['peak_rss_mb'] else 1.0
+        status = 'OK'
+        if p50_ratio > 1 + tolerance or rss_ratio > 1 + tolerance:
+            status = '退化'
+            regressions.append(name)
+        print(f"{name:40s} p50 {base['p50_ms']:9.1f} -> {result['p50_ms']:9.1f}ms ({p50_ratio:5.2f}x) "
+              f"rss {base['peak_rss_mb']:6.0f} -> {result['peak_rss_mb']:6.0f}MB  {status}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='风格迁移引擎性能测试')
+    parser.add_argument('--engines', nargs='+', default=['simplified', 'fast'],
+                        choices=['simplified', 'fast', 'neural'], help='要测试的引擎')
+    parser.add_argument('--resolutions', nargs='+', default=list(RESOLUTIONS),
+                        choices=list(RESOLUTIONS), help='要测试的分辨率')
+    parser.add_argument('--repeats', type=int, default=5, help='每个用例重复次数')
+    parser.add_argument('--warmup', type=int, default=1, help='每个用例预热次数')
+    parser.add_argument('--filter', default='', help='只运行名称包含该字符串的用例')
+    parser.add_argument('--neural-max-pixels', type=int, default=512 * 512, help='神经风格迁移测试的最大像素数')
+    parser.add_argument('--neural-steps', type=int, default=50, help='神经风格迁移的迭代次数')
+    parser.add_argument('--output', default='bench_results.json', help='结果JSON文件')
+    parser.add_argument('--compare', metavar='BASELINE', help='与基线JSON对比，发现退化时返回非0')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='允许的退化比例')
+    args = parser.parse_args(argv)
+
+    current = run_benchmarks(args)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(current, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到 {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.tolerance)
+        if regressions:
+            print(f"发现 {len(regressions)} 个退化的用例")
+            return 1
+        print("没有发现性能退化")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 在子进程中执行，测量导入app模块的耗时和内存
+PROBE = r'''
+import sys, time, json, resource
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+warm = None
+if {warm_up}:
+    start = time.perf_counter()
+    app.warm_up()
+    warm = time.perf_counter() - start
+usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print('__STARTUP__' + json.dumps({{
+    'import_s': elapsed,
+    'warm_up_s': warm,
+    'max_rss_mb': usage / 1024 / (1024 if sys.platform == 'darwin' else 1),
+    'modules': len(sys.modules),
+    'heavy_modules': [m for m in ('numpy', 'plotly', 'pandas', 'torch', 'torchvision', 'PIL') if m in sys.modules]
+}}))
+'''
+
+
+def run_probe(warm_up, cwd):
+    code = PROBE.format(warm_up=warm_up)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    proc = subprocess.run([sys.executable, '-c', code], cwd=cwd, env=env, capture_output=True, text=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith('__STARTUP__'):
+            return json.loads(line[len('__STARTUP__'):])
+    raise RuntimeError(f"启动测试失败:\n{proc.stderr[-2000:]}")
+
+
+def import_time_top(cwd, top):
+    """使用 -X importtime 列出累计耗时最多的模块"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=cwd, env=env,
+                          capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='测量导入app模块的启动耗时和内存')
+    parser.add_argument('--runs', type=int, default=5, help='重复次数，取中位数')
+    parser.add_argument('--warm-up', action='store_true', help='同时测量warm_up()的耗时')
+    parser.add_argument('--importtime', type=int, default=0, metavar='N', help='列出导入耗时最多的N个模块')
+    parser.add_argument('--output', help='把结果保存为JSON')
+    args = parser.parse_args(argv)
+
+    # 在项目目录中运行，与实际部署相同
+    runs = [run_probe(args.warm_up, ROOT_DIR) for _ in range(args.runs)]
+    summary = {
+        'runs': args.runs,
+        'import_s_median': statistics.median(r['import_s'] for r in runs),
+        'import_s_min': min(r['import_s'] for r in runs),
+        'max_rss_mb_median': statistics.median(r['max_rss_mb'] for r in runs),
+        'modules': runs[-1]['modules'],
+        'heavy_modules': runs[-1]['heavy_modules']
+    }
+    if args.warm_up:
+        summary['warm_up_s_median'] = statistics.median(r['warm_up_s'] for r in runs)
+
+    print(f"导入app: 中位数 {summary['import_s_median'] * 1000:.0f}ms，最快 {summary['import_s_min'] * 1000:.0f}ms")
+    print(f"峰值内存: {summary['max_rss_mb_median']:.0f}MB，已加载模块 {summary['modules']} 个")
+    print(f"已加载的重量级模块: {', '.join(summary['heavy_modules']) or '无'}")
+    if args.warm_up:
+        print(f"warm_up(): 中位数 {summary['warm_up_s_median'] * 1000:.0f}ms")
+
+    if args.importtime:
+        print(f"{'累计(ms)':>10s} {'自身(ms)':>10s}  模块")
+        for cumulative_us, self_us, name in import_time_top(ROOT_DIR, args.importtime):
+            print(f"{cumulative_us / 1000:10.1f} {self_us / 1000:10.1f}  {name}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""对比线程分配前后多worker并发时的吞吐量和延迟
+
+启动与部署相同数量的worker进程同时运行计算负载，分别测试:
+    default  不做任何限制，每个进程的运行时使用全部核心
+    budget   使用thread_budget分配线程（--pin 同时绑定核心）
+
+负载:
+    torch    与TransformerNet结构相近的卷积网络（下采样、残差块、上采样）
+    numpy    float32矩阵乘法（BLAS）
+未安装torch时自动使用numpy负载。
+
+用法:
+    python bench_threads.py --workers 4 --duration 20
+    python bench_threads.py --workers 8 --workload numpy --pin
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import importlib.util
+
+import thread_budget
+
+# 子进程: 在导入numpy/torch之前应用线程分配，然后循环执行负载
+CHILD = r'''
+import os, sys, json, time
+sys.path.insert(0, {root!r})
+import thread_budget
+if {budget}:
+    thread_budget.configure({workers}, worker_index={index}, pin_cores={pin})
+workload, size, duration = {workload!r}, {size}, {duration}
+
+if workload == 'torch':
+    import torch
+    import torch.nn as nn
+    thread_budget.apply_torch()
+
+    def block(cin, cout, stride):
+        return nn.Sequential(nn.Conv2d(cin, cout, 3, stride, 1), nn.InstanceNorm2d(cout, affine=True), nn.ReLU())
+    model = nn.Sequential(
+        block(3, 32, 1), block(32, 64, 2), block(64, 128, 2),
+        *[block(128, 128, 1) for _ in range(5)],
+        nn.Upsample(scale_factor=2), block(128, 64, 1), nn.Upsample(scale_factor=2), block(64, 32, 1),
+        nn.Conv2d(32, 3, 3, 1, 1), nn.Sigmoid()).eval()
+    data = torch.rand(1, 3, size, size)
+
+    def step():
+        with torch.no_grad():
+            model(data)
+else:
+    import numpy as np
+    a = np.random.rand(size, size).astype(np.float32)
+    b = np.random.rand(size, size).astype(np.float32)
+
+    def step():
+        a @ b
+
+step()
+print('__READY__', flush=True)
+sys.stdin.readline()
+latencies = []
+end = time.perf_counter() + duration
+while time.perf_counter() < end:
+    start = time.perf_counter()
+    step()
+    latencies.append(time.perf_counter() - start)
+print('__RESULT__' + json.dumps(latencies), flush=True)
+'''
+
+
+def run_round(args, budget):
+    """同时启动所有worker，返回每次操作的延迟列表"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    if not budget:
+        for name in thread_budget.THREAD_ENV_VARS:
+            env.pop(name, None)
+    procs = []
+    for index in range(args.workers):
+        code = CHILD.format(root=root, budget=budget, workers=args.workers, index=index, pin=args.pin,
+                            workload=args.workload, size=args.size, duration=args.duration)
+        procs.append(subprocess.Popen([sys.executable, '-c', code], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                      text=True, env=env))
+    # 所有worker完成预热后同时开始计时
+    for proc in procs:
+        while proc.stdout.readline().strip() != '__READY__':
+            if proc.poll() is not None:
+                raise RuntimeError('worker启动失败')
+    for proc in procs:
+        proc.stdin.write('\n')
+        proc.stdin.flush()
+
+    latencies = []
+    for proc in procs:
+        for line in proc.stdout:
+            if line.startswith('__RESULT__'):
+                latencies.extend(json.loads(line[len('__RESULT__'):]))
+        proc.wait()
+    return latencies
+
+
+def summarize(latencies, duration):
+    data = sorted(latencies)
+    return {
+        'ops': len(data),
+        'throughput': len(data) / duration,
+        'p50_ms': data[len(data) // 2] * 1000,
+        'p99_ms': data[min(len(data) - 1, int(len(data) * 0.99))] * 1000
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='对比线程分配前后多worker并发的吞吐量')
+    parser.add_argument('--workers', type=int, default=4, help='同时运行的worker进程数')
+    parser.add_argument('--workload', choices=['torch', 'numpy'],
+                        default='torch' if importlib.util.find_spec('torch') else 'numpy')
+    parser.add_argument('--size', type=int, default=0, help='图像边长（torch）或矩阵边长（numpy）')
+    parser.add_argument('--duration', type=float, default=10.0, help='每轮测试的秒数')
+    parser.add_argument('--pin', action='store_true', help='同时把worker绑定到独立的核心')
+    parser.add_argument('--output', help='把结果保存为JSON')
+    args = parser.parse_args(argv)
+    args.size = args.size or (256 if args.workload == 'torch' else 1024)
+
+    cores = len(thread_budget.available_cores())
+    plan = thread_budget.plan_budget(args.workers)
+    print(f"{cores} 个核心，{args.workers} 个worker，负载 {args.workload}({args.size})，"
+          f"每个worker分配 {plan.intra_op} 个线程")
+
+    results = {}
+    for name, budget in (('default', False), ('budget', True)):
+        results[name] = summarize(run_round(args, budget), args.duration)
+        r = results[name]
+        print(f"{name:8s} 吞吐量 {r['throughput']:8.2f} 次/秒  p50 {r['p50_ms']:8.1f}ms  p99 {r['p99_ms']:8.1f}ms")
+    print(f"吞吐量变化: {results['budget']['throughput'] / results['default']['throughput']:.2f}x")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'cores': cores, 'workers': args.workers, 'workload': args.workload, 'size': args.size,
+                       'pin': args.pin, 'results': results}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
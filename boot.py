@@ -0,0 +1,145 @@
+"""幂等的启动初始化
+
+每个初始化步骤都有一个指纹（相关代码文件的修改时间和大小，加上配置参数），
+执行成功后记录到状态文件中。之后启动时指纹不变且产物仍然存在的步骤直接跳过。
+多个worker同时启动时通过锁文件保证同一时间只有一个进程执行初始化。
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+STATE_FILE = os.path.join('database', '.boot_state.json')
+LOCK_FILE = os.path.join('database', '.boot.lock')
+
+
+class BootStep:
+    """一个初始化步骤
+
+    run: 执行初始化的函数，返回False表示失败
+    sources: 影响结果的函数或模块，它们所在文件变化时重新执行
+    outputs: 执行后应该存在的文件或目录，缺失时重新执行
+    params: 影响结果的其他参数（如数据库类型）
+    required: 失败时boot()是否返回False，非必需的步骤失败只记录日志
+    """
+
+    def __init__(self, name, run, sources=(), outputs=(), params=None, required=True):
+        self.name = name
+        self.run = run
+        self.sources = sources
+        self.outputs = outputs
+        self.params = params
+        self.required = required
+
+    def fingerprint(self):
+        digest = hashlib.sha1(self.name.encode('utf-8'))
+        for source in self.sources:
+            path = _source_file(source)
+            st = os.stat(path)
+            digest.update(f'{path}:{st.st_mtime_ns}:{st.st_size}'.encode('utf-8'))
+        digest.update(json.dumps(self.params, sort_keys=True, default=str).encode('utf-8'))
+        return digest.hexdigest()
+
+    def outputs_exist(self):
+        return all(os.path.exists(path) for path in self.outputs)
+
+
+def _source_file(source):
+    """函数、模块或文件路径对应的源文件"""
+    if isinstance(source, str):
+        return os.path.abspath(source)
+    module = sys.modules[getattr(source, '__module__', None) or source.__name__]
+    return os.path.abspath(module.__file__)
+
+
+def _read_state():
+    try:
+        with open(STATE_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_state(state):
+    tmp_path = f'{STATE_FILE}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, STATE_FILE)
+
+
+def _pending_steps(steps, state):
+    pending = []
+    for step in steps:
+        fingerprint = step.fingerprint()
+        if state.get(step.name) != fingerprint or not step.outputs_exist():
+            pending.append((step, fingerprint))
+    return pending
+
+
+class _BootLock:
+    """跨进程的排他锁"""
+
+    def __enter__(self):
+        self.file = open(LOCK_FILE, 'a+')
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        else:
+            self.file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+
+
+def boot(steps, force=False):
+    """执行需要执行的初始化步骤，返回必需的步骤是否全部成功"""
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+
+    # 快速路径: 不加锁检查，全部是最新状态时直接返回
+    if not force and not _pending_steps(steps, _read_state()):
+        print(f"启动初始化已是最新，跳过 {len(steps)} 个步骤，耗时 {(time.perf_counter() - start) * 1000:.1f}ms")
+        return True
+
+    with _BootLock():
+        # 等待锁期间其他进程可能已经完成了初始化
+        state = _read_state()
+        pending = [(step, step.fingerprint()) for step in steps] if force else _pending_steps(steps, state)
+        success = True
+        for step, fingerprint in pending:
+            step_start = time.perf_counter()
+            try:
+                ok = step.run() is not False
+            except Exception as e:
+                print(f"初始化步骤 {step.name} 失败: {e}")
+                ok = False
+            print(f"初始化步骤 {step.name}: {'完成' if ok else '失败'}，"
+                  f"耗时 {(time.perf_counter() - step_start) * 1000:.1f}ms")
+            if ok:
+                state[step.name] = fingerprint
+            else:
+                state.pop(step.name, None)
+                success = success and not step.required
+        _write_state(state)
+
+    print(f"启动初始化完成: 执行 {len(pending)} 个步骤，跳过 {len(steps) - len(pending)} 个，"
+          f"耗时 {(time.perf_counter() - start) * 1000:.1f}ms")
+    return success
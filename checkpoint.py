@@ -0,0 +1,199 @@
+"""神经风格迁移的检查点与断点续算
+
+神经风格迁移用L-BFGS迭代优化图像，一次运行需要10~30分钟，worker重启或被抢占时全部丢失。
+Checkpointer 定期把
+    当前图像张量、L-BFGS优化器状态、已完成的迭代次数、损失历史
+原子地写入任务对应的检查点文件（共享存储上，任何worker都能读取）。任务被重新领取后
+run_lbfgs() 从最后一个检查点继续迭代，而不是从头开始。
+
+引擎的约定: neural_style_transfer(..., checkpoint=Checkpointer) 接受检查点参数时，
+用 run_lbfgs() 执行优化循环即可获得断点续算。
+
+    python checkpoint.py --size 512 --steps 20     # 测量每次保存检查点的耗时和文件大小
+"""
+import os
+import sys
+import time
+import argparse
+
+from job_queue import JobInterrupted
+
+
+class Checkpointer:
+    """按迭代次数和/或时间间隔保存检查点
+
+    every_steps: 每隔多少次迭代保存，0表示不按迭代次数保存
+    every_seconds: 距上次保存超过多少秒时保存，0表示不按时间保存
+    control: worker传入的job_queue.JobControl。worker退出时立即保存检查点并中断优化，
+             租约丢失后不再写入检查点并中断优化
+    """
+
+    def __init__(self, path, every_steps=50, every_seconds=60, control=None):
+        self.path = path
+        self.every_steps = every_steps
+        self.every_seconds = every_seconds
+        self.control = control
+        self.last_step = 0
+        self.last_time = time.monotonic()
+        # 保存开销的统计
+        self.saves = 0
+        self.save_seconds = 0.0
+        self.last_bytes = 0
+        self.resumed_from = None
+
+    def load(self):
+        """读取检查点，不存在或已损坏时返回None"""
+        import torch
+
+        if not os.path.exists(self.path):
+            return None
+        try:
+            state = torch.load(self.path, map_location='cpu')
+        except Exception as e:
+            print(f"检查点 {self.path} 无法读取，从头开始: {e}")
+            return None
+        self.last_step = self.resumed_from = state['step']
+        return state
+
+    def due(self, step):
+        if self.every_steps and step - self.last_step >= self.every_steps:
+            return True
+        return bool(self.every_seconds) and time.monotonic() - self.last_time >= self.every_seconds
+
+    def check(self):
+        """租约已丢失时中断，另一个worker可能正在使用同一个检查点文件"""
+        if self.control is not None and self.control.lost.is_set():
+            raise JobInterrupted('租约已丢失')
+
+    def save(self, step, image, optimizer, losses, extra=None):
+        """原子地写入检查点，写入中途崩溃不会留下不完整的文件"""
+        import torch
+
+        self.check()
+        start = time.perf_counter()
+        state = {
+            'step': step,
+            'image': image.detach().cpu(),
+            'optimizer': optimizer.state_dict(),
+            'losses': list(losses),
+            'extra': extra or {},
+        }
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        torch.save(state, tmp_path)
+        os.replace(tmp_path, self.path)
+
+        elapsed = time.perf_counter() - start
+        self.saves += 1
+        self.save_seconds += elapsed
+        self.last_bytes = os.path.getsize(self.path)
+        self.last_step = step
+        self.last_time = time.monotonic()
+        if self.control is not None:
+            # 任务仍在推进，重新计算尝试次数
+            self.control.progress()
+        print(f"检查点: 第{step}次迭代，耗时 {elapsed * 1000:.1f}ms，{self.last_bytes / 1024 / 1024:.1f}MB")
+
+    def maybe_save(self, step, image, optimizer, losses, extra=None):
+        self.check()
+        if self.control is not None and self.control.stopping.is_set():
+            # 被抢占或停止部署时等不到优化完成，保存当前进度后交还任务
+            self.save(step, image, optimizer, losses, extra)
+            raise JobInterrupted('worker退出')
+        if self.due(step):
+            self.save(step, image, optimizer, losses, extra)
+            return True
+        return False
+
+    def clear(self):
+        """任务完成后删除检查点"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        return {
+            'saves': self.saves,
+            'avg_ms': round(self.save_seconds / self.saves * 1000, 2) if self.saves else 0.0,
+            'total_ms': round(self.save_seconds * 1000, 2),
+            'bytes': self.last_bytes,
+            'resumed_from': self.resumed_from,
+        }
+
+
+def run_lbfgs(image, optimizer, closure, num_steps, checkpointer=None):
+    """可以断点续算的L-BFGS优化循环
+
+    image: 被优化的图像张量（requires_grad），optimizer 必须以它为唯一参数。
+    closure(): 清零梯度、计算损失并反向传播，返回损失张量。
+    每次 optimizer.step(closure) 计为一次迭代，返回 (image, 损失历史)。
+    """
+    import torch
+
+    step = 0
+    losses = []
+    if checkpointer is not None:
+        state = checkpointer.load()
+        if state is not None:
+            with torch.no_grad():
+                image.copy_(state['image'].to(image.device))
+            optimizer.load_state_dict(state['optimizer'])
+            step = state['step']
+            losses = state['losses']
+            print(f"从检查点继续: 第{step}次迭代")
+
+    while step < num_steps:
+        loss = optimizer.step(closure)
+        step += 1
+        losses.append(float(loss))
+        if checkpointer is not None and step < num_steps:
+            checkpointer.maybe_save(step, image, optimizer, losses)
+    return image, losses
+
+
+def measure_overhead(size=512, steps=20, every_steps=5):
+    """在合成的优化问题上测量检查点的开销，返回 (不保存的耗时, 保存的耗时, 统计)"""
+    import tempfile
+    import torch
+
+    target = torch.rand(1, 3, size, size)
+
+    def run(checkpointer):
+        image = torch.rand(1, 3, size, size, requires_grad=True)
+        optimizer = torch.optim.LBFGS([image], max_iter=1, history_size=100)
+
+        def closure():
+            optimizer.zero_grad()
+            loss = ((image - target) ** 2).mean() + (image[:, :, 1:] - image[:, :, :-1]).abs().mean()
+            loss.backward()
+            return loss
+
+        start = time.perf_counter()
+        run_lbfgs(image, optimizer, closure, steps, checkpointer)
+        return time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        checkpointer = Checkpointer(os.path.join(tmp_dir, 'bench.pt'), every_steps=every_steps,
+                                    every_seconds=0)
+        baseline = run(None)
+        with_checkpoints = run(checkpointer)
+        return baseline, with_checkpoints, checkpointer.stats()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='测量神经风格迁移检查点的开销')
+    parser.add_argument('--size', type=int, default=512, help='图像边长')
+    parser.add_argument('--steps', type=int, default=20, help='L-BFGS迭代次数')
+    parser.add_argument('--every', type=int, default=5, help='每隔多少次迭代保存一次')
+    args = parser.parse_args(argv)
+
+    baseline, with_checkpoints, stats = measure_overhead(args.size, args.steps, args.every)
+    print(f"不保存检查点: {baseline:.2f}秒")
+    print(f"每{args.every}次迭代保存: {with_checkpoints:.2f}秒，保存 {stats['saves']} 次，"
+          f"平均每次 {stats['avg_ms']}ms，文件 {stats['bytes'] / 1024 / 1024:.1f}MB")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,5 @@
 import os
+import sys
 from PIL import Image, ImageDraw
 import random
 import colorsys
@@ -239,38 +240,38 @@ def create_udnie_style():
     
     return img
 
-def create_style_previews():
-    """创建所有风格预览图像"""
-    # 确保目录存在
-    output_dir = os.path.join('static', 'img', 'styles')
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # 创建并保存所有风格预览图像
-    style_creators = {
-        'vangogh': create_vangogh_style,
-        'picasso': create_picasso_style,
-        'ink': create_ink_style,
-        'impression': create_impression_style,
-        'pop': create_pop_style,
-        'horror': create_horror_style,
-        'candy': create_candy_style,
-        'mosaic': create_mosaic_style,
-        'rain-princess': create_rain_princess_style,
-        'udnie': create_udnie_style
-    }
-    
-    for style_id, create_func in style_creators.items():
-        output_path = os.path.join(output_dir, f'{style_id}.jpg')
-        try:
-            img = create_func()
-            img.save(output_path)
-            print(f"创建风格预览图像: {output_path}")
-        except Exception as e:
-            print(f"创建风格预览图像失败 {style_id}: {e}")
-            # 创建一个简单的彩色矩形作为替代
-            simple_img = Image.new('RGB', (300, 300), generate_random_color())
-            simple_img.save(output_path)
-            print(f"创建简单替代图像: {output_path}")
+STYLE_CREATORS = {
+    'vangogh': create_vangogh_style,
+    'picasso': create_picasso_style,
+    'ink': create_ink_style,
+    'impression': create_impression_style,
+    'pop': create_pop_style,
+    'horror': create_horror_style,
+    'candy': create_candy_style,
+    'mosaic': create_mosaic_style,
+    'rain-princess': create_rain_princess_style,
+    'udnie': create_udnie_style
+}
+
+def render_style_image(style_id):
+    """绘制风格预览图像，失败时使用简单的彩色矩形作为替代"""
+    try:
+        return STYLE_CREATORS[style_id]()
+    except Exception as e:
+        print(f"创建风格预览图像失败 {style_id}: {e}，使用简单替代图像")
+        return Image.new('RGB', (300, 300), generate_random_color())
+
+def create_style_previews(workers=None, force=False):
+    """创建所有风格预览图像，只重新生成代码变化或缺失的风格"""
+    from preview_builder import PreviewJob, build_previews
+
+    jobs = [
+        PreviewJob(style_id, render_style_image, args=(style_id,),
+                   sources=(create_func, generate_random_color))
+        for style_id, create_func in STYLE_CREATORS.items()
+    ]
+    return build_previews(jobs, workers=workers, force=force,
+                          manifest_name='.style_images_manifest.json')
 
 if __name__ == "__main__":
-    create_style_previews()
+    create_style_previews(force='--force' in sys.argv)
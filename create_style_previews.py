@@ -1,4 +1,5 @@
 import os
+import sys
 from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageEnhance
 import random
 import colorsys
@@ -223,28 +224,32 @@ def add_style_text(img, style_name):
     
     return img
 
-def create_style_preview(style_name, output_path, size=(300, 300)):
-    """创建风格预览图像"""
-    # 根据风格名称选择不同的预览生成函数
-    style_id = output_path.split('/')[-1].split('.')[0]  # 从路径获取风格ID
-    
-    if style_id == 'vangogh':
-        img = create_vangogh_preview(size)
-    elif style_id == 'picasso':
-        img = create_picasso_preview(size)
-    elif style_id == 'ink':
-        img = create_ink_preview(size)
-    elif style_id == 'impression':
-        img = create_impression_preview(size)
-    elif style_id == 'pop':
-        img = create_pop_preview(size)
-    else:
-        # 默认创建随机背景色
-        r, g, b = random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)
-        img = Image.new('RGB', size, color=(r, g, b))
+PREVIEW_GENERATORS = {
+    'vangogh': create_vangogh_preview,
+    'picasso': create_picasso_preview,
+    'ink': create_ink_preview,
+    'impression': create_impression_preview,
+    'pop': create_pop_preview
+}
+
+def create_random_preview(size=(300, 300)):
+    """没有专门生成函数的风格使用随机背景色"""
+    r, g, b = random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)
+    return Image.new('RGB', size, color=(r, g, b))
+
+def render_style_preview(style_id, style_name, size=(300, 300)):
+    """绘制带风格名称的预览图像"""
+    # 根据风格ID选择不同的预览生成函数
+    create_func = PREVIEW_GENERATORS.get(style_id, create_random_preview)
+    img = create_func(size)
     
     # 添加风格名称文字
-    img = add_style_text(img, style_name)
+    return add_style_text(img, style_name)
+
+def create_style_preview(style_name, output_path, size=(300, 300)):
+    """创建风格预览图像"""
+    style_id = os.path.splitext(os.path.basename(output_path))[0]  # 从路径获取风格ID
+    img = render_style_preview(style_id, style_name, size)
     
     # 保存图像
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
@@ -252,8 +257,10 @@ def create_style_preview(style_name, output_path, size=(300, 300)):
     
     return output_path
 
-def create_all_style_previews():
-    """创建所有风格预览图像"""
+def create_all_style_previews(workers=None, force=False):
+    """创建所有风格预览图像，只重新生成代码或参数变化的风格"""
+    from preview_builder import PreviewJob, build_previews
+
     styles = {
         'vangogh': '梵高星空',
         'picasso': '毕加索立体派',
@@ -262,10 +269,13 @@ def create_all_style_previews():
         'pop': '波普艺术'
     }
     
-    for style_id, style_name in styles.items():
-        output_path = os.path.join('static', 'img', 'styles', f'{style_id}.jpg')
-        create_style_preview(style_name, output_path)
-        print(f"Created style preview for {style_name} at {output_path}")
+    jobs = [
+        PreviewJob(style_id, render_style_preview, args=(style_id, style_name),
+                   sources=(PREVIEW_GENERATORS.get(style_id, create_random_preview), add_style_text))
+        for style_id, style_name in styles.items()
+    ]
+    return build_previews(jobs, workers=workers, force=force,
+                          manifest_name='.style_previews_manifest.json')
 
 if __name__ == "__main__":
-    create_all_style_previews()
+    create_all_style_previews(force='--force' in sys.argv)
@@ -0,0 +1,168 @@
+"""把快速风格迁移模型导出为TorchScript和ONNX，并与eager模式对比延迟
+
+导出文件保存在 models/pretrained/<style>.ts.pt 和 <style>.onnx，
+检查结果（与eager输出的最大误差、各后端延迟）写入 <style>.export.json。
+部署时通过 FAST_BACKEND=torchscript / onnx 选择后端，见 fast_runtime.py。
+
+用法:
+    python export_models.py                        # 导出 models/pretrained 下所有 .pth
+    python export_models.py --styles vangogh --formats onnx --size 512
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+from datetime import datetime
+
+import numpy as np
+
+from fast_runtime import (PRETRAINED_DIR, ONNXRUNTIME_AVAILABLE, OnnxModel, model_paths, source_signature,
+                          load_fp32, read_export_meta, value_range)
+
+FORMATS = ('torchscript', 'onnx')
+# 导出模型与eager输出的最大允许误差（按模型的输出范围归一化到 [0, 1]）
+MAX_ABS_DIFF = 1e-3
+
+
+def export_torchscript(model, example, path):
+    """追踪并冻结模型"""
+    import torch
+
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+    traced = torch.jit.freeze(traced)
+    optimize = getattr(torch.jit, 'optimize_for_inference', None)
+    if optimize is not None:
+        traced = optimize(traced)
+    traced.save(path)
+
+
+def export_onnx(model, example, path, opset):
+    """导出高宽可变的ONNX模型"""
+    import torch
+
+    dynamic_axes = {'input': {2: 'height', 3: 'width'}, 'output': {2: 'height', 3: 'width'}}
+    with torch.no_grad():
+        torch.onnx.export(model, example, path, input_names=['input'], output_names=['output'],
+                          dynamic_axes=dynamic_axes, opset_version=opset)
+
+
+def measure_latency(run, repeats, warmup=2):
+    """中位数延迟（毫秒）"""
+    for _ in range(warmup):
+        run()
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.median(latencies)
+
+
+def export_style(style, formats, args):
+    """导出一个风格的模型，返回元数据"""
+    import torch
+
+    paths = model_paths(style, args.pretrained_dir)
+    # 导出使用默认内存布局，channels-last由运行时决定
+    model = load_fp32(paths['fp32'], channels_last=False)
+    scale = value_range(style, args.pretrained_dir)
+    rng = np.random.default_rng(0)
+    example = torch.from_numpy(rng.random((1, 3, args.size, args.size), dtype=np.float32) * scale)
+    # 用不同尺寸的输入检查导出模型，确认高宽可变
+    check = torch.from_numpy(rng.random((1, 3, args.size // 2, args.size // 2 + 16), dtype=np.float32) * scale)
+
+    with torch.no_grad():
+        reference = model(check).numpy()
+        eager_ms = measure_latency(lambda: model(example), args.repeats)
+    meta = {
+        'style': style,
+        'source': source_signature(paths['fp32']),
+        'torch': torch.__version__,
+        'exported_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'size': args.size,
+        'eager_ms': round(eager_ms, 2),
+        'artifacts': [],
+        'results': {}
+    }
+
+    for fmt in formats:
+        try:
+            if fmt == 'torchscript':
+                export_torchscript(model, example, paths['torchscript'])
+                exported = torch.jit.load(paths['torchscript'], map_location='cpu')
+                with torch.no_grad():
+                    output = exported(check).numpy()
+                    latency = measure_latency(lambda: exported(example), args.repeats)
+            else:
+                export_onnx(model, example, paths['onnx'], args.opset)
+                if not ONNXRUNTIME_AVAILABLE:
+                    # 没有onnxruntime时无法检查，运行时也不会使用
+                    meta['results'][fmt] = {'error': 'onnxruntime未安装，未检查'}
+                    continue
+                exported = OnnxModel(paths['onnx'])
+                output = exported(check.numpy())
+                example_array = example.numpy()
+                latency = measure_latency(lambda: exported(example_array), args.repeats)
+        except Exception as e:
+            meta['results'][fmt] = {'error': str(e)}
+            continue
+
+        max_diff = float(np.abs(output - reference).max()) / scale
+        meta['results'][fmt] = {
+            'ms': round(latency, 2),
+            'speedup': round(eager_ms / latency, 2),
+            'max_abs_diff': max_diff
+        }
+        if max_diff <= args.max_diff:
+            meta['artifacts'].append(fmt)
+        else:
+            meta['results'][fmt]['error'] = f'与eager输出误差过大 ({max_diff:.2e})'
+
+    with open(paths['export_meta'], 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='导出TorchScript/ONNX模型并与eager模式对比延迟')
+    parser.add_argument('--styles', nargs='*', help='要导出的风格，默认导出所有.pth模型')
+    parser.add_argument('--pretrained-dir', default=PRETRAINED_DIR)
+    parser.add_argument('--formats', nargs='+', default=list(FORMATS), choices=FORMATS)
+    parser.add_argument('--size', type=int, default=512, help='导出和测量延迟使用的图像边长')
+    parser.add_argument('--opset', type=int, default=11)
+    parser.add_argument('--repeats', type=int, default=10, help='延迟测量次数')
+    parser.add_argument('--max-diff', type=float, default=MAX_ABS_DIFF)
+    parser.add_argument('--force', action='store_true', help='来源模型没有变化时也重新导出')
+    args = parser.parse_args(argv)
+
+    styles = args.styles or sorted(f[:-4] for f in os.listdir(args.pretrained_dir) if f.endswith('.pth'))
+    failed = 0
+    print(f"{'风格':12s} {'后端':12s} {'延迟(ms)':>9s} {'加速':>6s} {'最大误差':>10s}  结果")
+    for style in styles:
+        meta = None if args.force else read_export_meta(style, args.pretrained_dir)
+        if meta is not None and all(fmt in meta['artifacts'] for fmt in args.formats):
+            print(f"{style:12s} 已是最新（{', '.join(meta['artifacts'])}）")
+            continue
+        try:
+            meta = export_style(style, args.formats, args)
+        except Exception as e:
+            failed += 1
+            print(f"{style:12s} 导出失败: {e}")
+            continue
+
+        print(f"{style:12s} {'eager':12s} {meta['eager_ms']:9.1f}")
+        for fmt, result in meta['results'].items():
+            if 'ms' in result:
+                print(f"{style:12s} {fmt:12s} {result['ms']:9.1f} {result['speedup']:5.2f}x "
+                      f"{result['max_abs_diff']:10.2e}  {result.get('error', '可用')}")
+            else:
+                failed += 1
+                print(f"{style:12s} {fmt:12s} {result['error']}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,341 @@
+"""快速风格迁移（TransformerNet）的CPU推理运行时
+
+每个风格可以使用两种模型变体:
+    fp32  models/pretrained/<style>.pth 原始模型
+    int8  models/pretrained/<style>.int8.pt 由 quantize_models.py 预先生成的量化模型，
+          同目录下的 <style>.int8.json 记录来源模型签名、质量和延迟数据
+
+两种变体都使用channels-last内存布局。int8模型缺失、过期（来源.pth已变化）或
+未通过质量检查时自动回退到fp32。torch在第一次加载模型时才导入。
+
+fp32模型可以选择执行后端（按部署配置）:
+    eager        在PyTorch中逐层执行TransformerNet
+    torchscript  export_models.py导出的 <style>.ts.pt，省去逐层的Python调度
+    onnx         export_models.py导出的 <style>.onnx，使用ONNX Runtime的CPU provider执行，
+                 推理过程不需要导入torch
+导出文件缺失、过期或onnxruntime未安装时依次回退到torchscript和eager。
+int8模型本身就是TorchScript，不受后端配置影响。
+
+模型输入输出的像素范围按模型配置: 默认与常见的TransformerNet一致为0~255，
+输出经过Sigmoid归一化到0~1的模型在 models/pretrained/<style>.json 中写 {"value_range": 1}。
+"""
+import os
+import json
+import platform
+import threading
+import importlib.util
+
+import metrics
+import thread_budget
+from timing import stage
+
+PRETRAINED_DIR = os.path.join('models', 'pretrained')
+VARIANTS = ('fp32', 'int8')
+BACKENDS = ('eager', 'torchscript', 'onnx')
+ONNXRUNTIME_AVAILABLE = importlib.util.find_spec('onnxruntime') is not None
+# 模型输入输出的像素范围上限，可以在 <style>.json 中按模型覆盖
+DEFAULT_VALUE_RANGE = 255.0
+
+
+def model_paths(style, pretrained_dir=PRETRAINED_DIR):
+    """风格各模型变体的文件路径"""
+    base = os.path.join(pretrained_dir, style)
+    return {
+        'fp32': f'{base}.pth',
+        'model_meta': f'{base}.json',
+        'int8': f'{base}.int8.pt',
+        'int8_meta': f'{base}.int8.json',
+        'torchscript': f'{base}.ts.pt',
+        'onnx': f'{base}.onnx',
+        'export_meta': f'{base}.export.json'
+    }
+
+
+def value_range(style, pretrained_dir=PRETRAINED_DIR):
+    """模型输入输出的像素范围上限，没有模型配置时使用DEFAULT_VALUE_RANGE"""
+    try:
+        with open(model_paths(style, pretrained_dir)['model_meta'], encoding='utf-8') as f:
+            return float(json.load(f).get('value_range', DEFAULT_VALUE_RANGE))
+    except (OSError, ValueError):
+        return DEFAULT_VALUE_RANGE
+
+
+def source_signature(path):
+    """来源模型的签名，模型文件被替换后已生成的量化模型随之失效"""
+    st = os.stat(path)
+    return f'{st.st_size}:{st.st_mtime_ns}'
+
+
+def parse_variants(spec):
+    """解析 'vangogh=int8,ink=fp32' 形式的按风格配置"""
+    overrides = {}
+    for item in (spec or '').split(','):
+        if not item.strip():
+            continue
+        style, _, variant = item.partition('=')
+        variant = variant.strip()
+        if variant not in VARIANTS:
+            raise ValueError(f"未知的模型变体: {item}")
+        overrides[style.strip()] = variant
+    return overrides
+
+
+def default_quantized_engine():
+    """x86使用fbgemm，ARM使用qnnpack"""
+    machine = platform.machine().lower()
+    return 'qnnpack' if machine.startswith(('arm', 'aarch')) else 'fbgemm'
+
+
+def set_quantized_engine(engine):
+    import torch
+    if engine not in torch.backends.quantized.supported_engines:
+        raise RuntimeError(f"当前torch不支持量化后端 {engine}")
+    torch.backends.quantized.engine = engine
+
+
+def load_fp32(path, channels_last=True):
+    """加载原始的TransformerNet模型"""
+    import torch
+    from models.fast_transfer import TransformerNet
+
+    thread_budget.apply_torch()
+    model = TransformerNet()
+    state = torch.load(path, map_location='cpu')
+    # 部分检查点保存的是包含state_dict的字典
+    if isinstance(state, dict) and 'state_dict' in state:
+        state = state['state_dict']
+    model.load_state_dict(state)
+    model.eval()
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    return model
+
+
+def _read_meta(style, key, pretrained_dir):
+    """读取生成文件的元数据，来源模型已变化时返回None"""
+    paths = model_paths(style, pretrained_dir)
+    try:
+        with open(paths[key], encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not os.path.exists(paths['fp32']) or meta.get('source') != source_signature(paths['fp32']):
+        return None
+    return meta
+
+
+def read_int8_meta(style, pretrained_dir=PRETRAINED_DIR):
+    """读取量化模型的元数据，来源模型已变化时返回None"""
+    return _read_meta(style, 'int8_meta', pretrained_dir)
+
+
+def read_export_meta(style, pretrained_dir=PRETRAINED_DIR):
+    """读取导出模型的元数据，来源模型已变化时返回None"""
+    return _read_meta(style, 'export_meta', pretrained_dir)
+
+
+def load_int8(style, pretrained_dir=PRETRAINED_DIR):
+    """加载通过质量检查的量化模型，不可用时返回None"""
+    meta = read_int8_meta(style, pretrained_dir)
+    if meta is None or not meta.get('accepted'):
+        return None
+    import torch
+    thread_budget.apply_torch()
+    set_quantized_engine(meta['engine'])
+    model = torch.jit.load(model_paths(style, pretrained_dir)['int8'], map_location='cpu')
+    model.eval()
+    return model
+
+
+class OnnxModel:
+    """ONNX Runtime推理会话，输入输出都是 [1, 3, H, W] 的numpy数组"""
+
+    def __init__(self, path):
+        import onnxruntime
+
+        providers = [p for p in ('CPUExecutionProvider',) if p in onnxruntime.get_available_providers()]
+        options = onnxruntime.SessionOptions()
+        budget = thread_budget.current()
+        if budget is not None:
+            options.intra_op_num_threads = budget.intra_op
+            options.inter_op_num_threads = budget.inter_op
+        self.session = onnxruntime.InferenceSession(path, sess_options=options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, array):
+        return self.session.run(None, {self.input_name: array})[0]
+
+
+def load_exported(style, backend, pretrained_dir=PRETRAINED_DIR):
+    """加载export_models.py导出的模型，不可用时返回None"""
+    meta = read_export_meta(style, pretrained_dir)
+    if meta is None or backend not in meta.get('artifacts', []):
+        return None
+    path = model_paths(style, pretrained_dir)[backend]
+    if backend == 'onnx':
+        return OnnxModel(path) if ONNXRUNTIME_AVAILABLE else None
+    import torch
+    thread_budget.apply_torch()
+    model = torch.jit.load(path, map_location='cpu')
+    model.eval()
+    return model
+
+
+def to_array(image, value_range=DEFAULT_VALUE_RANGE):
+    """PIL图像 → [1, 3, H, W] 的 [0, value_range] float32数组"""
+    import numpy as np
+
+    array = np.asarray(image.convert('RGB'), dtype=np.float32) * (value_range / 255.0)
+    return np.ascontiguousarray(array.transpose(2, 0, 1)[np.newaxis])
+
+
+def from_array(array, value_range=DEFAULT_VALUE_RANGE):
+    """模型输出（[0, value_range]，超出部分截断）→ PIL图像"""
+    import numpy as np
+    from PIL import Image
+
+    array = np.clip(array[0].transpose(1, 2, 0), 0, value_range) * (255.0 / value_range)
+    return Image.fromarray(array.round().astype(np.uint8))
+
+
+def to_tensor(image, channels_last=True, value_range=DEFAULT_VALUE_RANGE):
+    """PIL图像 → [1, 3, H, W] 的 [0, value_range] 张量"""
+    import torch
+
+    tensor = torch.from_numpy(to_array(image, value_range))
+    if channels_last:
+        return tensor.contiguous(memory_format=torch.channels_last)
+    return tensor
+
+
+def from_tensor(tensor, value_range=DEFAULT_VALUE_RANGE):
+    """模型输出张量 → PIL图像"""
+    return from_array(tensor.detach().contiguous().numpy(), value_range)
+
+
+class FastModelPool:
+    """按风格缓存已加载的模型，每个风格可以单独选择fp32或int8，fp32模型使用配置的执行后端"""
+
+    def __init__(self, default_variant='fp32', overrides=None, pretrained_dir=PRETRAINED_DIR, channels_last=True,
+                 backend='eager'):
+        if default_variant not in VARIANTS:
+            raise ValueError(f"未知的模型变体: {default_variant}")
+        if backend not in BACKENDS:
+            raise ValueError(f"未知的执行后端: {backend}")
+        self.default_variant = default_variant
+        self.overrides = overrides or {}
+        self.backend = backend
+        self.pretrained_dir = pretrained_dir
+        self.channels_last = channels_last
+        self._models = {}
+        self._value_ranges = {}
+        self._lock = threading.Lock()
+
+    def variant_for(self, style):
+        return self.overrides.get(style, self.default_variant)
+
+    def _load(self, style, variant):
+        if variant == 'int8':
+            model = load_int8(style, self.pretrained_dir)
+            if model is not None:
+                return model, 'int8'
+            print(f"风格 {style} 没有可用的int8模型，使用fp32")
+        # 按 onnx → torchscript → eager 的顺序回退
+        candidates = BACKENDS[BACKENDS.index(self.backend):0:-1]
+        for backend in candidates:
+            model = load_exported(style, backend, self.pretrained_dir)
+            if model is not None:
+                return model, f'fp32/{backend}'
+            print(f"风格 {style} 没有可用的{backend}模型，尝试下一个后端")
+        return load_fp32(model_paths(style, self.pretrained_dir)['fp32'], self.channels_last), 'fp32/eager'
+
+    def get(self, style):
+        """返回 (模型, 实际使用的变体和后端)"""
+        key = (style, self.variant_for(style))
+        entry = self._models.get(key)
+        if entry is None:
+            with self._lock:
+                entry = self._models.get(key)
+                if entry is None:
+                    metrics.MODEL_POOL_REQUESTS.inc(result='miss')
+                    entry = self._models[key] = self._load(*key)
+                    return entry
+        metrics.MODEL_POOL_REQUESTS.inc(result='hit')
+        return entry
+
+    def value_range(self, style):
+        if style not in self._value_ranges:
+            self._value_ranges[style] = value_range(style, self.pretrained_dir)
+        return self._value_ranges[style]
+
+    def stylize(self, image, style):
+        """对PIL图像应用风格，返回PIL图像"""
+        model, _ = self.get(style)
+        scale = self.value_range(style)
+        if isinstance(model, OnnxModel):
+            with stage('infer'):
+                return from_array(model(to_array(image, scale)), scale)
+
+        import torch
+        with stage('infer'), torch.no_grad():
+            output = model(to_tensor(image, self.channels_last, scale))
+        return from_tensor(output, scale)
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._value_ranges.clear()
+
+
+def create_model_pool(config):
+    """根据Flask配置创建模型池，没有启用时返回None"""
+    overrides = parse_variants(config.get('FAST_MODEL_VARIANTS'))
+    default_variant = config.get('FAST_MODEL_VARIANT')
+    backend = config.get('FAST_BACKEND') or 'eager'
+    if not default_variant and not overrides and backend == 'eager':
+        return None
+    return FastModelPool(default_variant or 'fp32', overrides, backend=backend)
+
+
+def attach_model_pool(controller, pool, reduced_fraction=None, reduced_min_pixels=0):
+    """让风格控制器的快速迁移使用模型池，模型池无法处理的风格仍使用控制器原有实现
+
+    设置reduced_fraction时，不小于reduced_min_pixels的图像先缩小处理再引导上采样回原尺寸。
+    """
+    import guided_upsample
+
+    original = getattr(controller, 'fast_style_transfer', None)
+    if original is None:
+        print("风格控制器没有fast_style_transfer方法，不使用模型池")
+        return controller
+
+    def fast_style_transfer(content_path, style, output_path, *args, **kwargs):
+        from PIL import Image
+
+        if not os.path.exists(model_paths(style, pool.pretrained_dir)['fp32']):
+            return original(content_path, style, output_path, *args, **kwargs)
+        try:
+            # 各阶段记录在请求的Server-Timing中
+            with stage('decode'):
+                with Image.open(content_path) as image:
+                    image = image.convert('RGB')
+            reduced_size = guided_upsample.plan_reduction(content_path, reduced_fraction, reduced_min_pixels)
+            if reduced_size is None:
+                result = pool.stylize(image, style)
+            else:
+                with stage('resize'):
+                    reduced = image.resize(reduced_size, Image.LANCZOS)
+                low_res = pool.stylize(reduced, style)
+                with stage('upsample'):
+                    result = guided_upsample.guided_upsample(image, low_res)
+        except Exception as e:
+            # 例如run_simplified.py创建的占位模型文件
+            print(f"模型池处理风格 {style} 失败，使用控制器原有实现: {e}")
+            return original(content_path, style, output_path, *args, **kwargs)
+        with stage('encode'):
+            result.save(output_path)
+        return output_path
+
+    controller.fast_style_transfer = fast_style_transfer
+    controller.fast_model_pool = pool
+    return controller
@@ -0,0 +1,213 @@
+import os
+import sys
+import time
+import argparse
+
+from app import media_store, rate_limiter, get_db_connection, execute_query
+
+# 每个媒体类型对应的数据库引用: (表名, 字段名)
+REFERENCES = {
+    'originals': [('user_uploads', 'original_image'), ('user_results', 'original_image')],
+    'results': [('user_results', 'result_image')]
+}
+
+
+class GcReport:
+    """记录一次回收的统计结果"""
+
+    def __init__(self):
+        self.deleted = {}
+        self.total_bytes = 0
+        self.remaining_bytes = 0
+        self.purged_buckets = 0
+
+    def add(self, category, size):
+        count, total = self.deleted.get(category, (0, 0))
+        self.deleted[category] = (count + 1, total + size)
+
+    def show(self, dry_run, budget):
+        print("==== 媒体文件回收报告{} ====".format(' (dry-run)' if dry_run else ''))
+        print(f"回收前占用: {format_size(self.total_bytes)}")
+        for category, (count, size) in sorted(self.deleted.items()):
+            print(f"  {category}: {count} 个文件, {format_size(size)}")
+        print(f"回收后占用: {format_size(self.remaining_bytes)}")
+        print(f"闲置的限流令牌桶: {self.purged_buckets} 个")
+        if budget and self.remaining_bytes > budget:
+            print(f"警告: 仍超出预算 {format_size(budget)}，剩余文件都被数据库记录引用")
+
+
+def format_size(size):
+    """把字节数格式化为可读字符串"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+
+# 旧版本写入的引用可能带目录前缀（例如多风格融合的结果保存为 uploads/results/<文件名>），
+# relayout_media.py 会统一为文件名，未迁移前也必须把这些记录当作引用
+LEGACY_PREFIXES = {
+    'originals': ['uploads/', 'static/uploads/'],
+    'results': ['uploads/results/', 'static/uploads/results/']
+}
+
+
+def reference_forms(name, kind):
+    """文件名在数据库中可能出现的所有写法"""
+    forms = [name]
+    for prefix in LEGACY_PREFIXES.get(kind, []):
+        forms.append(prefix + name)
+        forms.append((prefix + name).replace('/', '\\'))
+    return forms
+
+
+def find_referenced(names, kind, batch_size):
+    """分批查询数据库，返回names中被记录引用的文件名集合（包括带旧目录前缀的引用）"""
+    referenced = set()
+    names = list(names)
+    # 每个文件名展开为多种写法，保持每次查询的参数个数不超过batch_size
+    step = max(1, batch_size // len(reference_forms('', kind)))
+    conn = get_db_connection()
+    try:
+        for start in range(0, len(names), step):
+            values = [form for name in names[start:start + step] for form in reference_forms(name, kind)]
+            placeholders = ', '.join('?' for _ in values)
+            for table, column in REFERENCES[kind]:
+                rows = execute_query(conn, f'SELECT {column} FROM {table} WHERE {column} IN ({placeholders})',
+                                     tuple(values), fetchall=True)
+                referenced.update(os.path.basename(row[column].replace('\\', '/')) for row in rows)
+    finally:
+        conn.close()
+    return referenced
+
+
+def scan(kind):
+    """扫描目录，返回 {文件名: (完整路径, 大小, 最近访问时间)}"""
+    files = {}
+    if not os.path.isdir(media_store.root(kind)):
+        return files
+    for name, path in media_store.iter_files(kind):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        # 挂载了noatime/relatime时atime可能不更新，取atime和mtime中较新的一个
+        files[name] = (path, st.st_size, max(st.st_atime, st.st_mtime))
+    return files
+
+
+def collect(budget=None, min_age=24 * 3600, temp_age=3600, base_age=7 * 24 * 3600, batch_size=500, dry_run=False,
+            bucket_age=7 * 24 * 3600):
+    """执行一次回收
+
+    1. 删除超过temp_age的临时文件
+    2. 删除超过base_age未被使用的风格化底图缓存
+    3. 删除超过min_age且不被数据库引用的原图和结果图（匿名用户的结果、已删除记录的原图），
+       以及超过min_age未更新的神经风格迁移检查点
+    4. 总占用超过budget时，按最近访问时间从旧到新继续删除未被引用的文件
+    5. 删除超过bucket_age未使用的限流令牌桶记录
+    """
+    now = time.time()
+    report = GcReport()
+    # 可以被删除的候选文件: (最近访问时间, 类别, 完整路径, 大小)
+    candidates = []
+
+    temp_files = scan('temp')
+    for name, (path, size, accessed) in temp_files.items():
+        report.total_bytes += size
+        candidates.append((accessed, 'temp', path, size))
+
+    # 底图缓存随时可以重新生成，命中时会更新修改时间
+    for name, (path, size, accessed) in scan('bases').items():
+        report.total_bytes += size
+        candidates.append((accessed, 'bases', path, size))
+
+    # 运行中的神经风格迁移会定期更新检查点，长期未更新的属于已失败的任务
+    for name, (path, size, accessed) in scan('checkpoints').items():
+        report.total_bytes += size
+        candidates.append((accessed, 'checkpoints', path, size))
+
+    for kind in ('originals', 'results'):
+        files = scan(kind)
+        report.total_bytes += sum(size for _, size, _ in files.values())
+        referenced = find_referenced(files.keys(), kind, batch_size)
+        for name, (path, size, accessed) in files.items():
+            if name not in referenced:
+                candidates.append((accessed, f'{kind}(未引用)', path, size))
+
+    remaining = report.total_bytes
+    kept = []
+    for accessed, category, path, size in candidates:
+        max_age = {'temp': temp_age, 'bases': base_age}.get(category, min_age)
+        if now - accessed > max_age:
+            _remove(path, dry_run)
+            report.add(category, size)
+            remaining -= size
+        else:
+            kept.append((accessed, category, path, size))
+
+    if budget and remaining > budget:
+        # 超出预算时按LRU淘汰尚在保留期内的未引用文件
+        kept.sort()
+        for accessed, category, path, size in kept:
+            if remaining <= budget:
+                break
+            _remove(path, dry_run)
+            report.add(f'{category}(超出预算)', size)
+            remaining -= size
+
+    report.remaining_bytes = remaining
+    report.purged_buckets = rate_limiter.purge_idle(bucket_age, dry_run)
+    return report
+
+
+def _remove(path, dry_run):
+    """删除文件，文件已经不存在时忽略"""
+    if dry_run:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def parse_size(value):
+    """解析 500M / 20G 形式的大小"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    value = value.strip().upper().rstrip('B')
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='回收无用的结果图、原图、底图缓存和临时文件')
+    parser.add_argument('--budget', type=parse_size, default=None, help='上传目录的总大小预算，如 20G')
+    parser.add_argument('--min-age', type=float, default=24, help='未引用的原图/结果图至少保留的小时数')
+    parser.add_argument('--temp-age', type=float, default=1, help='临时文件至少保留的小时数')
+    parser.add_argument('--base-age', type=float, default=7 * 24, help='风格化底图缓存未被使用时保留的小时数')
+    parser.add_argument('--bucket-age', type=float, default=7 * 24, help='限流令牌桶未被使用时保留的小时数')
+    parser.add_argument('--batch-size', type=int, default=500, help='每次数据库查询检查的文件数')
+    parser.add_argument('--dry-run', action='store_true', help='只输出报告，不删除文件')
+    parser.add_argument('--interval', type=float, default=0, help='大于0时作为后台进程每隔若干分钟执行一次')
+    args = parser.parse_args(argv)
+
+    while True:
+        report = collect(
+            budget=args.budget,
+            min_age=args.min_age * 3600,
+            temp_age=args.temp_age * 3600,
+            base_age=args.base_age * 3600,
+            batch_size=args.batch_size,
+            dry_run=args.dry_run,
+            bucket_age=args.bucket_age * 3600
+        )
+        report.show(args.dry_run, args.budget)
+        if args.interval <= 0:
+            return 0
+        time.sleep(args.interval * 60)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,30 @@
+"""gunicorn部署配置
+
+    gunicorn -c gunicorn.conf.py app:app
+
+worker数取WEB_CONCURRENCY（默认2）。每个worker在导入app之前按 thread_budget 分配线程，
+设置 THREAD_BUDGET_PIN=1 时同时把每个worker绑定到独立的一组核心。gunicorn没有固定的worker编号，
+这里在master中为每个新worker分配当前没有被其他worker使用的最小编号，worker重启后沿用空出的编号，
+绑定的核心不会重叠。
+"""
+import os
+
+import thread_budget
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY') or 2)
+timeout = 120
+
+THREAD_BUDGET_PIN = os.environ.get('THREAD_BUDGET_PIN', '0') == '1'
+
+
+def pre_fork(server, worker):
+    """在master中为即将启动的worker分配编号"""
+    used = {getattr(other, 'budget_index', None) for other in server.WORKERS.values()}
+    worker.budget_index = next(index for index in range(len(used) + 1) if index not in used)
+
+
+def post_fork(server, worker):
+    """在worker进程中分配线程，app导入时发现已经分配过就不再重复"""
+    thread_budget.configure(server.num_workers, worker_index=worker.budget_index, pin_cores=THREAD_BUDGET_PIN)
+
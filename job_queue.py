@@ -0,0 +1,280 @@
+"""持久化的任务队列
+
+任务保存在应用的数据库中（SQLite或DB_CONFIG配置的MySQL），不需要额外的消息队列服务。
+Web进程只负责入队，独立的 worker.py 进程领取并执行，两者可以分别扩容，
+只要共享数据库和 static/uploads 存储即可部署在不同机器上。
+
+领取任务时写入租约（lease_until）和随机的领取标记，执行期间worker定期续约（心跳）。
+worker崩溃或失去连接后租约过期，任务会被其他worker重新领取；超过最大尝试次数后标记为失败。
+"""
+import json
+import time
+import uuid
+import threading
+
+# 任务状态
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+SQLITE_DDL = '''
+CREATE TABLE IF NOT EXISTS style_jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    lane TEXT NOT NULL,
+    owner TEXT,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    worker TEXT,
+    claim_token TEXT,
+    lease_until REAL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    result TEXT,
+    error TEXT
+)
+'''
+
+MYSQL_DDL = '''
+CREATE TABLE IF NOT EXISTS style_jobs (
+    id VARCHAR(64) PRIMARY KEY,
+    kind VARCHAR(32) NOT NULL,
+    lane VARCHAR(32) NOT NULL,
+    owner VARCHAR(128),
+    payload TEXT NOT NULL,
+    state VARCHAR(16) NOT NULL,
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL DEFAULT 3,
+    worker VARCHAR(128),
+    claim_token VARCHAR(32),
+    lease_until DOUBLE,
+    created DOUBLE NOT NULL,
+    updated DOUBLE NOT NULL,
+    result TEXT,
+    error TEXT,
+    INDEX idx_style_jobs_claim (state, lane, created)
+)
+'''
+
+
+def create_table(conn, mysql=False):
+    """创建任务表，已存在时不做任何事"""
+    if mysql:
+        cursor = conn.cursor()
+        cursor.execute(MYSQL_DDL)
+        cursor.close()
+    else:
+        conn.execute(SQLITE_DDL)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_style_jobs_claim ON style_jobs (state, lane, created)')
+    conn.commit()
+
+
+class QueuedJob:
+    """一个已被领取的任务"""
+
+    def __init__(self, row, claim_token):
+        self.id = row['id']
+        self.kind = row['kind']
+        self.lane = row['lane']
+        self.owner = row['owner']
+        self.payload = json.loads(row['payload'])
+        self.attempts = row['attempts']
+        self.max_attempts = row['max_attempts']
+        self.claim_token = claim_token
+
+
+class JobInterrupted(Exception):
+    """处理函数响应JobControl的信号中断了任务"""
+
+
+class JobControl:
+    """worker传给任务处理函数的中断信号
+
+    stopping: worker正在退出，能保存进度的处理函数保存后抛出JobInterrupted，任务被交还队列
+    lost: 租约已丢失，任务可能已被其他worker接管，处理函数应尽快停止，不再写入任何中间状态
+    处理函数保存了进度（例如检查点）时调用progress()
+    """
+
+    def __init__(self, stopping=None, on_progress=None):
+        self.stopping = stopping or threading.Event()
+        self.lost = threading.Event()
+        self.on_progress = on_progress
+
+    def progress(self):
+        if self.on_progress is not None and not self.lost.is_set():
+            self.on_progress()
+
+
+class JobQueue:
+    """基于数据库表的任务队列
+
+    connect(): 返回新的数据库连接
+    execute(conn, query, params, fetchall, commit): 与app.execute_query相同的查询函数
+    """
+
+    def __init__(self, connect, execute, lease_seconds=60, max_attempts=3):
+        self.connect = connect
+        self.execute = execute
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def enqueue(self, kind, payload, lane='simplified', owner=None, job_id=None):
+        """加入一个任务，返回任务id"""
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        conn = self.connect()
+        try:
+            self.execute(conn, '''
+                INSERT INTO style_jobs (id, kind, lane, owner, payload, state, attempts, max_attempts, created, updated)
+                VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?, ?)
+            ''', (job_id, kind, lane, owner, json.dumps(payload, ensure_ascii=False), QUEUED, self.max_attempts,
+                  now, now), commit=True)
+        finally:
+            conn.close()
+        return job_id
+
+    def claim(self, worker, lanes=None):
+        """领取一个排队中或租约已过期的任务，没有任务时返回None
+
+        先查询候选任务，再用带条件的UPDATE抢占，多个worker同时领取同一个任务时
+        只有写入的领取标记与自己相同的worker成功。
+        """
+        conn = self.connect()
+        try:
+            now = time.time()
+            lane_filter = ''
+            params = [QUEUED, RUNNING, now]
+            if lanes:
+                lane_filter = f" AND lane IN ({', '.join('?' for _ in lanes)})"
+                params.extend(lanes)
+            candidates = self.execute(conn, f'''
+                SELECT id FROM style_jobs
+                WHERE (state = ? OR (state = ? AND lease_until < ?)){lane_filter}
+                ORDER BY created LIMIT 5
+            ''', tuple(params), fetchall=True)
+
+            for candidate in candidates:
+                token = uuid.uuid4().hex
+                self.execute(conn, '''
+                    UPDATE style_jobs
+                    SET state = ?, worker = ?, claim_token = ?, lease_until = ?, attempts = attempts + 1, updated = ?
+                    WHERE id = ? AND (state = ? OR (state = ? AND lease_until < ?))
+                ''', (RUNNING, worker, token, now + self.lease_seconds, now, candidate['id'], QUEUED, RUNNING, now),
+                    commit=True)
+                row = self.execute(conn, 'SELECT * FROM style_jobs WHERE id = ?', (candidate['id'],))
+                if row is None or row['claim_token'] != token:
+                    continue
+                if row['attempts'] > row['max_attempts']:
+                    # 多次领取后都没有完成（例如每次都让worker崩溃），不再重试
+                    self._finish(conn, row['id'], token, FAILED, error='超过最大尝试次数')
+                    continue
+                return QueuedJob(row, token)
+            return None
+        finally:
+            conn.close()
+
+    def heartbeat(self, job):
+        """续约，返回False表示租约已经丢失（任务被其他worker接管）"""
+        conn = self.connect()
+        try:
+            now = time.time()
+            self.execute(conn, '''
+                UPDATE style_jobs SET lease_until = ?, updated = ? WHERE id = ? AND claim_token = ? AND state = ?
+            ''', (now + self.lease_seconds, now, job.id, job.claim_token, RUNNING), commit=True)
+            row = self.execute(conn, 'SELECT claim_token, state FROM style_jobs WHERE id = ?', (job.id,))
+            return row is not None and row['claim_token'] == job.claim_token and row['state'] == RUNNING
+        finally:
+            conn.close()
+
+    def complete(self, job, result):
+        conn = self.connect()
+        try:
+            self._finish(conn, job.id, job.claim_token, DONE, result=result)
+        finally:
+            conn.close()
+
+    def fail(self, job, error):
+        """任务失败，未超过最大尝试次数时重新排队"""
+        conn = self.connect()
+        try:
+            if job.attempts < job.max_attempts:
+                self.execute(conn, '''
+                    UPDATE style_jobs SET state = ?, worker = NULL, claim_token = NULL, lease_until = NULL,
+                        error = ?, updated = ?
+                    WHERE id = ? AND claim_token = ?
+                ''', (QUEUED, error, time.time(), job.id, job.claim_token), commit=True)
+            else:
+                self._finish(conn, job.id, job.claim_token, FAILED, error=error)
+        finally:
+            conn.close()
+
+    def reset_attempts(self, job):
+        """任务保存了新的进度，之前的崩溃不再计入尝试次数
+
+        可以从检查点继续的任务被多次抢占时仍在推进，只有连续多次没有进展才标记为失败。
+        """
+        conn = self.connect()
+        try:
+            self.execute(conn, '''
+                UPDATE style_jobs SET attempts = 1, updated = ? WHERE id = ? AND claim_token = ?
+            ''', (time.time(), job.id, job.claim_token), commit=True)
+        finally:
+            conn.close()
+        job.attempts = 1
+
+    def release(self, job):
+        """worker退出时交还尚未开始执行或已保存进度的任务，不计入尝试次数"""
+        conn = self.connect()
+        try:
+            self.execute(conn, '''
+                UPDATE style_jobs SET state = ?, worker = NULL, claim_token = NULL, lease_until = NULL,
+                    attempts = attempts - 1, updated = ?
+                WHERE id = ? AND claim_token = ?
+            ''', (QUEUED, time.time(), job.id, job.claim_token), commit=True)
+        finally:
+            conn.close()
+
+    def _finish(self, conn, job_id, token, state, result=None, error=None):
+        self.execute(conn, '''
+            UPDATE style_jobs SET state = ?, result = ?, error = ?, lease_until = NULL, updated = ?
+            WHERE id = ? AND claim_token = ?
+        ''', (state, json.dumps(result, ensure_ascii=False) if result is not None else None, error, time.time(),
+              job_id, token), commit=True)
+
+    def status(self, job_id):
+        """任务的状态，排队中时包含同一道内的排队位置，找不到时返回None"""
+        conn = self.connect()
+        try:
+            row = self.execute(conn, 'SELECT * FROM style_jobs WHERE id = ?', (job_id,))
+            if row is None:
+                return None
+            info = {'id': row['id'], 'lane': row['lane'], 'state': row['state'], 'attempts': row['attempts'],
+                    'submitted': row['created']}
+            if row['state'] == QUEUED:
+                ahead = self.execute(conn, '''
+                    SELECT COUNT(*) AS ahead FROM style_jobs WHERE state = ? AND lane = ? AND created < ?
+                ''', (QUEUED, row['lane'], row['created']))
+                info['position'] = ahead['ahead'] + 1
+            if row['result']:
+                info['result'] = json.loads(row['result'])
+            if row['error']:
+                info['error'] = row['error']
+            return info
+        finally:
+            conn.close()
+
+    def purge(self, older_than):
+        """删除完成或失败超过older_than秒的任务记录，返回删除的数量"""
+        cutoff = time.time() - older_than
+        conn = self.connect()
+        try:
+            before = self.execute(conn, 'SELECT COUNT(*) AS n FROM style_jobs WHERE state IN (?, ?) AND updated < ?',
+                                  (DONE, FAILED, cutoff))
+            self.execute(conn, 'DELETE FROM style_jobs WHERE state IN (?, ?) AND updated < ?',
+                         (DONE, FAILED, cutoff), commit=True)
+            return before['n']
+        finally:
+            conn.close()
@@ -0,0 +1,120 @@
+"""拖动滑块时的实时预览通道
+
+前端拖动参数滑块时每次移动都会提交一组新参数。每个预览通道（由前端生成的channel id标识）
+只保留最新的一组参数:
+
+    - 新参数直接替换尚未开始的渲染，排队的旧参数不会被渲染
+    - 每个通道同时只有一个渲染在进行，完成时如果已经有更新的参数，结果直接丢弃
+    - 订阅者（SSE或长轮询）只会收到最新版本的预览
+
+渲染在每个通道的后台线程中进行，所有通道共用PREVIEW_WORKERS个并发名额。
+通道状态保存在进程内，多worker部署时需要把同一channel的请求路由到同一个worker。
+"""
+import time
+import threading
+
+import metrics
+
+PREVIEW_RENDERS = metrics.REGISTRY.register(metrics.Counter(
+    'live_preview_renders_total', '实时预览的渲染次数，按结果统计', ['outcome']))
+
+
+class PreviewChannel:
+    """一个预览通道: 待渲染的最新参数和最近一次发布的结果"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.version = 0
+        self.pending = None
+        self.published_version = 0
+        self.published = None
+        self.worker = None
+        self.last_active = time.monotonic()
+
+
+class PreviewHub:
+    """管理所有预览通道
+
+    render(job) 在后台线程中执行，返回可以JSON序列化的预览结果（dict），失败时抛出异常。
+    """
+
+    def __init__(self, render, workers=2, idle_timeout=300):
+        self.render = render
+        self.idle_timeout = idle_timeout
+        self._slots = threading.BoundedSemaphore(workers)
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def _channel(self, channel_id):
+        with self._lock:
+            self._expire()
+            channel = self._channels.get(channel_id)
+            if channel is None:
+                channel = self._channels[channel_id] = PreviewChannel()
+            return channel
+
+    def _expire(self):
+        now = time.monotonic()
+        for channel_id, channel in list(self._channels.items()):
+            if now - channel.last_active > self.idle_timeout and channel.worker is None:
+                del self._channels[channel_id]
+
+    def submit(self, channel_id, job):
+        """提交一组新参数，替换尚未开始的旧参数，返回新的版本号"""
+        channel = self._channel(channel_id)
+        with channel.cond:
+            if channel.pending is not None:
+                PREVIEW_RENDERS.inc(outcome='superseded')
+            channel.version += 1
+            channel.pending = (channel.version, job)
+            channel.last_active = time.monotonic()
+            if channel.worker is None:
+                channel.worker = threading.Thread(target=self._run, args=(channel,), daemon=True,
+                                                  name=f'live-preview-{channel_id}')
+                channel.worker.start()
+            return channel.version
+
+    def _run(self, channel):
+        while True:
+            with channel.cond:
+                if channel.pending is None:
+                    channel.worker = None
+                    return
+                version, job = channel.pending
+                channel.pending = None
+
+            with self._slots:
+                # 等待名额期间可能已经提交了更新的参数
+                with channel.cond:
+                    if channel.version != version:
+                        PREVIEW_RENDERS.inc(outcome='superseded')
+                        continue
+                try:
+                    payload = self.render(job)
+                except Exception as e:
+                    print(f"实时预览渲染失败: {e}")
+                    payload = {'error': str(e)}
+
+            with channel.cond:
+                if channel.version != version:
+                    # 渲染期间参数已经改变，这个结果没有人需要
+                    PREVIEW_RENDERS.inc(outcome='stale')
+                    continue
+                PREVIEW_RENDERS.inc(outcome='error' if 'error' in payload else 'published')
+                channel.published_version = version
+                channel.published = payload
+                channel.cond.notify_all()
+
+    def wait(self, channel_id, after=0, timeout=25):
+        """等待版本号大于after的预览，超时返回None，否则返回 (版本号, 预览结果)"""
+        channel = self._channel(channel_id)
+        deadline = time.monotonic() + timeout
+        with channel.cond:
+            channel.last_active = time.monotonic()
+            while channel.published_version <= after:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                channel.cond.wait(remaining)
+            channel.last_active = time.monotonic()
+            return channel.published_version, channel.published
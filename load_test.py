@@ -0,0 +1,291 @@
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import logging
+import sqlite3
+import argparse
+import tempfile
+import threading
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT_DIR)
+
+from bench_engines import make_synthetic_image
+
+# 默认的请求比例
+DEFAULT_MIX = 'upload=1,process=2,prediction=2,radar=3,user_center=1,share=2'
+
+# 延迟直方图的桶上限（毫秒）
+HISTOGRAM_BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class RouteStats:
+    """单个路由的统计数据"""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.status_codes = {}
+
+    def record(self, latency, status):
+        self.latencies.append(latency)
+        self.status_codes[status] = self.status_codes.get(status, 0) + 1
+        if status == 0 or status >= 400:
+            self.errors += 1
+
+    def summary(self, elapsed):
+        data = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        histogram = {}
+        for bound in HISTOGRAM_BUCKETS:
+            histogram[f'<={bound}ms'] = int(np.sum(data <= bound))
+        histogram['+Inf'] = len(self.latencies)
+        return {
+            'requests': len(self.latencies),
+            'errors': self.errors,
+            'error_rate': self.errors / len(self.latencies) if self.latencies else 0.0,
+            'throughput_rps': len(self.latencies) / elapsed if elapsed else 0.0,
+            'p50_ms': float(np.percentile(data, 50)),
+            'p90_ms': float(np.percentile(data, 90)),
+            'p99_ms': float(np.percentile(data, 99)),
+            'max_ms': float(np.max(data)),
+            'status_codes': {str(k): v for k, v in sorted(self.status_codes.items())},
+            'histogram': histogram
+        }
+
+
+class VirtualUser:
+    """一个带独立cookie的模拟用户"""
+
+    def __init__(self, base_url, username, password, images):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.images = images
+        self.uploaded = []
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, path, body=None, headers=None):
+        """发送请求，返回 (状态码, 响应内容)"""
+        req = urllib.request.Request(self.base_url + path, data=body, method=method, headers=headers or {})
+        try:
+            with self.opener.open(req, timeout=120) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+        except (urllib.error.URLError, OSError):
+            return 0, b''
+
+    def post_json(self, path, payload):
+        return self.request('POST', path, json.dumps(payload).encode('utf-8'),
+                            {'Content-Type': 'application/json'})
+
+    def login(self):
+        body = urllib.parse.urlencode({'username': self.username, 'password': self.password}).encode('utf-8')
+        return self.request('POST', '/login', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+
+    def upload(self):
+        image_path = random.choice(self.images)
+        boundary = uuid.uuid4().hex
+        with open(image_path, 'rb') as f:
+            content = f.read()
+        body = (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="file"; filename="{os.path.basename(image_path)}"\r\n'
+            'Content-Type: image/jpeg\r\n\r\n'
+        ).encode('utf-8') + content + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+        status, data = self.request('POST', '/upload', body,
+                                    {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        if status == 200:
+            self.uploaded.append(json.loads(data)['filename'])
+        return status
+
+    def process(self):
+        if not self.uploaded:
+            return self.upload()
+        styles = random.sample(['vangogh', 'picasso', 'ink', 'impression', 'pop'], random.choice([1, 1, 2]))
+        status, _ = self.post_json('/process', {
+            'image': random.choice(self.uploaded),
+            'styles': styles,
+            'weights': [1.0 / len(styles)] * len(styles),
+            'styleStrength': round(random.uniform(0.3, 1.0), 2),
+            'contentWeight': round(random.uniform(0.1, 0.6), 2),
+            'colorEnhance': random.random() < 0.5
+        })
+        return status
+
+    def prediction(self):
+        styles = random.sample(['vangogh', 'picasso', 'ink', 'candy', 'udnie'], random.choice([1, 2, 3]))
+        return self.post_json('/api/style_effect_prediction', {'styles': styles})[0]
+
+    def radar(self):
+        return self.post_json('/api/style_radar_data', {'style': random.choice(['vangogh', 'ink', 'mosaic'])})[0]
+
+    def user_center(self):
+        return self.request('GET', '/user_center')[0]
+
+    def share(self, result_ids):
+        if not result_ids:
+            return self.prediction()
+        return self.request('GET', f'/share/{random.choice(result_ids)}')[0]
+
+
+def parse_mix(value):
+    """解析 upload=1,process=2 形式的请求比例"""
+    mix = {}
+    for item in value.split(','):
+        name, weight = item.split('=')
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def setup_environment(work_dir, users, password):
+    """在临时目录中准备SQLite数据库、static目录和测试用户，返回Flask应用"""
+    os.chdir(work_dir)
+    import app as app_module
+
+    # 压测始终使用临时SQLite数据库，不访问线上MySQL
+    app_module.USE_MYSQL = False
+    # 压测测量的是服务能力，所有请求来自同一个地址，不能被计算配额拦截
+    app_module.app.config['RATE_LIMIT_ENABLED'] = False
+    if not app_module.init_db():
+        raise RuntimeError('初始化临时数据库失败')
+
+    from werkzeug.security import generate_password_hash
+    hashed = generate_password_hash(password, method='pbkdf2:sha256')
+    conn = sqlite3.connect(os.path.join('database', 'portrait.db'))
+    for i in range(users):
+        conn.execute('INSERT INTO users (username, email, password) VALUES (?, ?, ?)',
+                     (f'load_user_{i}', f'load_user_{i}@example.com', hashed))
+    conn.commit()
+    conn.close()
+    return app_module.app
+
+
+def load_result_ids():
+    conn = sqlite3.connect(os.path.join('database', 'portrait.db'))
+    ids = [row[0] for row in conn.execute('SELECT id FROM user_results')]
+    conn.close()
+    return ids
+
+
+def run_load(args):
+    from werkzeug.serving import make_server
+
+    work_dir = tempfile.mkdtemp(prefix='load_test_')
+    cwd = os.getcwd()
+    try:
+        app = setup_environment(work_dir, args.concurrency, 'load_test_pw')
+        images = [make_synthetic_image(os.path.join(work_dir, f'load_{i}.jpg'), (args.image_size, args.image_size), i)
+                  for i in range(4)]
+
+        # 不输出每个请求的访问日志
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+        print(f"测试服务已启动: {base_url}，临时目录: {work_dir}")
+
+        mix = parse_mix(args.mix)
+        routes = list(mix)
+        weights = [mix[r] for r in routes]
+        stats = {route: RouteStats() for route in routes}
+        lock = threading.Lock()
+
+        # 每个虚拟用户先登录并上传、处理一张图片，保证share有数据
+        vusers = []
+        for i in range(args.concurrency):
+            user = VirtualUser(base_url, f'load_user_{i}', 'load_test_pw', images)
+            if random.random() < args.logged_in_ratio:
+                user.login()
+            user.upload()
+            user.process()
+            vusers.append(user)
+        result_ids = load_result_ids()
+
+        deadline = time.time() + args.duration
+        started = time.time()
+
+        def worker(user):
+            while time.time() < deadline:
+                route = random.choices(routes, weights)[0]
+                begin = time.perf_counter()
+                if route == 'share':
+                    status = user.share(result_ids)
+                else:
+                    status = getattr(user, route)()
+                latency = time.perf_counter() - begin
+                with lock:
+                    stats[route].record(latency, status)
+
+        threads = [threading.Thread(target=worker, args=(user,)) for user in vusers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - started
+        server.shutdown()
+
+        report = {
+            'meta': {
+                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'concurrency': args.concurrency,
+                'duration_s': elapsed,
+                'mix': mix
+            },
+            'routes': {route: stats[route].summary(elapsed) for route in routes}
+        }
+        total = sum(len(s.latencies) for s in stats.values())
+        report['meta']['total_requests'] = total
+        report['meta']['throughput_rps'] = total / elapsed if elapsed else 0.0
+        return report
+    finally:
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def print_report(report):
+    meta = report['meta']
+    print(f"==== 压测结果: 并发 {meta['concurrency']}，{meta['duration_s']:.1f}秒，"
+          f"共 {meta['total_requests']} 个请求，{meta['throughput_rps']:.1f} req/s ====")
+    print(f"{'路由':14s}{'请求数':>8s}{'req/s':>9s}{'错误率':>9s}{'p50':>10s}{'p90':>10s}{'p99':>10s}")
+    for route, s in report['routes'].items():
+        print(f"{route:14s}{s['requests']:8d}{s['throughput_rps']:9.1f}{s['error_rate'] * 100:8.1f}%"
+              f"{s['p50_ms']:9.1f}ms{s['p90_ms']:8.1f}ms{s['p99_ms']:8.1f}ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='上传→处理→分享流程的HTTP压测工具')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发的虚拟用户数')
+    parser.add_argument('--duration', type=float, default=30, help='压测时长（秒）')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='各路由的请求比例')
+    parser.add_argument('--image-size', type=int, default=512, help='上传测试图像的边长')
+    parser.add_argument('--logged-in-ratio', type=float, default=0.8, help='登录用户所占比例')
+    parser.add_argument('--output', help='把结果保存为JSON')
+    parser.add_argument('--keep', action='store_true', help='保留临时目录便于排查')
+    args = parser.parse_args(argv)
+
+    report = run_load(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
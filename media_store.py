@@ -0,0 +1,132 @@
+import os
+import hashlib
+import shutil
+
+
+class LocalMediaStore:
+    """本地磁盘媒体存储
+
+    原图和结果图按文件名哈希分片到两级子目录中，例如
+    static/uploads/results/3f/a2/result_xxx.jpg，避免单个目录中堆积数百万文件。
+    数据库中只保存文件名，具体位置由存储层计算，因此更换布局不需要修改记录。
+    """
+
+    def __init__(self, folders, sharded_kinds=('originals', 'results'), shard_levels=2, shard_width=2,
+                 legacy_fallback=True):
+        # folders: 媒体类型 -> 根目录
+        self.folders = dict(folders)
+        self.sharded_kinds = set(sharded_kinds)
+        self.shard_levels = shard_levels
+        self.shard_width = shard_width
+        # 迁移完成前，分片位置找不到时回退到旧的平铺目录
+        self.legacy_fallback = legacy_fallback
+
+    def root(self, kind):
+        """获取媒体类型的根目录"""
+        if kind not in self.folders:
+            raise KeyError(f"未知的媒体类型: {kind}")
+        return self.folders[kind]
+
+    def relative_path(self, kind, name):
+        """文件相对于根目录的路径（包含分片子目录）"""
+        name = os.path.basename(name)
+        if kind not in self.sharded_kinds:
+            return name
+        digest = hashlib.md5(name.encode('utf-8')).hexdigest()
+        parts = [digest[i * self.shard_width:(i + 1) * self.shard_width] for i in range(self.shard_levels)]
+        return os.path.join(*parts, name)
+
+    def legacy_path(self, kind, name):
+        """旧的平铺布局中的文件路径"""
+        return os.path.join(self.root(kind), os.path.basename(name))
+
+    def new_path(self, kind, name):
+        """获取新文件的写入路径，并确保分片目录存在"""
+        path = os.path.join(self.root(kind), self.relative_path(kind, name))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def locate(self, kind, name):
+        """查找已有文件，返回 (相对路径, 完整路径)，不存在时返回 (None, None)"""
+        relative = self.relative_path(kind, name)
+        path = os.path.join(self.root(kind), relative)
+        if os.path.isfile(path):
+            return relative, path
+
+        if self.legacy_fallback and kind in self.sharded_kinds:
+            legacy = self.legacy_path(kind, name)
+            if os.path.isfile(legacy):
+                return os.path.basename(name), legacy
+
+        return None, None
+
+    def path(self, kind, name):
+        """获取已有文件的完整路径，不存在时返回None"""
+        return self.locate(kind, name)[1]
+
+    def exists(self, kind, name):
+        """检查文件是否存在"""
+        return self.path(kind, name) is not None
+
+    def save(self, kind, name, file_storage):
+        """保存上传的文件（werkzeug FileStorage），返回完整路径"""
+        path = self.new_path(kind, name)
+        file_storage.save(path)
+        return path
+
+    def adopt(self, kind, src_path, name=None):
+        """把存储层以外写出的文件移动到正确位置，返回完整路径"""
+        path = self.new_path(kind, name or os.path.basename(src_path))
+        if os.path.abspath(src_path) != os.path.abspath(path):
+            shutil.move(src_path, path)
+        return path
+
+    def delete(self, kind, name):
+        """删除文件，返回是否确实删除了文件"""
+        path = self.path(kind, name)
+        if path is None:
+            return False
+        os.remove(path)
+        return True
+
+    def delete_path(self, path):
+        """按数据库中保存的完整路径删除文件（用于风格预览图和模型文件）"""
+        if path and os.path.isfile(path):
+            os.remove(path)
+            return True
+        return False
+
+    def iter_files(self, kind):
+        """遍历某个媒体类型下的所有文件，产出 (文件名, 完整路径)"""
+        root = self.root(kind)
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                yield filename, os.path.join(dirpath, filename)
+
+
+# 可用的存储后端，新的后端（如对象存储）在此注册
+MEDIA_STORE_BACKENDS = {
+    'local': LocalMediaStore
+}
+
+
+def create_media_store(config):
+    """根据Flask配置创建媒体存储"""
+    backend = config.get('MEDIA_STORE', 'local')
+    if backend not in MEDIA_STORE_BACKENDS:
+        raise ValueError(f"不支持的媒体存储后端: {backend}")
+
+    folders = {
+        'originals': config['ORIGINAL_FOLDER'],
+        'results': config['RESULT_FOLDER'],
+        'temp': os.path.join('static', 'uploads', 'temp'),
+        'bases': os.path.join('static', 'uploads', 'bases'),
+        'checkpoints': os.path.join('static', 'uploads', 'checkpoints'),
+        'previews': os.path.join('static', 'img', 'styles'),
+        'models': os.path.join('static', 'models')
+    }
+    return MEDIA_STORE_BACKENDS[backend](
+        folders,
+        sharded_kinds=('originals', 'results', 'bases'),
+        legacy_fallback=config.get('MEDIA_LEGACY_FALLBACK', True)
+    )
@@ -0,0 +1,240 @@
+"""Prometheus文本格式的运行指标
+
+不依赖prometheus_client，所有指标保存在当前进程内存中。使用多个gunicorn
+worker时每个worker各自统计，需要分别抓取或在单worker上部署监控端点。
+"""
+import re
+import sys
+import time
+import threading
+from bisect import bisect_left
+from functools import lru_cache
+
+# 默认的延迟桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Metric:
+    """指标基类，按标签值保存数据"""
+
+    type_name = ''
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {value}']
+
+
+class Counter(Metric):
+    """只增不减的计数器"""
+
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """可增可减的当前值"""
+
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """分桶统计的直方图"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [各桶计数..., +Inf计数, 总和]
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def time(self, **labels):
+        """用作上下文管理器记录代码块耗时"""
+        return _Timer(self, labels)
+
+    def _render_value(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), state[:-1]):
+            cumulative += count
+            labels = _format_labels(self.labelnames + ('le',), key + (bound,))
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {state[-1]}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    """指标集合"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'HTTP请求处理耗时', ['endpoint', 'method', 'status']))
+REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    'http_requests_in_flight', '正在处理的HTTP请求数'))
+STYLE_JOB_DURATION = REGISTRY.register(Histogram(
+    'style_job_duration_seconds', '风格迁移任务耗时', ['engine', 'style']))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'style_job_queue_depth', '等待执行的风格迁移任务数', ['lane']))
+STYLE_JOB_WAIT = REGISTRY.register(Histogram(
+    'style_job_wait_seconds', '风格迁移任务的排队时间', ['lane']))
+MODEL_POOL_REQUESTS = REGISTRY.register(Counter(
+    'model_pool_requests_total', '模型缓存命中与未命中次数', ['result']))
+DB_QUERY_LATENCY = REGISTRY.register(Histogram(
+    'db_query_duration_seconds', '数据库查询耗时', ['statement'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)))
+RESULT_BYTES_WRITTEN = REGISTRY.register(Counter(
+    'result_bytes_written_total', '写入结果目录的字节数'))
+STYLE_JOB_DEDUP = REGISTRY.register(Counter(
+    'style_job_dedup_total', '相同风格迁移任务的合并情况: computed自己计算，shared复用其他请求的结果', ['result']))
+
+_STATEMENT_PATTERN = re.compile(r'^\s*(SELECT\b.*?\bFROM|INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+(\w+)',
+                                re.IGNORECASE | re.DOTALL)
+
+
+@lru_cache(maxsize=256)
+def statement_label(query):
+    """把SQL语句归类为 select:users 这样的低基数标签"""
+    match = _STATEMENT_PATTERN.match(query)
+    if not match:
+        return query.split(None, 1)[0].lower() if query.strip() else 'unknown'
+    return f"{match.group(1).split()[0].lower()}:{match.group(2).lower()}"
+
+
+def init_app(app):
+    """为Flask应用注册请求统计钩子和 /metrics 路由"""
+    from flask import g, request
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_start = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+
+    @app.after_request
+    def _metrics_record(response):
+        start = g.pop('_metrics_start', None)
+        if start is not None:
+            REQUESTS_IN_FLIGHT.dec()
+            REQUEST_LATENCY.observe(time.perf_counter() - start, endpoint=request.endpoint or 'unknown',
+                                    method=request.method, status=response.status_code)
+        return response
+
+    @app.teardown_request
+    def _metrics_teardown(exc):
+        # 未被after_request处理的异常请求
+        if g.pop('_metrics_start', None) is not None:
+            REQUESTS_IN_FLIGHT.dec()
+
+    @app.route('/metrics')
+    def metrics():
+        """Prometheus抓取端点"""
+        return app.response_class(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+def measure_overhead(iterations=100000):
+    """测量热路径上的指标采集开销"""
+    histogram = Histogram('bench_seconds', 'bench', ['endpoint', 'method', 'status'])
+    gauge = Gauge('bench_in_flight', 'bench')
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        gauge.inc()
+        histogram.observe(0.012, endpoint='process_image', method='POST', status=200)
+        gauge.dec()
+    per_request = (time.perf_counter() - start) / iterations
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        statement_label('SELECT * FROM user_results WHERE user_id = ? ORDER BY create_date DESC')
+    per_query = (time.perf_counter() - start) / iterations
+
+    return per_request, per_query
+
+
+if __name__ == '__main__':
+    per_request, per_query = measure_overhead()
+    print(f"每个请求的指标开销: {per_request * 1e6:.2f}µs")
+    print(f"每次数据库查询的标签开销: {per_query * 1e6:.2f}µs")
+    sys.exit(0)
@@ -0,0 +1,163 @@
+"""风格预览图像的增量并行生成
+
+每个风格的预览由一个生成函数绘制，生成函数和相关辅助函数的源码、参数以及输出尺寸
+组成指纹，和输出文件的内容摘要一起记录在预览目录的清单文件中。只有指纹变化、
+输出文件缺失或被其他脚本覆盖（内容摘要不一致）的风格会重新生成，
+需要生成的风格较多时在进程池中并行绘制。每个风格使用固定的随机种子，
+重新生成的图像与之前一致。
+"""
+import os
+import json
+import random
+import hashlib
+import inspect
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+PREVIEW_DIR = os.path.join('static', 'img', 'styles')
+# 默认清单文件名，使用不同绘制函数写入同一目录的脚本各自传入自己的清单名，
+# 否则相同的风格ID会让它们互相覆盖指纹，每次运行都全部重新生成。
+# 两个脚本写出的文件名相同，一个脚本覆盖了另一个的输出时由内容摘要发现
+MANIFEST_NAME = '.preview_manifest.json'
+# 除原尺寸的 <style>.jpg 外，界面还需要的缩略图尺寸，输出为 <style>_<name>.jpg
+PREVIEW_SIZES = {
+    'thumb': (150, 150),
+    'icon': (64, 64)
+}
+# 需要生成的风格少于这个数量时直接在当前进程中绘制，启动进程池反而更慢
+MIN_PARALLEL_JOBS = 4
+
+
+class PreviewJob:
+    """一个风格的预览生成任务
+
+    render: 模块级函数，使用args调用后返回PIL图像
+    sources: 生成过程中用到的其他函数，它们的源码变化时同样重新生成
+    """
+
+    def __init__(self, style_id, render, args=(), sources=()):
+        self.style_id = style_id
+        self.render = render
+        self.args = tuple(args)
+        self.sources = tuple(sources)
+
+    def fingerprint(self, sizes):
+        digest = hashlib.sha1()
+        for func in (self.render,) + self.sources:
+            digest.update(inspect.getsource(func).encode('utf-8'))
+        digest.update(json.dumps([self.style_id, self.args, sorted(sizes.items())],
+                                 ensure_ascii=False, default=str).encode('utf-8'))
+        return digest.hexdigest()
+
+
+def preview_paths(output_dir, style_id, sizes=PREVIEW_SIZES):
+    """风格的所有预览文件路径，键为尺寸名，原尺寸为None"""
+    paths = {None: os.path.join(output_dir, f'{style_id}.jpg')}
+    for name in sizes:
+        paths[name] = os.path.join(output_dir, f'{style_id}_{name}.jpg')
+    return paths
+
+
+def _file_digest(path):
+    digest = hashlib.sha1()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def _output_digests(paths):
+    """{文件名: 内容摘要}，文件缺失时摘要为None"""
+    return {os.path.basename(p): _file_digest(p) for p in paths.values()}
+
+
+def _is_current(entry, fingerprint, paths):
+    """清单记录的指纹一致，且输出文件仍是上次生成的内容"""
+    if not isinstance(entry, dict) or entry.get('fingerprint') != fingerprint:
+        return False
+    digests = _output_digests(paths)
+    return None not in digests.values() and digests == entry.get('outputs')
+
+
+def _load_manifest(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(path, manifest):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def render_job(job, output_dir, sizes):
+    """绘制一个风格并保存所有尺寸，在进程池的子进程中执行"""
+    from PIL import Image
+
+    # 同一风格每次使用相同的随机序列
+    random.seed(job.style_id)
+    img = job.render(*job.args).convert('RGB')
+    paths = preview_paths(output_dir, job.style_id, sizes)
+    img.save(paths[None])
+    for name, size in sizes.items():
+        img.resize(size, Image.LANCZOS).save(paths[name])
+    return paths[None]
+
+
+def build_previews(jobs, output_dir=PREVIEW_DIR, sizes=PREVIEW_SIZES, workers=None, force=False,
+                   manifest_name=MANIFEST_NAME):
+    """生成指纹变化或缺失的预览，返回 {'generated', 'skipped', 'failed'} 数量"""
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, manifest_name)
+    manifest = _load_manifest(manifest_path)
+
+    pending = []
+    for job in jobs:
+        fingerprint = job.fingerprint(sizes)
+        paths = preview_paths(output_dir, job.style_id, sizes)
+        if force or not _is_current(manifest.get(job.style_id), fingerprint, paths):
+            pending.append((job, fingerprint))
+
+    stats = {'generated': 0, 'skipped': len(jobs) - len(pending), 'failed': 0}
+    if not pending:
+        print(f"风格预览已是最新，跳过 {stats['skipped']} 个风格")
+        return stats
+
+    def finish(job, fingerprint, error):
+        if error is None:
+            manifest[job.style_id] = {
+                'fingerprint': fingerprint,
+                'outputs': _output_digests(preview_paths(output_dir, job.style_id, sizes))
+            }
+            stats['generated'] += 1
+            print(f"创建风格预览图像: {job.style_id}")
+        else:
+            manifest.pop(job.style_id, None)
+            stats['failed'] += 1
+            print(f"创建风格预览图像失败 {job.style_id}: {error}")
+
+    workers = min(workers or os.cpu_count() or 1, len(pending))
+    if workers <= 1 or len(pending) < MIN_PARALLEL_JOBS:
+        for job, fingerprint in pending:
+            try:
+                render_job(job, output_dir, sizes)
+                finish(job, fingerprint, None)
+            except Exception as e:
+                finish(job, fingerprint, e)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(render_job, job, output_dir, sizes): (job, fingerprint)
+                       for job, fingerprint in pending}
+            for future in as_completed(futures):
+                job, fingerprint = futures[future]
+                finish(job, fingerprint, future.exception())
+
+    _save_manifest(manifest_path, manifest)
+    print(f"风格预览: 生成 {stats['generated']} 个，跳过 {stats['skipped']} 个，失败 {stats['failed']} 个")
+    return stats
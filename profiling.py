@@ -0,0 +1,207 @@
+"""管理员按需性能分析
+
+管理员在任意请求上加 ?_profile=1（cProfile）或 ?_profile=sample（采样分析），
+也可以使用请求头 X-Profile: 1 / sample。分析结果保存在 profiles/ 目录，
+只能通过管理员路由访问。普通请求只做一次查询字符串和请求头检查。
+
+同一时间只能有一个cProfile分析（Python 3.12起同时启用第二个会出错），已有cProfile分析进行中时
+改用采样分析，结果说明中会注明。流式响应（批量处理的NDJSON、实时预览的SSE）只分析到视图返回
+响应对象为止，不包括之后逐步执行的生成器。
+"""
+import os
+import io
+import sys
+import time
+import uuid
+import types
+import pstats
+import cProfile
+import threading
+from collections import Counter
+from datetime import datetime
+
+PROFILE_DIR = 'profiles'
+# 摘要中列出的函数数量
+TOP_FUNCTIONS = 30
+
+# cProfile同一时间只能有一个在运行
+_cprofile_lock = threading.Lock()
+
+
+class SamplingProfiler:
+    """定时采样目标线程的调用栈，开销与请求中的函数调用次数无关"""
+
+    def __init__(self, thread_id, interval=0.002):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self):
+        """按包含时间（出现在栈中的采样数）排序的函数列表"""
+        inclusive = Counter()
+        for stack, count in self.stacks.items():
+            for func in set(stack):
+                inclusive[func] += count
+        lines = [f"采样间隔 {self.interval * 1000:.1f}ms，共 {self.samples} 个样本", '',
+                 f"{'样本数':>8s} {'占比':>7s}  函数"]
+        for func, count in inclusive.most_common(TOP_FUNCTIONS):
+            lines.append(f"{count:8d} {count / max(self.samples, 1) * 100:6.1f}%  {func}")
+        return '\n'.join(lines) + '\n'
+
+    def folded(self):
+        """flamegraph.pl / speedscope 可以直接读取的折叠栈格式"""
+        return ''.join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.items())
+
+
+def profile_mode(request):
+    """返回请求要求的分析方式，未要求时返回None"""
+    if b'_profile' in request.query_string:
+        return request.args.get('_profile') or '1'
+    return request.headers.get('X-Profile')
+
+
+def _profile_name(endpoint):
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{endpoint or 'unknown'}_{uuid.uuid4().hex[:8]}"
+
+
+def save_cprofile(profiler, name, description):
+    """保存cProfile原始数据和按累计时间排序的摘要"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(os.path.join(PROFILE_DIR, f'{name}.prof'))
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+    with open(os.path.join(PROFILE_DIR, f'{name}.txt'), 'w', encoding='utf-8') as f:
+        f.write(description + '\n\n' + stream.getvalue())
+
+
+def save_sampling(sampler, name, description):
+    """保存采样分析的摘要和折叠栈"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, f'{name}.txt'), 'w', encoding='utf-8') as f:
+        f.write(description + '\n\n' + sampler.summary())
+    with open(os.path.join(PROFILE_DIR, f'{name}.folded'), 'w', encoding='utf-8') as f:
+        f.write(sampler.folded())
+
+
+def _stop_cprofile(profiler):
+    profiler.disable()
+    _cprofile_lock.release()
+
+
+def list_profiles(limit=50):
+    """列出最近的分析结果，最新的在前"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for filename in os.listdir(PROFILE_DIR):
+        if not filename.endswith('.txt'):
+            continue
+        name = filename[:-4]
+        path = os.path.join(PROFILE_DIR, filename)
+        with open(path, encoding='utf-8') as f:
+            description = f.readline().strip()
+        files = [f'{name}{ext}' for ext in ('.txt', '.prof', '.folded')
+                 if os.path.exists(os.path.join(PROFILE_DIR, f'{name}{ext}'))]
+        profiles.append({
+            'name': name,
+            'description': description,
+            'created': datetime.fromtimestamp(os.path.getmtime(path)).strftime('%Y-%m-%d %H:%M:%S'),
+            'files': files
+        })
+    profiles.sort(key=lambda p: p['name'], reverse=True)
+    return profiles[:limit]
+
+
+def init_app(app):
+    """注册分析钩子和管理员查看路由"""
+    from flask import g, request, session, jsonify, send_from_directory, abort
+
+    @app.before_request
+    def _profile_start():
+        mode = profile_mode(request)
+        if mode is None or not session.get('is_admin'):
+            return
+        g._profile_start = time.perf_counter()
+        g._profile_note = ''
+        if mode != 'sample':
+            if _cprofile_lock.acquire(blocking=False):
+                g._profiler = cProfile.Profile()
+                g._profiler.enable()
+                return
+            g._profile_note = '（已有cProfile分析进行中，改用采样分析）'
+        g._profiler = SamplingProfiler(threading.get_ident())
+        g._profiler.start()
+
+    @app.after_request
+    def _profile_finish(response):
+        profiler = g.pop('_profiler', None)
+        if profiler is None:
+            return response
+
+        elapsed = time.perf_counter() - g.pop('_profile_start')
+        name = _profile_name(request.endpoint)
+        description = (f"{request.method} {request.full_path.rstrip('?')} -> {response.status_code}，"
+                       f"耗时 {elapsed * 1000:.1f}ms{g.pop('_profile_note', '')}")
+        if isinstance(response.response, types.GeneratorType):
+            description += '（流式响应，不包括生成器的执行）'
+        if isinstance(profiler, SamplingProfiler):
+            profiler.stop()
+            save_sampling(profiler, name, description)
+        else:
+            _stop_cprofile(profiler)
+            save_cprofile(profiler, name, description)
+        response.headers['X-Profile-Id'] = name
+        print(f"已保存性能分析: {name}")
+        return response
+
+    @app.teardown_request
+    def _profile_teardown(exc):
+        # 没有经过after_request（例如响应处理中出错）时也要停止分析，释放cProfile锁
+        profiler = g.pop('_profiler', None)
+        if isinstance(profiler, SamplingProfiler):
+            profiler.stop()
+        elif profiler is not None:
+            _stop_cprofile(profiler)
+
+    @app.route('/admin/profiles')
+    def admin_profiles():
+        """分析结果列表"""
+        if 'user_id' not in session or not session.get('is_admin'):
+            return jsonify({'success': False, 'error': '需要管理员权限'}), 403
+        return jsonify({'success': True, 'profiles': list_profiles()})
+
+    @app.route('/admin/profiles/<path:filename>')
+    def admin_profile_file(filename):
+        """查看或下载单个分析文件"""
+        if 'user_id' not in session or not session.get('is_admin'):
+            return jsonify({'success': False, 'error': '需要管理员权限'}), 403
+        if not filename.endswith(('.txt', '.prof', '.folded')):
+            abort(404)
+        return send_from_directory(os.path.abspath(PROFILE_DIR), filename,
+                                   mimetype='text/plain' if not filename.endswith('.prof') else None,
+                                   as_attachment=filename.endswith('.prof'))
@@ -0,0 +1,209 @@
+"""预先生成快速风格迁移模型的int8量化版本
+
+TransformerNet全部由卷积、实例归一化和上采样组成，动态量化只处理Linear/LSTM，
+对它没有效果，因此使用FX图模式的静态量化（训练后量化）：用一组校准图像统计激活范围，
+再转换为int8卷积。量化模型以TorchScript保存在 models/pretrained/<style>.int8.pt，
+质量（与fp32输出对比的PSNR/SSIM）和延迟对比写入 <style>.int8.json。
+只有通过质量阈值的模型会被 fast_runtime 使用。
+
+用法:
+    python quantize_models.py                       # 处理 models/pretrained 下所有 .pth
+    python quantize_models.py --styles vangogh ink --calibration-dir static/uploads/originals
+"""
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+import statistics
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+
+from fast_runtime import (PRETRAINED_DIR, model_paths, source_signature, default_quantized_engine,
+                          set_quantized_engine, load_fp32, read_int8_meta, to_tensor, value_range)
+from bench_engines import synthetic_image
+from guided_upsample import box_filter
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def load_images(directory, count, size):
+    """从目录中取最多count张图像并缩放到size，不足的部分用合成图像补足"""
+    images = []
+    if directory and os.path.isdir(directory):
+        for dirpath, _, filenames in os.walk(directory):
+            for filename in sorted(filenames):
+                if len(images) >= count:
+                    break
+                if filename.lower().endswith(IMAGE_EXTENSIONS):
+                    with Image.open(os.path.join(dirpath, filename)) as img:
+                        images.append(img.convert('RGB').resize(size, Image.BICUBIC))
+    seed = 0
+    while len(images) < count:
+        images.append(synthetic_image(size, seed))
+        seed += 1
+    return images
+
+
+def quantize(model, calibration, engine):
+    """FX图模式静态量化"""
+    import torch
+    from torch.quantization import get_default_qconfig
+    from torch.quantization.quantize_fx import prepare_fx, convert_fx
+
+    set_quantized_engine(engine)
+    model = copy.deepcopy(model).eval()
+    qconfig_dict = {'': get_default_qconfig(engine)}
+    try:
+        prepared = prepare_fx(model, qconfig_dict, example_inputs=(calibration[0],))
+    except TypeError:
+        # torch 1.9 的prepare_fx没有example_inputs参数
+        prepared = prepare_fx(model, qconfig_dict)
+    with torch.no_grad():
+        for tensor in calibration:
+            prepared(tensor)
+    return convert_fx(prepared)
+
+
+def to_script(model, example):
+    import torch
+    try:
+        return torch.jit.script(model)
+    except Exception:
+        with torch.no_grad():
+            return torch.jit.trace(model, example)
+
+
+def to_array(tensor, scale=1.0):
+    """模型输出 → 归一化到 [0, 1] 的 HWC 数组"""
+    array = tensor.detach().squeeze(0).clamp(0, scale).permute(1, 2, 0).contiguous().numpy().astype(np.float64)
+    return array / scale
+
+
+def psnr(reference, test):
+    mse = np.mean((reference - test) ** 2)
+    return float('inf') if mse == 0 else float(10 * np.log10(1.0 / mse))
+
+
+def ssim(reference, test, radius=3):
+    """亮度通道上7x7窗口的平均SSIM"""
+    weights = np.array([0.299, 0.587, 0.114])
+    x = reference @ weights
+    y = test @ weights
+    c1, c2 = 0.01 ** 2, 0.03 ** 2
+    mu_x, mu_y = box_filter(x, radius), box_filter(y, radius)
+    var_x = box_filter(x * x, radius) - mu_x ** 2
+    var_y = box_filter(y * y, radius) - mu_y ** 2
+    cov = box_filter(x * y, radius) - mu_x * mu_y
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * cov + c2)) / ((mu_x ** 2 + mu_y ** 2 + c1) * (var_x + var_y + c2))
+    return float(ssim_map.mean())
+
+
+def measure_latency(model, tensor, repeats, warmup=2):
+    """中位数延迟（毫秒）"""
+    import torch
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(tensor)
+        latencies = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model(tensor)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.median(latencies)
+
+
+def build_style(style, args):
+    """生成一个风格的量化模型，返回元数据"""
+    import torch
+
+    paths = model_paths(style, args.pretrained_dir)
+    fp32 = load_fp32(paths['fp32'])
+    scale = value_range(style, args.pretrained_dir)
+    size = (args.calibration_size, args.calibration_size)
+    calibration = [to_tensor(img, value_range=scale)
+                   for img in load_images(args.calibration_dir, args.calibration_count, size)]
+
+    start = time.perf_counter()
+    int8 = to_script(quantize(fp32, calibration, args.engine), calibration[0])
+    build_seconds = time.perf_counter() - start
+
+    # 质量检查使用与校准不同的合成图像
+    eval_size = (args.eval_size, args.eval_size)
+    eval_images = [to_tensor(synthetic_image(eval_size, 100 + i), value_range=scale) for i in range(args.eval_count)]
+    psnr_values, ssim_values = [], []
+    with torch.no_grad():
+        for tensor in eval_images:
+            reference = to_array(fp32(tensor), scale)
+            test = to_array(int8(tensor), scale)
+            psnr_values.append(psnr(reference, test))
+            ssim_values.append(ssim(reference, test))
+
+    fp32_ms = measure_latency(fp32, eval_images[0], args.repeats)
+    int8_ms = measure_latency(int8, eval_images[0], args.repeats)
+    meta = {
+        'style': style,
+        'source': source_signature(paths['fp32']),
+        'engine': args.engine,
+        'torch': torch.__version__,
+        'built_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'build_seconds': round(build_seconds, 2),
+        'calibration_images': len(calibration),
+        'psnr': round(min(psnr_values), 2),
+        'ssim': round(min(ssim_values), 4),
+        'fp32_ms': round(fp32_ms, 2),
+        'int8_ms': round(int8_ms, 2),
+        'speedup': round(fp32_ms / int8_ms, 2),
+        'eval_size': args.eval_size,
+        'min_psnr': args.min_psnr,
+        'min_ssim': args.min_ssim
+    }
+    meta['accepted'] = meta['psnr'] >= args.min_psnr and meta['ssim'] >= args.min_ssim
+
+    int8.save(paths['int8'])
+    with open(paths['int8_meta'], 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='生成TransformerNet的int8量化模型并检查质量和延迟')
+    parser.add_argument('--styles', nargs='*', help='要处理的风格，默认处理所有.pth模型')
+    parser.add_argument('--pretrained-dir', default=PRETRAINED_DIR)
+    parser.add_argument('--engine', default=default_quantized_engine(), choices=['fbgemm', 'qnnpack', 'x86', 'onednn'])
+    parser.add_argument('--calibration-dir', default=os.path.join('static', 'uploads', 'originals'),
+                        help='校准图像目录，图像不足时用合成图像补足')
+    parser.add_argument('--calibration-count', type=int, default=16)
+    parser.add_argument('--calibration-size', type=int, default=256)
+    parser.add_argument('--eval-count', type=int, default=4)
+    parser.add_argument('--eval-size', type=int, default=512)
+    parser.add_argument('--repeats', type=int, default=10, help='延迟测量次数')
+    parser.add_argument('--min-psnr', type=float, default=30.0)
+    parser.add_argument('--min-ssim', type=float, default=0.95)
+    parser.add_argument('--force', action='store_true', help='来源模型没有变化时也重新生成')
+    args = parser.parse_args(argv)
+
+    styles = args.styles or sorted(f[:-4] for f in os.listdir(args.pretrained_dir) if f.endswith('.pth'))
+    failed = 0
+    print(f"{'风格':12s} {'PSNR':>7s} {'SSIM':>7s} {'fp32(ms)':>9s} {'int8(ms)':>9s} {'加速':>6s}  结果")
+    for style in styles:
+        meta = None if args.force else read_int8_meta(style, args.pretrained_dir)
+        if meta is not None:
+            print(f"{style:12s} 已是最新（{'可用' if meta['accepted'] else '未通过质量检查'}）")
+            continue
+        try:
+            meta = build_style(style, args)
+        except Exception as e:
+            failed += 1
+            print(f"{style:12s} 量化失败: {e}")
+            continue
+        print(f"{style:12s} {meta['psnr']:7.2f} {meta['ssim']:7.4f} {meta['fp32_ms']:9.1f} {meta['int8_ms']:9.1f} "
+              f"{meta['speedup']:5.2f}x  {'可用' if meta['accepted'] else '未通过质量检查，保持fp32'}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""按计算代价的限流和配额
+
+每个请求按预计的计算代价扣除令牌: 代价单位为"用简化引擎处理一百万像素、单一风格"，
+按引擎、像素数和风格数放大。每个用户（匿名用户按会话所在IP）和每个IP各有一个令牌桶，
+两个桶都足够时才会扣除，否则返回需要等待的秒数。
+
+令牌桶保存在本机的SQLite文件中，同一台机器上的所有worker进程共享。
+配额按主体查找，依次使用 'user:<id>' 的单独配额、'registered'/'anonymous' 分级配额、
+以及IP桶使用的 'ip' 配额，管理员可以通过 /admin/quotas 修改。
+"""
+import os
+import math
+import time
+import sqlite3
+import threading
+
+DB_FILE = os.path.join('database', 'rate_limit.db')
+
+# 各引擎处理一百万像素的相对代价
+ENGINE_COST = {'simplified': 1.0, 'fast': 0.5, 'neural': 200.0}
+# 每多一种风格增加的代价比例（多风格融合需要分别风格化再混合）
+EXTRA_STYLE_COST = 0.5
+# 小图按这个像素数计费，避免大量极小的请求
+MIN_MEGAPIXELS = 0.25
+
+# 默认配额: (桶容量, 每小时恢复的令牌数)
+# 匿名用户的容量小于最小的神经风格迁移任务（200 × 0.25），/process 对匿名用户的神经风格迁移直接返回403；
+# 注册用户的容量能容纳一张约12MP手机照片的神经风格迁移（200 × 12 = 2400），大约每小时一次，
+# IP桶要同时容纳同一地址后面的多个注册用户。单次代价超过桶容量的请求返回413，不会永远等待
+DEFAULT_QUOTAS = {
+    'anonymous': (30.0, 60.0),
+    'registered': (2500.0, 2500.0),
+    'ip': (5000.0, 5000.0),
+}
+
+
+def estimate_cost(engine, megapixels, styles=1, items=1):
+    """估计一次请求的计算代价"""
+    per_item = ENGINE_COST.get(engine, 1.0) * max(megapixels, MIN_MEGAPIXELS) * (1 + EXTRA_STYLE_COST * (styles - 1))
+    return round(per_item * items, 3)
+
+
+class RateLimitExceeded(Exception):
+    """令牌不足，retry_after为需要等待的秒数，单次请求就超过桶容量时为None"""
+
+    def __init__(self, subject, cost, retry_after):
+        if retry_after is None:
+            message = f'请求的计算量 {cost} 超过 {subject} 的配额上限，请缩小图片或减少风格数'
+        else:
+            message = f'{subject} 的计算配额不足，请 {retry_after} 秒后重试'
+        super().__init__(message)
+        self.subject = subject
+        self.cost = cost
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """SQLite中的令牌桶，多个进程共享"""
+
+    def __init__(self, db_file=DB_FILE, quotas=None):
+        self.db_file = db_file
+        self.defaults = dict(DEFAULT_QUOTAS, **(quotas or {}))
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.db_file) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+        if not self._initialized:
+            with self._init_lock:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS buckets (
+                        key TEXT PRIMARY KEY,
+                        tokens REAL NOT NULL,
+                        updated REAL NOT NULL
+                    )
+                ''')
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS quotas (
+                        subject TEXT PRIMARY KEY,
+                        capacity REAL NOT NULL,
+                        refill_per_hour REAL NOT NULL
+                    )
+                ''')
+                self._initialized = True
+        return conn
+
+    def _quota(self, conn, subjects):
+        """按顺序查找第一个有配额的主体"""
+        for subject in subjects:
+            row = conn.execute('SELECT capacity, refill_per_hour FROM quotas WHERE subject = ?',
+                               (subject,)).fetchone()
+            if row is not None:
+                return row
+            if subject in self.defaults:
+                return self.defaults[subject]
+        return None
+
+    def charge(self, buckets, cost):
+        """从所有桶中扣除cost个令牌
+
+        buckets: [(桶的键, 依次查找配额的主体列表), ...]
+        任意一个桶不足时不扣除，抛出RateLimitExceeded；没有配额的桶不限制。
+        返回扣除后各桶剩余的令牌数。
+        """
+        conn = self._connect()
+        try:
+            # IMMEDIATE事务: 读取和更新之间其他进程不能修改
+            conn.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            updates = []
+            remaining = {}
+            for key, subjects in buckets:
+                quota = self._quota(conn, subjects)
+                if quota is None:
+                    continue
+                capacity, refill_per_hour = quota
+                row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * refill_per_hour / 3600)
+                if tokens < cost:
+                    conn.execute('ROLLBACK')
+                    if cost > capacity or refill_per_hour <= 0:
+                        retry_after = None
+                    else:
+                        retry_after = math.ceil((cost - tokens) * 3600 / refill_per_hour)
+                    raise RateLimitExceeded(subjects[0], cost, retry_after)
+                updates.append((key, tokens - cost, now))
+                remaining[key] = round(tokens - cost, 3)
+            conn.executemany('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)', updates)
+            conn.execute('COMMIT')
+            return remaining
+        finally:
+            conn.close()
+
+    def purge_idle(self, max_idle, dry_run=False):
+        """删除超过max_idle秒未使用的令牌桶，返回删除的数量
+
+        没有记录的桶按已满处理，闲置时间足以恢复到桶容量的记录删除后不影响限流；
+        恢复速度小于 容量/max_idle 的单独配额会因此提前恢复。
+        """
+        conn = self._connect()
+        try:
+            cutoff = time.time() - max_idle
+            if dry_run:
+                return conn.execute('SELECT COUNT(*) FROM buckets WHERE updated < ?', (cutoff,)).fetchone()[0]
+            return conn.execute('DELETE FROM buckets WHERE updated < ?', (cutoff,)).rowcount
+        finally:
+            conn.close()
+
+    def list_quotas(self):
+        """所有配额，包括未被修改的默认值"""
+        quotas = {subject: {'capacity': capacity, 'refill_per_hour': refill, 'default': True}
+                  for subject, (capacity, refill) in self.defaults.items()}
+        conn = self._connect()
+        try:
+            for subject, capacity, refill in conn.execute('SELECT subject, capacity, refill_per_hour FROM quotas'):
+                quotas[subject] = {'capacity': capacity, 'refill_per_hour': refill, 'default': False}
+        finally:
+            conn.close()
+        return quotas
+
+    def set_quota(self, subject, capacity, refill_per_hour):
+        """设置配额，capacity为None时删除，恢复使用默认值"""
+        conn = self._connect()
+        try:
+            if capacity is None:
+                conn.execute('DELETE FROM quotas WHERE subject = ?', (subject,))
+            else:
+                conn.execute('INSERT OR REPLACE INTO quotas (subject, capacity, refill_per_hour) VALUES (?, ?, ?)',
+                             (subject, float(capacity), float(refill_per_hour)))
+        finally:
+            conn.close()
@@ -0,0 +1,132 @@
+"""局部区域风格迁移
+
+/process 可以通过矩形区域（roi）或上传的蒙版图像（mask，白色表示需要风格化的区域）
+限制风格迁移的范围。只把区域外扩一定边距后的包围框裁剪出来交给引擎，结果通过
+羽化的蒙版贴回原图，引擎的耗时和内存与实际处理的面积成正比。
+"""
+from PIL import Image, ImageDraw, ImageFilter
+
+# 羽化半径的上限（像素），更大的半径会让高斯模糊和裁剪边距覆盖整张图
+MAX_FEATHER = 64
+
+
+class RegionPlan:
+    """一次局部风格迁移的裁剪范围和贴回使用的蒙版
+
+    box: 原图中裁剪的区域 (left, top, right, bottom)
+    mask: 与box同尺寸的羽化蒙版（L模式）
+    """
+
+    def __init__(self, box, mask):
+        self.box = box
+        self.mask = mask
+
+    @property
+    def size(self):
+        return self.box[2] - self.box[0], self.box[3] - self.box[1]
+
+
+def parse_region(data):
+    """从请求数据中解析区域参数，没有指定区域时返回None，参数错误时抛出ValueError
+
+    roi: {"x": 0, "y": 0, "width": 100, "height": 100}（原图像素）
+    mask: 通过 /upload 上传的蒙版文件名
+    invertMask: 反转区域，例如只风格化背景
+    feather: 羽化半径（像素），不超过MAX_FEATHER
+    """
+    roi = data.get('roi')
+    mask = data.get('mask')
+    if roi is None and not mask:
+        return None
+    if roi is not None and mask:
+        raise ValueError('roi和mask只能指定一个')
+
+    region = {'roi': None, 'mask': mask or None, 'invert': bool(data.get('invertMask', False)),
+              'feather': data.get('feather')}
+    if roi is not None:
+        try:
+            x, y, width, height = (int(roi[key]) for key in ('x', 'y', 'width', 'height'))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('roi需要包含整数x、y、width、height')
+        if x < 0 or y < 0 or width <= 0 or height <= 0:
+            raise ValueError('roi超出范围')
+        region['roi'] = (x, y, x + width, y + height)
+    if region['feather'] is not None:
+        try:
+            feather = int(region['feather'])
+        except (TypeError, ValueError):
+            raise ValueError('feather需要是整数')
+        if feather > MAX_FEATHER:
+            raise ValueError(f'feather不能超过{MAX_FEATHER}')
+        region['feather'] = max(0, feather)
+    return region
+
+
+def _expand(bbox, margin, size):
+    left, top, right, bottom = bbox
+    return max(0, left - margin), max(0, top - margin), min(size[0], right + margin), min(size[1], bottom + margin)
+
+
+def plan_region(image_path, region, mask_path=None, padding=16, feather=8):
+    """计算裁剪范围和羽化蒙版，区域为空时抛出ValueError
+
+    裁剪范围在区域包围框外扩 max(padding, 2*feather)，让引擎看到区域周围的内容，
+    羽化过渡也完全落在裁剪范围内。
+    """
+    with Image.open(image_path) as img:
+        image_size = img.size
+    width, height = image_size
+    if region['feather'] is not None:
+        feather = region['feather']
+    margin = max(padding, 2 * feather)
+
+    if region['roi'] is not None:
+        left, top, right, bottom = region['roi']
+        bbox = (min(left, width), min(top, height), min(right, width), min(bottom, height))
+        if bbox[0] >= bbox[2] or bbox[1] >= bbox[3]:
+            raise ValueError('roi不在图像范围内')
+        if region['invert']:
+            # 区域以外都需要处理，只能整图处理
+            box = (0, 0, width, height)
+            mask = Image.new('L', image_size, 255)
+            ImageDraw.Draw(mask).rectangle((bbox[0], bbox[1], bbox[2] - 1, bbox[3] - 1), fill=0)
+        else:
+            box = _expand(bbox, margin, image_size)
+            mask = Image.new('L', (box[2] - box[0], box[3] - box[1]), 0)
+            ImageDraw.Draw(mask).rectangle((bbox[0] - box[0], bbox[1] - box[1],
+                                            bbox[2] - box[0] - 1, bbox[3] - box[1] - 1), fill=255)
+    else:
+        with Image.open(mask_path) as img:
+            full_mask = img.convert('L')
+        if full_mask.size != image_size:
+            full_mask = full_mask.resize(image_size, Image.BILINEAR)
+        if region['invert']:
+            full_mask = full_mask.point(lambda v: 255 - v)
+        bbox = full_mask.getbbox()
+        if bbox is None:
+            raise ValueError('蒙版为空')
+        box = _expand(bbox, margin, image_size)
+        mask = full_mask.crop(box)
+
+    if feather > 0:
+        mask = mask.filter(ImageFilter.GaussianBlur(feather / 2))
+    return RegionPlan(box, mask)
+
+
+def save_crop(src_path, dst_path, plan):
+    """保存裁剪区域交给引擎处理"""
+    with Image.open(src_path) as img:
+        img.crop(plan.box).convert('RGB').save(dst_path, quality=95)
+
+
+def composite(original_path, stylized_path, output_path, plan):
+    """把风格化的裁剪区域按羽化蒙版贴回原图"""
+    with Image.open(original_path) as img:
+        base = img.convert('RGB')
+    with Image.open(stylized_path) as img:
+        stylized = img.convert('RGB')
+    if stylized.size != plan.size:
+        stylized = stylized.resize(plan.size, Image.LANCZOS)
+    base.paste(stylized, plan.box[:2], plan.mask)
+    base.save(output_path, quality=95)
+    return output_path
@@ -0,0 +1,110 @@
+import os
+import sys
+import argparse
+
+from app import media_store, get_db_connection, execute_query
+
+# 需要检查的数据库字段: (表名, 字段名)
+REFERENCE_COLUMNS = [
+    ('user_uploads', 'original_image'),
+    ('user_results', 'original_image'),
+    ('user_results', 'result_image')
+]
+
+
+def relayout_files(kind, batch_size=1000, dry_run=False):
+    """把平铺目录中的旧文件移动到分片子目录"""
+    root = media_store.root(kind)
+    if not os.path.isdir(root):
+        print(f"目录不存在，跳过: {root}")
+        return 0
+
+    moved = 0
+    batch = []
+    # 只处理根目录下的文件，分片目录中的文件已经在正确位置
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            batch.append(entry.name)
+            if len(batch) >= batch_size:
+                moved += _move_batch(kind, batch, dry_run)
+                batch = []
+    if batch:
+        moved += _move_batch(kind, batch, dry_run)
+
+    print(f"{kind}: {'需要移动' if dry_run else '已移动'} {moved} 个文件")
+    return moved
+
+
+def _move_batch(kind, names, dry_run):
+    """移动一批文件"""
+    for name in names:
+        src = media_store.legacy_path(kind, name)
+        dst = os.path.join(media_store.root(kind), media_store.relative_path(kind, name))
+        if dry_run:
+            continue
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        os.replace(src, dst)
+    print(f"  {kind}: 处理了 {len(names)} 个文件")
+    return len(names)
+
+
+def normalize_reference(value):
+    """数据库中只保存文件名，去掉旧记录中的目录前缀（如 uploads/results/）"""
+    if not value:
+        return value
+    return os.path.basename(value.replace('\\', '/'))
+
+
+def rewrite_references(batch_size=500, dry_run=False):
+    """分批把数据库中的文件引用统一为不含目录的文件名"""
+    total = 0
+    for table, column in REFERENCE_COLUMNS:
+        last_id = 0
+        updated = 0
+        while True:
+            conn = get_db_connection()
+            rows = execute_query(conn, f'''
+                SELECT id, {column} FROM {table} WHERE id > ? ORDER BY id LIMIT ?
+            ''', (last_id, batch_size), fetchall=True)
+
+            if not rows:
+                conn.close()
+                break
+
+            changes = []
+            for row in rows:
+                normalized = normalize_reference(row[column])
+                if normalized != row[column]:
+                    changes.append((normalized, row['id']))
+            last_id = rows[-1]['id']
+
+            if changes and not dry_run:
+                for normalized, row_id in changes:
+                    execute_query(conn, f'UPDATE {table} SET {column} = ? WHERE id = ?', (normalized, row_id))
+                conn.commit()
+            conn.close()
+            updated += len(changes)
+
+        print(f"{table}.{column}: {'需要更新' if dry_run else '已更新'} {updated} 条记录")
+        total += updated
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='把上传原图和结果图迁移到哈希分片目录')
+    parser.add_argument('--batch-size', type=int, default=1000, help='每批处理的文件/记录数')
+    parser.add_argument('--dry-run', action='store_true', help='只统计，不移动文件也不修改数据库')
+    args = parser.parse_args(argv)
+
+    print("==== 开始迁移媒体文件布局 ====")
+    for kind in ('originals', 'results'):
+        relayout_files(kind, args.batch_size, args.dry_run)
+    rewrite_references(args.batch_size, args.dry_run)
+    print("迁移完成，可以设置 MEDIA_LEGACY_FALLBACK=0 关闭旧目录回退")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
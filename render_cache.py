@@ -0,0 +1,132 @@
+"""风格化底图缓存
+
+把引擎以 强度1.0/内容0/不增强 生成的"底图"按 (原图内容, 风格组合) 缓存在磁盘上，
+最近使用的底图和原图同时解码保存在内存中。只调整风格强度、内容保留度和色彩增强时跳过引擎，
+只用 apply_blend() 重新混合和后处理。
+
+apply_blend() 是对引擎参数的近似: 假设引擎把风格化结果按 强度*(1-内容保留度) 与原图线性混合，
+色彩增强为固定的饱和度1.3、对比度1.1。引擎的实际实现不同时结果会改变，
+所以只在确认引擎行为一致时通过 BASE_CACHE_BLEND 开启。
+"""
+import os
+import json
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from PIL import Image, ImageEnhance
+
+# 生成底图时传给引擎的参数
+BASE_PARAMS = {'style_strength': 1.0, 'content_weight': 0.0, 'color_enhance': False}
+# 底图的缓存格式版本，改变底图的生成方式时增加
+BASE_VERSION = 1
+# 近似引擎色彩增强的饱和度和对比度系数
+ENHANCE_COLOR = 1.3
+ENHANCE_CONTRAST = 1.1
+
+
+@lru_cache(maxsize=1024)
+def _file_digest(path, size, mtime_ns):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_digest(path):
+    """文件内容的摘要，按 (路径, 大小, 修改时间) 缓存，同一文件不重复读取"""
+    st = os.stat(path)
+    return _file_digest(os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+
+def base_key(content_path, styles, weights, engine='simplified'):
+    """底图的缓存键，只与原图内容和风格组合有关"""
+    weights = [round(float(w), 4) for w in weights] if len(styles) > 1 else []
+    payload = json.dumps([BASE_VERSION, engine, file_digest(content_path), list(styles), weights])
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def apply_blend(original, base, params):
+    """按风格强度和内容保留度混合底图与原图，再做色彩增强（对引擎的近似，见模块说明）"""
+    if base.size != original.size:
+        base = base.resize(original.size, Image.LANCZOS)
+    alpha = min(max(params['style_strength'] * (1 - params['content_weight']), 0.0), 1.0)
+    result = Image.blend(original, base, alpha)
+    if params['color_enhance']:
+        result = ImageEnhance.Color(result).enhance(ENHANCE_COLOR)
+        result = ImageEnhance.Contrast(result).enhance(ENHANCE_CONTRAST)
+    return result
+
+
+def load_entry(content_path, base_path):
+    """解码原图和底图"""
+    with Image.open(content_path) as img:
+        original = img.convert('RGB')
+    with Image.open(base_path) as img:
+        base = img.convert('RGB')
+    return BaseEntry(original, base)
+
+
+class BaseEntry:
+    """已解码的原图和底图"""
+
+    def __init__(self, original, base):
+        self.original = original
+        self.base = base
+        self.nbytes = (original.width * original.height + base.width * base.height) * 3
+
+
+class BaseCache:
+    """磁盘 + 内存两级的底图缓存，内存部分按字节数做LRU淘汰"""
+
+    def __init__(self, store, kind='bases', memory_bytes=256 * 1024 * 1024):
+        self.store = store
+        self.kind = kind
+        self.memory_bytes = memory_bytes
+        self._entries = OrderedDict()
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def _remember(self, key, entry):
+        with self._lock:
+            if key in self._entries:
+                self._used -= self._entries.pop(key).nbytes
+            if entry.nbytes > self.memory_bytes:
+                return
+            self._entries[key] = entry
+            self._used += entry.nbytes
+            while self._used > self.memory_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._used -= evicted.nbytes
+
+    def get(self, key, content_path):
+        """返回缓存的底图，没有时返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        base_path = self.store.path(self.kind, f'{key}.jpg')
+        if base_path is None:
+            return None
+        # 更新修改时间，gc_media按最近使用时间淘汰
+        os.utime(base_path)
+        entry = load_entry(content_path, base_path)
+        self._remember(key, entry)
+        return entry
+
+    def put(self, key, content_path, base_path):
+        """把引擎生成的底图文件移入缓存，返回解码后的条目"""
+        path = self.store.new_path(self.kind, f'{key}.jpg')
+        shutil.move(base_path, path)
+        entry = load_entry(content_path, path)
+        self._remember(key, entry)
+        return entry
+
+    def clear_memory(self):
+        with self._lock:
+            self._entries.clear()
+            self._used = 0
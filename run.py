@@ -1,13 +1,11 @@
-import os
-from init_dirs import create_directories
-from app import app, init_db
+import sys
+from app import app, boot_app
 
 if __name__ == '__main__':
-    # 创建必要的目录
-    create_directories()
-    
-    # 初始化数据库
-    init_db()
+    # 创建目录、初始化数据库，已完成的步骤会被跳过
+    if not boot_app():
+        print("启动初始化失败，程序退出")
+        sys.exit(1)
     
     # 运行Flask应用
     print("启动Flask应用...")
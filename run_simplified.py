@@ -165,26 +165,25 @@ def create_model_placeholders():
             print(f"Created placeholder model file for {model_name}")
 
 def initialize_project():
-    """初始化项目，创建必要的目录和文件"""
+    """初始化项目，创建必要的目录和文件，已完成且没有变化的步骤会被跳过"""
+    from boot import BootStep, boot
+
     print("初始化项目...")
-    
-    try:
-        # 创建目录结构
-        create_project_directories()
-        
-        # 创建风格预览图像
-        create_all_style_previews()
-        
-        # 初始化数据库
-        init_db()
-        
-        # 创建模型占位文件
-        create_model_placeholders()
-        
-        print("项目初始化完成")
-    except Exception as e:
-        print(f"项目初始化失败: {e}")
+    style_ids = ['vangogh', 'picasso', 'ink', 'impression', 'pop']
+    steps = [
+        BootStep('project_directories', create_project_directories, sources=[create_project_directories],
+                 outputs=['static/uploads/temp', 'models/pretrained', 'templates/admin']),
+        BootStep('simple_style_previews', create_all_style_previews, sources=[create_all_style_previews],
+                 outputs=[os.path.join('static', 'img', 'styles', f'{s}.jpg') for s in style_ids]),
+        BootStep('simplified_database', init_db, sources=[init_db], outputs=['database/portrait.db']),
+        BootStep('model_placeholders', create_model_placeholders, sources=[create_model_placeholders],
+                 outputs=[f'models/pretrained/{s}.pth' for s in style_ids]),
+    ]
+
+    if not boot(steps):
+        print("项目初始化失败")
         sys.exit(1)
+    print("项目初始化完成")
 
 def run_app():
     """运行Flask应用"""
@@ -0,0 +1,197 @@
+"""按引擎分道、按用户公平分享的风格迁移任务调度
+
+不同引擎的任务耗时相差几个数量级（简化迁移不到1秒，快速迁移几十毫秒，神经风格迁移几十分钟），
+共用同一批worker时一个用户的大批量任务会阻塞所有人的预览。调度器:
+
+    - 每类引擎一条道（lane），可以限制道内同时执行的任务数（例如神经迁移只占1个名额）
+    - 道内按用户做加权公平排队（WFQ）: 每个任务的虚拟完成时间为
+          max(道的虚拟时间, 该用户上一个任务的虚拟完成时间) + 代价 / 权重
+      按虚拟完成时间从小到大执行，批量提交的任务不会挤占其他用户
+    - 为交互式的道（实时预览）预留名额，其他道最多使用 总名额 - 预留名额
+
+任务在提交它的线程中执行: run() 先排队等待名额，轮到后在当前线程调用函数，
+请求内的timing.stage等线程局部状态照常可用。每个任务的排队位置和预计开始时间可以通过
+status() 查询。
+"""
+import math
+import time
+import uuid
+import threading
+
+import metrics
+
+
+class Lane:
+    """一条调度道
+
+    limit: 道内同时执行的任务数上限，None表示只受总名额限制
+    interactive: 是否可以使用预留名额，有空闲名额时优先调度
+    """
+
+    def __init__(self, name, limit=None, interactive=False, default_duration=1.0):
+        self.name = name
+        self.limit = limit
+        self.interactive = interactive
+        self.queue = []
+        self.running = 0
+        self.virtual_time = 0.0
+        self.last_finish = {}
+        # 任务耗时的指数滑动平均，用于估计开始时间
+        self.avg_duration = default_duration
+
+
+class Job:
+    """一个排队或执行中的任务"""
+
+    def __init__(self, job_id, lane, user, finish_tag):
+        self.id = job_id
+        self.lane = lane
+        self.user = user
+        self.finish_tag = finish_tag
+        self.state = 'queued'
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.interactive_slot = False
+        self.granted = threading.Event()
+
+
+class JobScheduler:
+    """在固定数量的worker名额上调度各道的任务"""
+
+    def __init__(self, lanes, workers, reserved=1, keep_finished=300):
+        self.lanes = {lane.name: lane for lane in lanes}
+        self.workers = max(1, workers)
+        self.reserved = min(reserved, self.workers - 1)
+        self.keep_finished = keep_finished
+        self.running = 0
+        self.running_interactive = 0
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def run(self, lane_name, user, func, *args, cost=1.0, weight=1.0, job_id=None, **kwargs):
+        """排队等待名额后在当前线程执行func(*args, **kwargs)，返回其结果"""
+        job = self._submit(lane_name, user, cost, weight, job_id)
+        job.granted.wait()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._finish(job)
+
+    def _submit(self, lane_name, user, cost, weight, job_id):
+        lane = self.lanes[lane_name]
+        with self._lock:
+            start_tag = max(lane.virtual_time, lane.last_finish.get(user, 0.0))
+            finish_tag = start_tag + cost / max(weight, 1e-6)
+            lane.last_finish[user] = finish_tag
+            job = Job(job_id or uuid.uuid4().hex, lane, user, finish_tag)
+            self._jobs[job.id] = job
+            lane.queue.append(job)
+            self._dispatch()
+        return job
+
+    def _finish(self, job):
+        with self._lock:
+            lane = job.lane
+            job.state = 'done'
+            job.finished = time.time()
+            lane.running -= 1
+            self.running -= 1
+            if job.interactive_slot:
+                self.running_interactive -= 1
+            duration = job.finished - job.started
+            lane.avg_duration = 0.8 * lane.avg_duration + 0.2 * duration
+            metrics.STYLE_JOB_WAIT.observe(job.started - job.submitted, lane=lane.name)
+            # 没有排队任务的用户不再需要记录虚拟完成时间
+            if not any(queued.user == job.user for queued in lane.queue):
+                if lane.last_finish.get(job.user, 0.0) <= lane.virtual_time:
+                    lane.last_finish.pop(job.user, None)
+            self._expire()
+            self._dispatch()
+
+    def _can_start(self, lane):
+        if lane.limit is not None and lane.running >= lane.limit:
+            return False
+        if self.running >= self.workers:
+            return False
+        if lane.interactive:
+            return True
+        # 普通道不能使用为交互式道预留的名额
+        return self.running - self.running_interactive < self.workers - self.reserved
+
+    def _dispatch(self):
+        """把空闲名额分配给道内虚拟完成时间最小的任务，调用时持有锁
+
+        交互式的道优先；其他道之间选择排队最久的任务所在的道，避免长任务的道一直等待。
+        """
+        while True:
+            ready = [lane for lane in self.lanes.values() if lane.queue and self._can_start(lane)]
+            if not ready:
+                break
+            lane = min(ready, key=lambda l: (not l.interactive, min(job.submitted for job in l.queue)))
+            job = min(lane.queue, key=lambda j: j.finish_tag)
+            lane.queue.remove(job)
+            lane.virtual_time = max(lane.virtual_time, job.finish_tag)
+            lane.running += 1
+            self.running += 1
+            job.interactive_slot = lane.interactive
+            if lane.interactive:
+                self.running_interactive += 1
+            job.state = 'running'
+            job.started = time.time()
+            job.granted.set()
+        for lane in self.lanes.values():
+            self._update_depth(lane)
+
+    def _update_depth(self, lane):
+        metrics.QUEUE_DEPTH.set(len(lane.queue), lane=lane.name)
+
+    def _expire(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.state == 'done' and now - job.finished > self.keep_finished:
+                del self._jobs[job_id]
+
+    def _slots(self, lane):
+        slots = self.workers if lane.interactive else self.workers - self.reserved
+        if lane.limit is not None:
+            slots = min(slots, lane.limit)
+        return max(1, slots)
+
+    def status(self, job_id):
+        """任务的状态、排队位置和预计开始时间（秒），找不到时返回None
+
+        预计开始时间按道内前面的任务数和该道任务的平均耗时粗略估计。
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            lane = job.lane
+            info = {'id': job.id, 'lane': lane.name, 'state': job.state, 'submitted': job.submitted}
+            if job.state == 'queued':
+                ahead = sorted(lane.queue, key=lambda j: j.finish_tag).index(job)
+                slots = self._slots(lane)
+                # 排在前面的任务和正在执行的任务都要先占用名额
+                waves = math.floor((ahead + lane.running) / slots)
+                info['position'] = ahead + 1
+                info['estimated_start'] = round(waves * lane.avg_duration, 2)
+            elif job.state == 'running':
+                info['started'] = job.started
+            else:
+                info['started'] = job.started
+                info['finished'] = job.finished
+            return info
+
+    def summary(self):
+        """各道的排队和执行情况"""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'reserved': self.reserved,
+                'lanes': {
+                    name: {'queued': len(lane.queue), 'running': lane.running,
+                           'avg_duration': round(lane.avg_duration, 3)}
+                    for name, lane in self.lanes.items()
+                }
+            }
@@ -0,0 +1,139 @@
+"""相同风格迁移任务的合并执行（single-flight）
+
+分享链接被大量打开或用户连续点击时，会同时收到多个完全相同的 /process 请求。
+这里按任务键（原图内容 + 全部参数）合并:
+
+    - 同一进程内的线程: 等待第一个线程的结果（threading.Event）
+    - 不同worker进程: 通过一个小的SQLite锁表协调，第一个插入记录的进程负责计算，
+      其他进程轮询记录直到写入结果
+
+结果在完成后的share_window秒内仍可被相同的请求复用，覆盖略晚到达的重复点击。
+负责计算的进程崩溃时，记录超过stale_after秒后由等待者接管。
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+import metrics
+
+DB_FILE = os.path.join('database', 'singleflight.db')
+
+
+def job_key(*parts):
+    """由原图摘要、参数等组成的任务键"""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SingleFlight:
+    """合并相同键的并发计算"""
+
+    def __init__(self, db_file=DB_FILE, share_window=30, stale_after=600, poll_interval=0.05):
+        self.db_file = db_file
+        self.share_window = share_window
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.db_file) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+        if not self._initialized:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS flights (
+                    key TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    started REAL NOT NULL,
+                    finished REAL,
+                    result TEXT
+                )
+            ''')
+            self._initialized = True
+        return conn
+
+    def run(self, key, compute):
+        """返回 (结果, 是否复用了其他请求的结果)
+
+        compute() 返回可以JSON序列化的结果，返回None或抛出异常表示失败，失败不会被共享。
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.result is not None:
+                metrics.STYLE_JOB_DEDUP.inc(result='shared')
+                return flight.result, True
+            # 第一个线程失败，自己重新计算
+            return self.run(key, compute)
+
+        try:
+            flight.result, shared = self._run_across_processes(key, compute)
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        metrics.STYLE_JOB_DEDUP.inc(result='shared' if shared else 'computed')
+        return flight.result, shared
+
+    def _run_across_processes(self, key, compute):
+        owner = f'{os.getpid()}:{threading.get_ident()}'
+        conn = self._connect()
+        try:
+            while True:
+                now = time.time()
+                # 清理过期的记录: 结果已超过共享窗口，或计算进程长时间没有完成
+                conn.execute('DELETE FROM flights WHERE (finished IS NOT NULL AND finished < ?) '
+                             'OR (finished IS NULL AND started < ?)',
+                             (now - self.share_window, now - self.stale_after))
+                inserted = conn.execute('INSERT OR IGNORE INTO flights (key, owner, started) VALUES (?, ?, ?)',
+                                        (key, owner, now)).rowcount
+                if inserted:
+                    break
+                result = self._wait_result(conn, key)
+                if result is not None:
+                    return result, True
+                # 记录被删除（计算失败或过期），重新竞争
+        finally:
+            conn.close()
+
+        result = None
+        try:
+            result = compute()
+        finally:
+            conn = self._connect()
+            try:
+                if result is None:
+                    conn.execute('DELETE FROM flights WHERE key = ? AND owner = ?', (key, owner))
+                else:
+                    conn.execute('UPDATE flights SET finished = ?, result = ? WHERE key = ? AND owner = ?',
+                                 (time.time(), json.dumps(result), key, owner))
+            finally:
+                conn.close()
+        return result, False
+
+    def _wait_result(self, conn, key):
+        """轮询其他进程的计算结果，记录消失或计算进程超时时返回None"""
+        while True:
+            row = conn.execute('SELECT started, finished, result FROM flights WHERE key = ?', (key,)).fetchone()
+            if row is None or (row[1] is None and time.time() - row[0] > self.stale_after):
+                return None
+            if row[1] is not None:
+                return json.loads(row[2])
+            time.sleep(self.poll_interval)
@@ -0,0 +1,179 @@
+"""各风格的特性参数，供可视化接口和性能测试共用"""
+
+# 为不同风格定义特性参数 - 为每种风格设置不同的参数，确保有明显区别
+STYLE_PROPERTIES = {
+    'vangogh': {
+        'realism': 0.4,  # 真实感
+        'detail': 0.7,  # 细节保留
+        'color_fidelity': 0.5,  # 色彩保真度
+        'stylization': 0.9,  # 风格化程度
+        'optimal_style_weight': 0.75,  # 最佳风格权重
+        'optimal_content_weight': 0.45,  # 最佳内容权重
+        'balance_factor': 1.1,  # 平衡因子
+        'heatmap_variant': 1  # 热力图变体
+    },
+    'picasso': {
+        'realism': 0.3,
+        'detail': 0.5,
+        'color_fidelity': 0.6,
+        'stylization': 0.8,
+        'optimal_style_weight': 0.8,
+        'optimal_content_weight': 0.3,
+        'balance_factor': 0.9,
+        'heatmap_variant': 2
+    },
+    'ink': {
+        'realism': 0.2,
+        'detail': 0.8,
+        'color_fidelity': 0.3,
+        'stylization': 0.9,
+        'optimal_style_weight': 0.9,
+        'optimal_content_weight': 0.2,
+        'balance_factor': 1.2,
+        'heatmap_variant': 3
+    },
+    'impression': {
+        'realism': 0.5,
+        'detail': 0.6,
+        'color_fidelity': 0.8,
+        'stylization': 0.7,
+        'optimal_style_weight': 0.7,
+        'optimal_content_weight': 0.5,
+        'balance_factor': 1.0,
+        'heatmap_variant': 4
+    },
+    'pop': {
+        'realism': 0.3,
+        'detail': 0.5,
+        'color_fidelity': 0.9,
+        'stylization': 0.8,
+        'optimal_style_weight': 0.65,
+        'optimal_content_weight': 0.55,
+        'balance_factor': 0.85,
+        'heatmap_variant': 5
+    },
+    'horror': {
+        'realism': 0.4,
+        'detail': 0.8,
+        'color_fidelity': 0.4,
+        'stylization': 0.9,
+        'optimal_style_weight': 0.85,
+        'optimal_content_weight': 0.3,
+        'balance_factor': 1.15,
+        'heatmap_variant': 6
+    },
+    'candy': {
+        'realism': 0.2,
+        'detail': 0.4,
+        'color_fidelity': 0.9,
+        'stylization': 0.9,
+        'optimal_style_weight': 0.7,
+        'optimal_content_weight': 0.4,
+        'balance_factor': 0.8,
+        'heatmap_variant': 7
+    },
+    'mosaic': {
+        'realism': 0.3,
+        'detail': 0.7,
+        'color_fidelity': 0.6,
+        'stylization': 0.8,
+        'optimal_style_weight': 0.75,
+        'optimal_content_weight': 0.35,
+        'balance_factor': 1.05,
+        'heatmap_variant': 8
+    },
+    'rain-princess': {
+        'realism': 0.5,
+        'detail': 0.7,
+        'color_fidelity': 0.7,
+        'stylization': 0.8,
+        'optimal_style_weight': 0.6,
+        'optimal_content_weight': 0.6,
+        'balance_factor': 0.95,
+        'heatmap_variant': 9
+    },
+    'udnie': {
+        'realism': 0.4,
+        'detail': 0.6,
+        'color_fidelity': 0.5,
+        'stylization': 0.8,
+        'optimal_style_weight': 0.7,
+        'optimal_content_weight': 0.5,
+        'balance_factor': 1.0,
+        'heatmap_variant': 10
+    }
+}
+
+# 不同风格的特性数据（雷达图）
+STYLE_FEATURES = {
+    'vangogh': {
+        '笔触': 0.9,
+        '色彩': 0.8,
+        '纹理': 0.7,
+        '对比度': 0.8,
+        '构图': 0.6
+    },
+    'picasso': {
+        '笔触': 0.6,
+        '色彩': 0.7,
+        '纹理': 0.8,
+        '对比度': 0.9,
+        '构图': 0.7
+    },
+    'ink': {
+        '笔触': 0.8,
+        '色彩': 0.3,
+        '纹理': 0.9,
+        '对比度': 0.9,
+        '构图': 0.8
+    },
+    'impression': {
+        '笔触': 0.7,
+        '色彩': 0.9,
+        '纹理': 0.6,
+        '对比度': 0.6,
+        '构图': 0.8
+    },
+    'pop': {
+        '笔触': 0.5,
+        '色彩': 0.9,
+        '纹理': 0.5,
+        '对比度': 0.9,
+        '构图': 0.6
+    },
+    'horror': {
+        '笔触': 0.6,
+        '色彩': 0.7,
+        '纹理': 0.9,
+        '对比度': 0.9,
+        '构图': 0.7
+    },
+    'candy': {
+        '笔触': 0.5,
+        '色彩': 0.9,
+        '纹理': 0.5,
+        '对比度': 0.8,
+        '构图': 0.6
+    },
+    'mosaic': {
+        '笔触': 0.3,
+        '色彩': 0.8,
+        '纹理': 0.9,
+        '对比度': 0.7,
+        '构图': 0.6
+    },
+    'rain-princess': {
+        '笔触': 0.7,
+        '色彩': 0.7,
+        '纹理': 0.8,
+        '对比度': 0.7,
+        '构图': 0.8
+    },
+    'udnie': {
+        '笔触': 0.7,
+        '色彩': 0.6,
+        '纹理': 0.8,
+        '对比度': 0.8,
+        '构图': 0.7
+    }
+}
@@ -0,0 +1,120 @@
+"""按worker分配CPU线程
+
+多个gunicorn worker时，每个进程的torch、OpenMP/MKL和NumPy(BLAS)默认都会开启与核心数相同的
+线程，并发时相互抢占，快速迁移的延迟急剧上升。这里根据可用核心数和worker数为每个worker
+计算intra-op/inter-op线程数，并一致地设置到各运行时:
+
+    OMP/MKL/OpenBLAS等环境变量   必须在导入numpy/torch之前设置，app模块在导入时调用configure()
+    torch                        torch导入后调用apply_torch()（fast_runtime加载模型时自动调用）
+    已经导入的numpy              安装了threadpoolctl时在运行时限制BLAS线程
+    ONNX Runtime                 fast_runtime创建会话时读取当前分配
+
+可选地把每个worker绑定到独立的一组核心（仅Linux）。
+"""
+import os
+import sys
+import importlib.util
+
+# 由分配结果设置的线程数环境变量
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS',
+                   'VECLIB_MAXIMUM_THREADS')
+
+_current = None
+_torch_applied = False
+
+
+class ThreadBudget:
+    """一个worker的线程分配"""
+
+    def __init__(self, intra_op, inter_op, cores=None):
+        self.intra_op = intra_op
+        self.inter_op = inter_op
+        # 绑定的核心，None表示不绑定
+        self.cores = cores
+
+    def __repr__(self):
+        pinned = f", 绑定核心 {self.cores}" if self.cores else ''
+        return f"ThreadBudget(intra_op={self.intra_op}, inter_op={self.inter_op}{pinned})"
+
+
+def available_cores():
+    """当前进程可以使用的核心，考虑容器/taskset的限制"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_budget(workers, cores=None, worker_index=None, inter_op=1):
+    """把核心平均分给workers个worker
+
+    给出worker_index时返回的分配包含该worker独占的核心，可用于绑定。
+    核心数少于worker数时每个worker使用1个线程，不绑定核心。
+    """
+    cores = cores if cores is not None else available_cores()
+    workers = max(1, workers)
+    intra_op = max(1, len(cores) // workers)
+    pinned = None
+    if worker_index is not None and len(cores) >= workers:
+        start = (worker_index % workers) * intra_op
+        pinned = cores[start:start + intra_op]
+    return ThreadBudget(intra_op, inter_op, pinned)
+
+
+def apply_env(budget):
+    """设置OpenMP/MKL/BLAS的线程数环境变量，对之后才初始化的运行时生效"""
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(budget.intra_op)
+
+
+def apply_numpy(budget):
+    """numpy已经导入时，通过threadpoolctl限制已加载的BLAS/OpenMP线程池"""
+    if 'numpy' not in sys.modules or importlib.util.find_spec('threadpoolctl') is None:
+        return False
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(budget.intra_op)
+    return True
+
+
+def apply_torch(budget=None):
+    """设置torch的线程数，torch未导入时不做任何事"""
+    global _torch_applied
+    budget = budget or _current
+    if budget is None or _torch_applied or 'torch' not in sys.modules:
+        return False
+    import torch
+    torch.set_num_threads(budget.intra_op)
+    try:
+        torch.set_num_interop_threads(budget.inter_op)
+    except RuntimeError:
+        # inter-op线程池已经启动后不能再修改
+        print("torch的inter-op线程池已启动，保持原有设置")
+    _torch_applied = True
+    return True
+
+
+def pin(budget):
+    """把当前进程绑定到分配的核心"""
+    if not budget.cores or not hasattr(os, 'sched_setaffinity'):
+        return False
+    os.sched_setaffinity(0, budget.cores)
+    return True
+
+
+def configure(workers, worker_index=None, pin_cores=False, inter_op=1):
+    """为当前worker分配线程并应用到所有运行时，返回分配结果"""
+    global _current, _torch_applied
+    budget = plan_budget(workers, worker_index=worker_index if pin_cores else None, inter_op=inter_op)
+    apply_env(budget)
+    apply_numpy(budget)
+    if pin_cores:
+        pin(budget)
+    _current = budget
+    _torch_applied = False
+    apply_torch(budget)
+    print(f"线程分配: {workers} 个worker，{budget}")
+    return budget
+
+
+def current():
+    """当前进程的线程分配，没有配置时返回None"""
+    return _current
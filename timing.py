@@ -0,0 +1,106 @@
+"""请求内分阶段计时，结果通过Server-Timing响应头返回并输出结构化日志
+
+引擎代码可以直接使用:
+
+    from timing import stage
+    with stage('resize'):
+        ...
+
+不在请求中（例如命令行脚本、后台线程）调用时stage不做任何事。
+"""
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+class StageTimer:
+    """记录一个请求中各阶段的耗时"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = []
+
+    def add(self, name, seconds):
+        self.stages.append((name, seconds))
+
+    @contextmanager
+    def stage(self, name):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - begin)
+
+    def total(self):
+        return time.perf_counter() - self.start
+
+    def as_dict(self):
+        """同名阶段（例如多次encode）合并累加，单位毫秒"""
+        result = {}
+        for name, seconds in self.stages:
+            result[name] = result.get(name, 0.0) + seconds * 1000
+        return {name: round(ms, 3) for name, ms in result.items()}
+
+    def header(self):
+        """生成Server-Timing响应头"""
+        parts = [f'{_token(name)};dur={ms:.2f}' for name, ms in self.as_dict().items()]
+        parts.append(f'total;dur={self.total() * 1000:.2f}')
+        return ', '.join(parts)
+
+
+def _token(name):
+    """Server-Timing的指标名只能包含token字符"""
+    return ''.join(c if c.isalnum() or c in '-_.+' else '_' for c in name)
+
+
+def start_timer():
+    """为当前线程开始新的计时"""
+    _local.timer = StageTimer()
+    return _local.timer
+
+
+def current_timer():
+    return getattr(_local, 'timer', None)
+
+
+def stop_timer():
+    timer = current_timer()
+    _local.timer = None
+    return timer
+
+
+@contextmanager
+def stage(name):
+    """记录一个阶段，没有进行中的计时时不做任何事"""
+    timer = current_timer()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def init_app(app):
+    """为每个请求开始计时，有阶段数据时返回Server-Timing并输出日志"""
+    from flask import request
+
+    @app.before_request
+    def _timing_start():
+        start_timer()
+
+    @app.after_request
+    def _timing_finish(response):
+        timer = stop_timer()
+        if timer is not None and timer.stages:
+            response.headers['Server-Timing'] = timer.header()
+            print(json.dumps({
+                'event': 'stage_timing',
+                'endpoint': request.endpoint,
+                'status': response.status_code,
+                'total_ms': round(timer.total() * 1000, 3),
+                'stages': timer.as_dict()
+            }, ensure_ascii=False))
+        return response
@@ -0,0 +1,197 @@
+import os
+import uuid
+import importlib.util
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# numpy、PIL和imageio在实际处理视频时才导入，app启动时只需要扩展名判断
+IMAGEIO_AVAILABLE = importlib.util.find_spec('imageio') is not None
+FFMPEG_AVAILABLE = IMAGEIO_AVAILABLE and importlib.util.find_spec('imageio_ffmpeg') is not None
+
+# 支持的动图/视频格式，除GIF外都需要imageio(及imageio-ffmpeg)
+VIDEO_EXTENSIONS = {'gif', 'mp4', 'webm', 'mov', 'avi'}
+# 当前环境实际能处理的格式，没有安装imageio-ffmpeg时只接受GIF
+SUPPORTED_VIDEO_EXTENSIONS = VIDEO_EXTENSIONS if FFMPEG_AVAILABLE else {'gif'}
+
+
+def is_video_file(filename):
+    """是否为动图或视频文件"""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in VIDEO_EXTENSIONS
+
+
+def is_gif(filename):
+    return filename.lower().endswith('.gif')
+
+
+def is_supported_video(filename):
+    """当前环境是否能处理该动图或视频"""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in SUPPORTED_VIDEO_EXTENSIONS
+
+
+def iter_frames(path):
+    """逐帧读取动图或视频，产出 (RGB图像, 帧时长毫秒)，不会一次性载入整个文件"""
+    from PIL import Image, ImageSequence
+
+    if is_gif(path):
+        with Image.open(path) as img:
+            for frame in ImageSequence.Iterator(img):
+                yield frame.convert('RGB'), frame.info.get('duration', 100)
+        return
+
+    if not IMAGEIO_AVAILABLE:
+        raise RuntimeError('处理视频需要安装imageio和imageio-ffmpeg')
+
+    import imageio
+    import numpy as np
+
+    reader = imageio.get_reader(path)
+    try:
+        fps = reader.get_meta_data().get('fps', 25) or 25
+        for frame in reader:
+            yield Image.fromarray(np.asarray(frame)).convert('RGB'), 1000.0 / fps
+    finally:
+        reader.close()
+
+
+def probe_video(path):
+    """读取动图或视频的尺寸和帧数，无法得到帧数时返回None"""
+    from PIL import Image
+
+    if is_gif(path):
+        with Image.open(path) as img:
+            return img.size, getattr(img, 'n_frames', 1)
+
+    if not IMAGEIO_AVAILABLE:
+        raise RuntimeError('处理视频需要安装imageio和imageio-ffmpeg')
+
+    import imageio
+
+    reader = imageio.get_reader(path)
+    try:
+        meta = reader.get_meta_data()
+        size = tuple(meta.get('size') or reader.get_data(0).shape[1::-1])
+        frames = meta.get('nframes')
+        if not isinstance(frames, int) or frames <= 0:
+            frames = round(meta['duration'] * meta['fps']) if meta.get('duration') and meta.get('fps') else None
+        return size, frames
+    finally:
+        reader.close()
+
+
+class FrameWriter:
+    """按顺序以流的方式写出处理后的帧
+
+    视频用imageio编码（固定帧率）；GIF用PIL的逐帧编码接口直接追加到打开的文件，
+    每帧带自己的调色板和时长。两种格式都不会在内存中保留已写出的帧。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.gif = is_gif(path)
+        self.writer = None
+        self.file = None
+
+    def write(self, img, duration):
+        if self.gif:
+            self._write_gif_frame(img, duration)
+            return
+
+        import imageio
+        import numpy as np
+
+        if self.writer is None:
+            self.writer = imageio.get_writer(self.path, fps=1000.0 / duration, macro_block_size=1)
+        self.writer.append_data(np.asarray(img))
+
+    def _write_gif_frame(self, img, duration):
+        from PIL import Image, GifImagePlugin
+
+        frame = img.convert('P', palette=Image.ADAPTIVE)
+        if self.file is None:
+            self.file = open(self.path, 'wb')
+            header, _ = GifImagePlugin.getheader(frame, info={'loop': 0})
+            for chunk in header:
+                self.file.write(chunk)
+        for chunk in GifImagePlugin.getdata(frame, duration=int(duration), include_color_table=True):
+            self.file.write(chunk)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.file is not None:
+            self.file.write(b';')  # GIF结束标记
+            self.file.close()
+            self.file = None
+
+
+def frame_signature(img, size=64):
+    """用于判断相邻帧是否几乎相同的缩略灰度图"""
+    import numpy as np
+    from PIL import Image
+
+    return np.asarray(img.convert('L').resize((size, size), Image.BILINEAR), dtype=np.float32)
+
+
+def stylize_video(src_path, dst_path, stylize, temp_dir, workers=4, window=8, diff_threshold=2.0,
+                  max_frames=600):
+    """对动图或视频逐帧做风格迁移
+
+    stylize(帧路径) -> 结果图像（PIL），由调用方决定使用哪种风格与参数。每帧先保存为
+    temp_dir下的PNG交给stylize，处理完立即删除；结果图像直接交给编码器，不另外写入磁盘。
+    帧在线程池中并行处理，同时最多保留window帧在内存中；与上一个关键帧
+    平均灰度差小于diff_threshold的帧直接复用上一帧的处理结果。
+    返回统计信息。
+    """
+    import numpy as np
+    from PIL import Image
+
+    os.makedirs(temp_dir, exist_ok=True)
+    stats = {'frames': 0, 'stylized': 0, 'reused': 0}
+
+    def run(frame):
+        frame_path = os.path.join(temp_dir, f"frame_{uuid.uuid4()}.png")
+        frame.save(frame_path)
+        try:
+            result = stylize(frame_path)
+        finally:
+            os.remove(frame_path)
+        if result.size != frame.size:
+            result = result.resize(frame.size)
+        return result.convert('RGB')
+
+    writer = FrameWriter(dst_path)
+    pending = deque()
+    last_signature = None
+    last_future = None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            for index, (frame, duration) in enumerate(iter_frames(src_path)):
+                if index >= max_frames:
+                    break
+
+                signature = frame_signature(frame)
+                if last_future is not None and np.mean(np.abs(signature - last_signature)) < diff_threshold:
+                    future = last_future
+                    stats['reused'] += 1
+                else:
+                    future = pool.submit(run, frame)
+                    last_future, last_signature = future, signature
+                    stats['stylized'] += 1
+
+                pending.append((future, duration))
+                stats['frames'] += 1
+
+                # 滑动窗口已满时先按顺序写出最早的帧
+                while len(pending) >= window:
+                    done_future, done_duration = pending.popleft()
+                    writer.write(done_future.result(), done_duration)
+
+            while pending:
+                done_future, done_duration = pending.popleft()
+                writer.write(done_future.result(), done_duration)
+        finally:
+            writer.close()
+
+    return stats
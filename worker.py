@@ -0,0 +1,146 @@
+"""独立的风格迁移worker进程
+
+从应用数据库中的任务队列（job_queue.py）领取任务并执行，与Web进程分别部署和扩容，
+多台机器共享数据库和 static/uploads 存储即可。执行期间定期续约，崩溃后租约过期的任务
+会被其他worker重新领取，神经风格迁移从最后一个检查点继续。
+收到SIGTERM/SIGINT后不再领取新任务: 神经风格迁移在下一次迭代后保存检查点并交还队列，
+由其他worker继续；其他任务执行完成后退出。
+
+用法:
+    python worker.py                       # 处理所有道的任务，1个并发
+    python worker.py --lanes neural --concurrency 1
+    python worker.py --concurrency 4 --poll 0.5
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+import threading
+
+from app import app, style_job_queue, QUEUED_JOB_HANDLERS, boot_app
+from job_queue import JobControl, JobInterrupted
+
+_stop = threading.Event()
+
+
+def heartbeat(queue, job, control, interval, done):
+    """定期续约，租约丢失时通知处理函数停止，之后提交的结果会被忽略"""
+    while not done.wait(interval):
+        try:
+            if not queue.heartbeat(job):
+                print(f"任务 {job.id} 的租约已丢失，停止执行")
+                control.lost.set()
+                return
+        except Exception as e:
+            print(f"任务 {job.id} 续约失败: {e}")
+
+
+def execute(queue, job):
+    handler = QUEUED_JOB_HANDLERS.get(job.kind)
+    if handler is None:
+        queue.fail(job, f'未知的任务类型: {job.kind}')
+        return
+
+    control = JobControl(stopping=_stop, on_progress=lambda: queue.reset_attempts(job))
+    done = threading.Event()
+    beat = threading.Thread(target=heartbeat, args=(queue, job, control, max(1, queue.lease_seconds / 3), done),
+                            daemon=True)
+    beat.start()
+    start = time.perf_counter()
+    try:
+        with app.app_context():
+            result = handler(job.payload, job.id, control)
+    except JobInterrupted as e:
+        if control.lost.is_set():
+            print(f"任务 {job.id} 已中断: {e}")
+        else:
+            # 进度已经保存，交还任务由其他worker继续，不计入尝试次数
+            print(f"任务 {job.id} 已保存进度并交还队列: {e}")
+            queue.release(job)
+    except Exception as e:
+        if control.lost.is_set():
+            # 任务已由其他worker接管，不能再修改它的状态
+            print(f"任务 {job.id} 已中断: {e}")
+        else:
+            print(f"任务 {job.id} 失败（第{job.attempts}次）: {e}")
+            queue.fail(job, str(e))
+    else:
+        queue.complete(job, result)
+        print(f"任务 {job.id} 完成，耗时 {time.perf_counter() - start:.2f}秒")
+    finally:
+        done.set()
+        beat.join()
+
+
+def purge(queue, keep_hours):
+    """删除完成超过keep_hours小时的任务记录"""
+    try:
+        removed = queue.purge(keep_hours * 3600)
+        if removed:
+            print(f"清理了 {removed} 条已完成的任务记录")
+    except Exception as e:
+        print(f"清理任务记录失败: {e}")
+
+
+def run_loop(queue, worker_id, lanes, poll, keep_hours=None):
+    last_purge = 0
+    while not _stop.is_set():
+        try:
+            job = queue.claim(worker_id, lanes)
+        except Exception as e:
+            print(f"领取任务失败: {e}")
+            job = None
+        if job is None:
+            # 空闲时每小时清理一次旧的任务记录
+            if keep_hours and time.time() - last_purge > 3600:
+                purge(queue, keep_hours)
+                last_purge = time.time()
+            _stop.wait(poll)
+            continue
+        if _stop.is_set():
+            queue.release(job)
+            break
+        execute(queue, job)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='从任务队列领取并执行风格迁移任务')
+    parser.add_argument('--lanes', default='', help='只处理这些道的任务，逗号分隔，默认全部')
+    parser.add_argument('--concurrency', type=int, default=1, help='同时执行的任务数')
+    parser.add_argument('--poll', type=float, default=1.0, help='队列为空时的轮询间隔（秒）')
+    parser.add_argument('--keep-hours', type=float, default=7 * 24, help='已完成的任务记录保留的小时数，0表示不清理')
+    args = parser.parse_args(argv)
+
+    if not boot_app():
+        print("启动初始化失败，worker退出")
+        return 1
+
+    lanes = [lane.strip() for lane in args.lanes.split(',') if lane.strip()] or None
+    base_id = f'{socket.gethostname()}:{os.getpid()}'
+
+    def stop(signum, frame):
+        print("收到退出信号，保存进度或等待当前任务完成")
+        _stop.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f"worker {base_id} 启动，道: {lanes or '全部'}，并发: {args.concurrency}")
+    # 只由第一个线程清理旧记录
+    threads = [threading.Thread(target=run_loop, args=(style_job_queue, f'{base_id}:{index}', lanes, args.poll,
+                                                       args.keep_hours if index == 0 else None))
+               for index in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    # 主线程需要保持可中断，才能处理信号
+    while any(thread.is_alive() for thread in threads):
+        for thread in threads:
+            thread.join(0.5)
+    print(f"worker {base_id} 已退出")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())